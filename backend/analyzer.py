@@ -1,7 +1,8 @@
 import pandas as pd
 import numpy as np
-from typing import Dict, List, Tuple
+from typing import Dict, Tuple
 from datetime import datetime, timedelta
+from price_series import as_price_series
 
 class InvestmentAnalyzer:
     def __init__(self):
@@ -39,21 +40,17 @@ class InvestmentAnalyzer:
         
         return ema
     
-    def calculate_technical_indicators(self, price_data: List[Dict]) -> Dict:
-        """計算技術指標"""
-        if not price_data or len(price_data) < 20:
+    def calculate_technical_indicators(self, price_data) -> Dict:
+        """計算技術指標（price_data 為 PriceSeries，也接受記錄列表）"""
+        prices = as_price_series(price_data)
+        if len(prices) < 20:
             return {}
         
-        # 轉換為DataFrame
-        df = pd.DataFrame(price_data)
-        df['date'] = pd.to_datetime(df['date'])
-        df = df.sort_values('date')
-        
         # 提取價格數據
-        close_prices = df['close'].values
-        high_prices = df['high'].values
-        low_prices = df['low'].values
-        volume = df['volume'].values
+        close_prices = prices.close
+        high_prices = prices.high
+        low_prices = prices.low
+        volume = prices.volume
         
         try:
             indicators = {}
@@ -255,7 +252,7 @@ class InvestmentAnalyzer:
             print(f"Error in fundamental analysis: {e}")
             return {'total_score': 25, 'raw_score': 25}  # 返回中等評分而不是0
     
-    def analyze_technical(self, indicators: Dict, price_data: List[Dict]) -> Dict:
+    def analyze_technical(self, indicators: Dict, price_data) -> Dict:
         """技術面分析"""
         technical_score = 0
         analysis = {}
@@ -264,7 +261,7 @@ class InvestmentAnalyzer:
             # 獲取當前價格
             current_price = 0
             if price_data and len(price_data) > 0:
-                current_price = price_data[-1].get('close', 0)
+                current_price = as_price_series(price_data).last_close
             else:
                 # 如果沒有價格數據，使用默認值
                 current_price = 100  # 默認價格
@@ -374,28 +371,24 @@ class InvestmentAnalyzer:
             print(f"Error in technical analysis: {e}")
             return {'total_score': 0, 'raw_score': 0}
     
-    def calculate_risk_metrics(self, price_data: List[Dict]) -> Dict:
-        """計算風險指標"""
-        if not price_data or len(price_data) < 30:
+    def calculate_risk_metrics(self, price_data) -> Dict:
+        """計算風險指標（price_data 為 PriceSeries，也接受記錄列表）"""
+        prices = as_price_series(price_data)
+        if len(prices) < 30:
             return {}
         
         try:
-            df = pd.DataFrame(price_data)
-            df['date'] = pd.to_datetime(df['date'])
-            df = df.sort_values('date')
-            
             # 計算日收益率
-            df['returns'] = df['close'].pct_change()
-            returns = df['returns'].dropna()
+            returns = pd.Series(prices.close).pct_change().dropna()
             
             # 波動率 (年化)
             volatility = returns.std() * np.sqrt(252)
             
             # 最大回撤
-            df['cumulative'] = (1 + returns).cumprod()
-            df['running_max'] = df['cumulative'].expanding().max()
-            df['drawdown'] = (df['cumulative'] - df['running_max']) / df['running_max']
-            max_drawdown = df['drawdown'].min()
+            cumulative = (1 + returns).cumprod()
+            running_max = cumulative.expanding().max()
+            drawdown = (cumulative - running_max) / running_max
+            max_drawdown = drawdown.min()
             
             # VaR (Value at Risk) 95%
             var_95 = np.percentile(returns, 5)
@@ -573,6 +566,9 @@ class InvestmentAnalyzer:
             print(f"Analyzing {symbol}...")
             print(f"Stock info keys: {list(stock_info.keys())}")
             
+            # 價格數據只轉換一次，下面各項分析共用
+            price_data = as_price_series(price_data)
+            
             # 計算技術指標
             technical_indicators = self.calculate_technical_indicators(price_data)
             
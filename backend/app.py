@@ -3,14 +3,32 @@ from flask_cors import CORS
 import os
 from datetime import datetime
 import json
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response
 from flask_cors import CORS
 from data_collector import DataCollector
 from analyzer import InvestmentAnalyzer
 from simple_report_generator import SimpleReportGenerator
 from cache_manager import cache_manager
+from rate_limiter import rate_limiter
+from price_series import PriceSeries
+from flask.json.provider import DefaultJSONProvider
+import numpy as np
+
+class AppJSONProvider(DefaultJSONProvider):
+    """API響應的JSON序列化：PriceSeries 在這裡才轉換為記錄列表，NumPy 數值轉換為Python數值"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, PriceSeries):
+            return o.to_records()
+        if isinstance(o, np.generic):
+            return o.item()
+        if isinstance(o, np.ndarray):
+            return o.tolist()
+        return DefaultJSONProvider.default(o)
 
 app = Flask(__name__, static_folder='../frontend', static_url_path='')
+app.json = AppJSONProvider(app)
 CORS(app)
 
 # 初始化組件
@@ -18,59 +36,108 @@ collector = DataCollector()
 analyzer = InvestmentAnalyzer()
 report_generator = SimpleReportGenerator()
 
+# 熱重啟：啟動時從快照恢復緩存，退出時和定期保存（CACHE_SNAPSHOT_PATH / CACHE_SNAPSHOT_INTERVAL）
+cache_manager.enable_snapshots()
+
 # 設置環境變量
 app.config['FLASK_ENV'] = os.getenv('FLASK_ENV', 'development')
 
+@app.before_request
+def _start_pacing_measurement():
+    """每個請求開始時重置限速等待計時"""
+    rate_limiter.begin_request()
+
+@app.after_request
+def _report_pacing_latency(response):
+    """在響應頭報告本次請求因數據源限速而增加的延遲"""
+    waited_ms = rate_limiter.request_wait() * 1000
+    response.headers['Server-Timing'] = f'pacing;dur={waited_ms:.1f};desc="rate limiter wait"'
+    if waited_ms >= 1:
+        print(f"⏳ {request.path} waited {waited_ms:.0f}ms for rate limiter")
+    return response
+
 @app.route('/')
 def index():
     return app.send_static_file('index.html')
 
-@app.route('/api/stock/<symbol>')
-def get_stock_data(symbol):
-    """獲取股票數據"""
+def _build_stock_analysis(symbol):
+    """獲取數據並分析股票（未命中緩存時調用）"""
+    # 強制使用智能數據獲取器
     try:
-        # 檢查緩存
-        cached_data = cache_manager.get('analysis_result', symbol)
-        if cached_data:
-            print(f"📦 Using cached analysis for {symbol}")
-            return jsonify(cached_data)
+        print(f"🔍 Fetching data for {symbol} using smart fetcher...")
+        from smart_data_fetcher import smart_fetcher
         
-        # 強制使用智能數據獲取器
-        try:
-            print(f"🔍 Fetching data for {symbol} using smart fetcher...")
-            from smart_data_fetcher import smart_fetcher
-            
-            # 直接使用智能數據獲取器
-            success, raw_data = smart_fetcher.fetch_stock_data(symbol)
-            if success:
-                # 轉換數據格式
-                stock_info = collector._convert_smart_fetcher_data(symbol, raw_data)
-                print(f"✅ Smart fetcher success for {symbol}: {stock_info.get('name', 'Unknown')}")
-            else:
-                print(f"❌ Smart fetcher failed for {symbol}, using fallback")
-                stock_info = collector.get_stock_info_async(symbol)
-            
-            # 獲取價格數據
-            price_data = collector.get_stock_prices(symbol, "5d")
+        # 直接使用智能數據獲取器
+        success, raw_data = smart_fetcher.fetch_stock_data(symbol)
+        if success:
+            # 轉換數據格式
+            stock_info = collector._convert_smart_fetcher_data(symbol, raw_data)
+            print(f"✅ Smart fetcher success for {symbol}: {stock_info.get('name', 'Unknown')}")
+        else:
+            print(f"❌ Smart fetcher failed for {symbol}, using fallback")
+            stock_info = collector.get_stock_info_async(symbol)
+        
+        # 獲取價格數據（PriceSeries，分析器直接使用）
+        price_data = collector.get_stock_prices(symbol, "5d")
+        
+        # 構建完整的數據結構
+        data = {
+            'symbol': symbol,
+            'stock_info': stock_info,
+            'price_data': price_data,
+            'financial_data': {}
+        }
+    except Exception as multi_error:
+        print(f"Smart fetcher failed for {symbol}: {multi_error}, falling back to sync")
+        data = collector.collect_all_data(symbol)
+    
+    # 分析數據
+    analysis_result = analyzer.analyze_stock(data)
+    print(f"💾 Caching analysis result for {symbol}")
+    return analysis_result
+
+def _build_stock_report(symbol):
+    """獲取數據並生成報告HTML（未命中緩存時調用）"""
+    # 強制使用智能數據獲取器獲取數據
+    try:
+        print(f"🔍 Fetching data for report {symbol} using smart fetcher...")
+        from smart_data_fetcher import smart_fetcher
+        
+        # 直接使用智能數據獲取器
+        success, raw_data = smart_fetcher.fetch_stock_data(symbol)
+        if success:
+            # 轉換數據格式
+            stock_info = collector._convert_smart_fetcher_data(symbol, raw_data)
+            print(f"✅ Smart fetcher success for report {symbol}: {stock_info.get('name', 'Unknown')}")
             
-            # 構建完整的數據結構
+            # 構建數據結構
             data = {
                 'symbol': symbol,
                 'stock_info': stock_info,
-                'price_data': price_data,
+                'price_data': [],
                 'financial_data': {}
             }
-        except Exception as multi_error:
-            print(f"Smart fetcher failed for {symbol}: {multi_error}, falling back to sync")
+        else:
+            print(f"❌ Smart fetcher failed for report {symbol}, using fallback")
             data = collector.collect_all_data(symbol)
-        
-        # 分析數據
-        analysis_result = analyzer.analyze_stock(data)
-        
-        # 緩存分析結果
-        cache_manager.set('analysis_result', symbol, analysis_result)
-        print(f"💾 Cached analysis result for {symbol}")
-        
+    except Exception as e:
+        print(f"Smart fetcher failed for report {symbol}: {e}, using fallback")
+        data = collector.collect_all_data(symbol)
+    
+    # 生成報告
+    report_html = report_generator.generate_simple_html_report(data)
+    print(f"💾 Caching report for {symbol}")
+    return report_html
+
+@app.route('/api/stock/<symbol>')
+def get_stock_data(symbol):
+    """獲取股票數據"""
+    try:
+        # 緩存未命中時只有一個請求執行獲取和分析，其他並發請求等待其結果
+        analysis_result = cache_manager.get_or_compute(
+            'analysis_result', symbol, lambda: _build_stock_analysis(symbol),
+            tags=[f"symbol:{symbol}"]
+        )
         return jsonify(analysis_result)
         
     except Exception as e:
@@ -81,51 +148,41 @@ def get_stock_data(symbol):
 def generate_report(symbol):
     """生成股票分析報告"""
     try:
-        # 檢查緩存
-        cached_report = cache_manager.get('analysis_result', f"{symbol}_report")
-        if cached_report:
-            print(f"📦 Using cached report for {symbol}")
-            return cached_report
-        
-        # 強制使用智能數據獲取器獲取數據
-        try:
-            print(f"🔍 Fetching data for report {symbol} using smart fetcher...")
-            from smart_data_fetcher import smart_fetcher
-            
-            # 直接使用智能數據獲取器
-            success, raw_data = smart_fetcher.fetch_stock_data(symbol)
-            if success:
-                # 轉換數據格式
-                stock_info = collector._convert_smart_fetcher_data(symbol, raw_data)
-                print(f"✅ Smart fetcher success for report {symbol}: {stock_info.get('name', 'Unknown')}")
-                
-                # 構建數據結構
-                data = {
-                    'symbol': symbol,
-                    'stock_info': stock_info,
-                    'price_data': [],
-                    'financial_data': {}
-                }
-            else:
-                print(f"❌ Smart fetcher failed for report {symbol}, using fallback")
-                data = collector.collect_all_data(symbol)
-        except Exception as e:
-            print(f"Smart fetcher failed for report {symbol}: {e}, using fallback")
-            data = collector.collect_all_data(symbol)
-        
-        # 生成報告
-        report_html = report_generator.generate_simple_html_report(data)
-        
-        # 緩存報告
-        cache_manager.set('analysis_result', f"{symbol}_report", report_html)
-        print(f"💾 Cached report for {symbol}")
-        
+        report_html = cache_manager.get_or_compute(
+            'analysis_result', f"{symbol}_report", lambda: _build_stock_report(symbol),
+            tags=[f"symbol:{symbol}", 'kind:report']
+        )
         return report_html
         
     except Exception as e:
         print(f"Error generating report for {symbol}: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/stock/<symbol>/prices')
+def get_stock_price_history(symbol):
+    """獲取股價歷史數據，例如 /api/stock/0700.HK/prices?period=1y"""
+    try:
+        return jsonify({'symbol': symbol, 'prices': collector.get_stock_prices(symbol, request.args.get('period', '1y'))})
+
+    except Exception as e:
+        print(f"Error fetching price history for {symbol}: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/stocks')
+def get_stocks_batch():
+    """批量獲取股票信息，例如 /api/stocks?symbols=0700.HK,0005.HK"""
+    try:
+        symbols = [s.strip() for s in request.args.get('symbols', '').split(',') if s.strip()]
+        if not symbols:
+            return jsonify({'error': 'symbols parameter is required'}), 400
+        if not collector.multi_source:
+            return jsonify({symbol: collector.get_stock_info(symbol) for symbol in symbols})
+        return jsonify(collector.multi_source.get_stock_info_many(symbols))
+
+    except Exception as e:
+        print(f"Error fetching batch stock info: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/market/sectors')
 def get_market_sectors():
     """獲取市場板塊數據"""
@@ -167,10 +224,24 @@ def get_cache_stats():
     """獲取緩存統計信息"""
     try:
         stats = cache_manager.get_stats()
+        # SmartDataFetcher 的兩級（內存L1 + 文件L2）緩存統計
+        from smart_data_fetcher import smart_fetcher
+        stats['smart_fetcher'] = smart_fetcher.get_cache_stats()
+        # 增量價格歷史（全量/增量下載次數、復權重新下載次數）
+        from price_history_store import price_history_store
+        stats['price_history'] = price_history_store.get_stats()
         return jsonify(stats)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/cache/metrics')
+def get_cache_metrics():
+    """以Prometheus文本格式導出緩存指標"""
+    try:
+        return Response(cache_manager.get_prometheus_metrics(), mimetype='text/plain; version=0.0.4')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/cache/info')
 def get_cache_info():
     """獲取緩存詳細信息"""
@@ -195,12 +266,57 @@ def clear_cache():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/cache/snapshot', methods=['POST'])
+def snapshot_cache():
+    """手動保存緩存快照"""
+    try:
+        return jsonify(cache_manager.snapshot())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/cache/restore', methods=['POST'])
+def restore_cache():
+    """手動從快照恢復緩存"""
+    try:
+        return jsonify(cache_manager.restore())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/cache/compact', methods=['POST'])
+def compact_cache():
+    """壓縮持久緩存存儲"""
+    try:
+        from smart_data_fetcher import smart_fetcher
+        result = {'smart_fetcher': smart_fetcher.compact_cache()}
+        # 使用內存後端時只清理過期條目；SQLite後端若與 smart_fetcher 共用同一文件則無需重複壓縮
+        if getattr(cache_manager.backend, 'path', None) != smart_fetcher.store_path:
+            result['cache_manager'] = cache_manager.compact()
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/cache/invalidate/<symbol>', methods=['POST'])
 def invalidate_stock_cache(symbol):
     """失效特定股票的緩存"""
     try:
-        cache_manager.invalidate_stock_data(symbol)
-        return jsonify({'message': f'Invalidated cache for {symbol}'})
+        deleted = cache_manager.invalidate_stock_data(symbol)
+        return jsonify({'message': f'Invalidated cache for {symbol}', 'deleted': deleted})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/cache/invalidate', methods=['POST'])
+def invalidate_cache():
+    """按標籤（如 symbol:0700.HK、period:1y、source:fallback）或鍵前綴失效緩存"""
+    try:
+        data = request.json or {}
+        cache_type = data.get('type')
+        if data.get('tag'):
+            deleted = cache_manager.invalidate_tag(data['tag'], cache_type)
+        elif data.get('prefix') and cache_type:
+            deleted = cache_manager.invalidate_prefix(cache_type, data['prefix'])
+        else:
+            return jsonify({'error': 'tag, or type and prefix, are required'}), 400
+        return jsonify({'deleted': deleted})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -220,6 +336,42 @@ def set_cache_ttl():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/cache/stale', methods=['POST'])
+def set_cache_stale_ttl():
+    """設置緩存過期後仍可提供舊數據的時間窗口"""
+    try:
+        data = request.json
+        cache_type = data.get('type')
+        hours = data.get('hours', 0)
+        
+        from datetime import timedelta
+        cache_manager.set_stale_ttl(cache_type, timedelta(hours=hours))
+        
+        return jsonify({'message': f'Set stale window for {cache_type} to {hours} hours'})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/cache/limits', methods=['POST'])
+def set_cache_limits():
+    """設置緩存容量上限"""
+    try:
+        data = request.json
+        cache_type = data.get('type')
+        if not cache_type:
+            return jsonify({'error': 'Cache type is required'}), 400
+
+        max_entries = data.get('max_entries')
+        max_mb = data.get('max_mb')
+        max_bytes = int(float(max_mb) * 1024 * 1024) if max_mb is not None else None
+        cache_manager.set_limits(cache_type, max_entries=max_entries, max_bytes=max_bytes)
+
+        return jsonify({
+            'message': f'Set limits for {cache_type}',
+            'limits': cache_manager.get_cache_info()['limits'].get(cache_type)
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/watchlist')
 def get_watchlist():
     """獲取監控列表"""
@@ -239,6 +391,38 @@ def get_watchlist():
         print(f"Error reading watchlist: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/watchlist/prices')
+def get_watchlist_prices():
+    """刷新觀察清單的最新價格（所有股票合併為一次批量下載）"""
+    try:
+        watchlist = []
+        watchlist_file = 'data/watchlist.json'
+        if os.path.exists(watchlist_file):
+            with open(watchlist_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+                watchlist = data if isinstance(data, list) else data.get('symbols', [])
+
+        prices = collector.get_stock_prices_bulk(watchlist, request.args.get('period', '5d'))
+        result = {}
+        for symbol in watchlist:
+            series = prices.get(symbol)
+            if not series:
+                result[symbol] = None
+                continue
+            current_price = series.last_close
+            previous_close = float(series.close[-2]) if len(series) >= 2 else current_price
+            result[symbol] = {
+                'date': str(series.dates[-1]),
+                'current_price': current_price,
+                'change_percent': ((current_price - previous_close) / previous_close * 100)
+                                  if previous_close else 0.0
+            }
+        return jsonify(result)
+
+    except Exception as e:
+        print(f"Error refreshing watchlist prices: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/watchlist', methods=['POST'])
 def add_to_watchlist():
     """添加到監控列表"""
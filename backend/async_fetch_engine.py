@@ -0,0 +1,221 @@
+"""
+異步數據獲取引擎
+用 aiohttp 協程實現REST數據源，共用一個 ClientSession，每個數據源有獨立的並發信號量和令牌桶配額。
+事件循環運行在後台線程中，Flask 路由通過同步接口 fetch_many / fetch 調用，
+一個worker即可同時處理數百個股票代碼的請求。aiohttp 未安裝時不可用，調用方回退到同步獲取。
+"""
+import asyncio
+import atexit
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from rate_limiter import rate_limiter
+from source_router import source_router
+from circuit_breaker import circuit_breakers, is_upstream_failure
+
+# 每個數據源同時在途的請求上限
+SOURCE_CONCURRENCY = {
+    'alpha_vantage': 2,
+    'finnhub': 8,
+    'twelve_data': 2,
+    'marketstack': 2,
+    'iex_cloud': 4,
+    'quandl': 4
+}
+
+class AsyncFetchEngine:
+    """基於aiohttp的REST數據源獲取引擎
+
+    請求構造和響應轉換沿用 MultiSourceDataCollector 的 _rest_request / _parse_rest_response，
+    統計、熔斷和路由評分也與同步路徑共用。
+    """
+
+    def __init__(self, collector, total_connections: int = 100, timeout: Tuple[float, float] = (3.05, 10.0),
+                 rate_limit_timeout: float = 30.0):
+        self.collector = collector
+        self.total_connections = total_connections
+        self.timeout = timeout                        # (連接超時, 讀取超時)
+        self.rate_limit_timeout = rate_limit_timeout  # 每個請求等待配額的最長時間
+        self.source_concurrency = dict(SOURCE_CONCURRENCY)
+
+        self.loop = None
+        self.thread = None
+        self.session = None
+        self.semaphores = {}
+        self.start_lock = threading.Lock()
+
+        self.stats_lock = threading.Lock()
+        self.stats = {'batches': 0, 'symbols': 0, 'requests': 0, 'in_flight': 0, 'max_in_flight': 0,
+                      'timed_out_symbols': 0}
+
+    @property
+    def available(self) -> bool:
+        return aiohttp is not None
+
+    def _ensure_started(self):
+        """第一次使用時啟動後台事件循環線程和共享的 ClientSession"""
+        with self.start_lock:
+            if self.loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='async-fetch-engine', daemon=True)
+            thread.start()
+            asyncio.run_coroutine_threadsafe(self._create_session(), loop).result()
+            self.loop, self.thread = loop, thread
+            atexit.register(self.close)
+            print(f"⚡ Async fetch engine started ({self.total_connections} connections)")
+
+    async def _create_session(self):
+        connector = aiohttp.TCPConnector(limit=self.total_connections, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.timeout[0], sock_read=self.timeout[1])
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                             headers={'User-Agent': 'investment-analyzer/1.0'})
+        # 信號量必須在事件循環中創建
+        self.semaphores = {name: asyncio.Semaphore(limit) for name, limit in self.source_concurrency.items()}
+
+    def _track(self, delta: int):
+        with self.stats_lock:
+            self.stats['in_flight'] += delta
+            if delta > 0:
+                self.stats['requests'] += 1
+                self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self.stats['in_flight'])
+
+    async def fetch_source(self, source_name: str, symbol: str) -> Tuple[bool, Dict]:
+        """從單個REST數據源獲取一隻股票"""
+        breaker = circuit_breakers.get(source_name)
+        if not breaker.allow_request():
+            return False, {}
+        try:
+            if not await rate_limiter.acquire_async(source_name, timeout=self.rate_limit_timeout):
+                breaker.release()
+                return False, {}
+
+            url, params, clean_symbol = self.collector._rest_request(source_name, symbol)
+            start_time = time.time()
+            success, data, rate_limited, symbol_miss = False, {}, False, False
+            async with self.semaphores.setdefault(source_name, asyncio.Semaphore(2)):
+                self._track(1)
+                try:
+                    async with self.session.get(url, params=params) as response:
+                        rate_limited = response.status == 429
+                        # 200沒有有效數據或404只與這個代碼有關，不計入熔斷器
+                        symbol_miss = response.status in (200, 404)
+                        if response.status == 200:
+                            payload = await response.json(content_type=None)
+                            data = self.collector._parse_rest_response(source_name, payload, clean_symbol) or {}
+                            success = bool(data)
+                except Exception as e:
+                    print(f"{source_name} async error for {symbol}: {e}")
+                    symbol_miss = not is_upstream_failure(e)
+                finally:
+                    self._track(-1)
+        except asyncio.CancelledError:
+            # 批量超時取消了未完成的請求，交還探測名額
+            breaker.release()
+            raise
+
+        self.collector._update_source_stats(source_name, success, rate_limited=rate_limited,
+                                            symbol_miss=symbol_miss)
+        source = next((s for s in self.collector.data_sources if s['name'] == source_name), {})
+        source_router.record(source_name, symbol, success, time.time() - start_time,
+                             prior_success=source.get('success_rate', 0.5))
+        return success, data
+
+    async def fetch_symbol(self, symbol: str, sources: List[str]) -> Tuple[Optional[str], Optional[Dict]]:
+        """按路由排序依次嘗試各REST數據源，返回第一個有效結果"""
+        candidates = [s for s in self.collector.data_sources if s['enabled'] and s['name'] in sources]
+        for source in source_router.rank(candidates, symbol):
+            success, data = await self.fetch_source(source['name'], symbol)
+            if success:
+                return source['name'], data
+        return None, None
+
+    async def fetch_many_async(self, symbols: List[str], sources: List[str],
+                               timeout: float = None) -> Dict[str, Tuple[str, Dict]]:
+        """並發獲取多隻股票；每隻股票完成時寫入結果，超時後取消未完成的股票並返回已完成的部分"""
+        results = {}
+
+        async def run(symbol):
+            source_name, data = await self.fetch_symbol(symbol, sources)
+            if data:
+                results[symbol] = (source_name, data)
+
+        tasks = [asyncio.ensure_future(run(symbol)) for symbol in symbols]
+        if not tasks:
+            return results
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                print(f"⚠️ Async fetch error: {task.exception()}")
+        if pending:
+            print(f"⏱️ Async batch timed out: {len(pending)}/{len(tasks)} symbols unfinished, "
+                  f"returning {len(results)} results")
+            with self.stats_lock:
+                self.stats['timed_out_symbols'] += len(pending)
+        return results
+
+    def fetch_many(self, symbols: List[str], sources: List[str] = None,
+                   timeout: float = 60.0) -> Dict[str, Tuple[str, Dict]]:
+        """同步接口：並發獲取多隻股票，返回 {代碼: (數據源, 數據)}，只包含成功的股票
+
+        超過 timeout 時返回已經完成的股票，調用方只需要處理其餘的股票。
+        """
+        if not self.available:
+            raise RuntimeError("aiohttp is not installed")
+        self._ensure_started()
+        sources = sources or list(self.source_concurrency)
+        with self.stats_lock:
+            self.stats['batches'] += 1
+            self.stats['symbols'] += len(symbols)
+        future = asyncio.run_coroutine_threadsafe(self.fetch_many_async(symbols, sources, timeout), self.loop)
+        try:
+            # 超時由協程內部處理，這裡只多留取消任務的時間
+            return future.result(timeout + 5)
+        except Exception as e:
+            future.cancel()
+            print(f"⚠️ Async batch fetch failed: {e}")
+            return {}
+
+    def fetch(self, symbol: str, sources: List[str] = None, timeout: float = 30.0) -> Tuple[bool, Dict]:
+        """同步接口：獲取單隻股票"""
+        result = self.fetch_many([symbol], sources, timeout).get(symbol)
+        return (True, result[1]) if result else (False, {})
+
+    def close(self):
+        """關閉 ClientSession 並停止事件循環"""
+        with self.start_lock:
+            if self.loop is None:
+                return
+            loop, self.loop = self.loop, None
+        try:
+            asyncio.run_coroutine_threadsafe(self.session.close(), loop).result(5)
+        except Exception as e:
+            print(f"⚠️ Error closing async session: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+
+    def get_stats(self) -> Dict:
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats.update({
+            'available': self.available,
+            'running': self.loop is not None,
+            'source_concurrency': self.source_concurrency
+        })
+        return stats
+
+def create_engine(collector) -> AsyncFetchEngine:
+    """按環境變量創建引擎；ASYNC_FETCH_CONNECTIONS 為總連接數上限"""
+    return AsyncFetchEngine(
+        collector,
+        total_connections=int(os.getenv('ASYNC_FETCH_CONNECTIONS', '100')),
+        timeout=(float(os.getenv('HTTP_CONNECT_TIMEOUT', '3.05')), float(os.getenv('HTTP_READ_TIMEOUT', '10')))
+    )
@@ -0,0 +1,874 @@
+"""
+緩存存儲後端
+內存分片後端（默認）和基於SQLite WAL的共享後端，後者可讓多個WSGI進程共用同一份緩存
+"""
+import os
+import sys
+import time
+import heapq
+import bisect
+import pickle
+import sqlite3
+import zlib
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+# 前綴範圍查詢的上界：prefix + PREFIX_END 大於所有以 prefix 開頭的鍵
+PREFIX_END = '\U0010ffff'
+
+def estimate_size(obj, _depth: int = 0) -> int:
+    """粗略估算對象佔用的內存（字節）"""
+    size = sys.getsizeof(obj)
+    if _depth > 8:
+        return size
+    
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += estimate_size(item, _depth + 1)
+    
+    return size
+
+class CacheEntry:
+    """緩存條目：expires_at 為軟過期時間，stale_until 為硬過期時間，tags 用於按標籤失效，
+    last_used 為最近寫入或命中的時間（跨分片比較LRU順序）"""
+    __slots__ = ('data', 'expires_at', 'stale_until', 'size', 'tags', 'last_used')
+
+    def __init__(self, data, expires_at: float, stale_until: float, size: int, tags: tuple = ()):
+        self.data = data
+        self.expires_at = expires_at
+        self.stale_until = stale_until
+        self.size = size
+        self.tags = tags
+        self.last_used = time.time()
+
+class CacheBackend:
+    """緩存存儲後端接口
+    
+    後端負責存儲、容量淘汰、過期清理以及命中/未命中等存儲層統計；
+    TTL策略、單飛和後台刷新由 CacheManager 負責。
+    """
+    name = 'base'
+    # 數據是否已持久化（持久化後端不需要快照）
+    persistent = False
+
+    def get(self, cache_type: str, key: str) -> Optional[CacheEntry]:
+        """返回未軟過期的條目並計為命中，否則計為未命中並返回None"""
+        raise NotImplementedError
+
+    def peek(self, cache_type: str, key: str) -> Optional[CacheEntry]:
+        """返回未硬過期的條目，不更新統計和LRU順序"""
+        raise NotImplementedError
+
+    def put(self, cache_type: str, key: str, data, expires_at: float, stale_until: float,
+            max_entries: int, max_bytes: int, tags: Iterable[str] = ()) -> bool:
+        """寫入條目並按容量上限淘汰；條目本身超出字節上限時返回False"""
+        raise NotImplementedError
+
+    def delete(self, cache_type: str, key: str) -> bool:
+        raise NotImplementedError
+
+    def delete_by_tag(self, tag: str, cache_type: str = None) -> int:
+        """通過標籤索引刪除帶有該標籤的條目，返回刪除數量"""
+        raise NotImplementedError
+
+    def delete_by_prefix(self, cache_type: str, prefix: str) -> int:
+        """通過有序鍵索引刪除鍵以 prefix 開頭的條目，返回刪除數量"""
+        raise NotImplementedError
+
+    def clear_type(self, cache_type: str) -> int:
+        raise NotImplementedError
+
+    def clear_all(self) -> int:
+        raise NotImplementedError
+
+    def enforce_limits(self, cache_type: str, max_entries: int, max_bytes: int):
+        raise NotImplementedError
+
+    def cleanup_expired(self, batch_size: int) -> int:
+        """分批刪除已硬過期的條目，返回刪除數量"""
+        raise NotImplementedError
+
+    def keys(self, cache_type: str) -> List[str]:
+        raise NotImplementedError
+
+    def items(self) -> List[tuple]:
+        """返回所有未硬過期的 (cache_type, key, CacheEntry)，按LRU順序（最舊在前）"""
+        raise NotImplementedError
+
+    def get_many(self, cache_type: str, keys: List[str]) -> Dict[str, CacheEntry]:
+        """批量獲取，只返回命中的條目"""
+        entries = {}
+        for key in keys:
+            entry = self.get(cache_type, key)
+            if entry is not None:
+                entries[key] = entry
+        return entries
+
+    def compact(self) -> Dict:
+        """回收存儲空間，默認只清理全部過期條目"""
+        return {'expired': self.cleanup_expired(1000)}
+
+    def stats(self) -> Dict:
+        """返回 {'counters', 'cache_types', 'memory_usage', 'evictions_by_type', 'type_counters'}
+        
+        type_counters 為每種類型的 hits / misses / sets / expirations / evictions 計數。
+        """
+        raise NotImplementedError
+
+class _TypeTotals:
+    """所有分片共享的按類型條目數和字節數；分片在持有自己的鎖時更新，鎖順序為 分片鎖 -> 本鎖"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.bytes = {}
+
+    def add(self, cache_type: str, entries: int, size: int):
+        with self.lock:
+            self.entries[cache_type] = self.entries.get(cache_type, 0) + entries
+            self.bytes[cache_type] = self.bytes.get(cache_type, 0) + size
+
+    def get(self, cache_type: str):
+        with self.lock:
+            return self.entries.get(cache_type, 0), self.bytes.get(cache_type, 0)
+
+class _CacheShard:
+    """緩存分片：擁有獨立的鎖、LRU表、過期堆和統計
+    
+    以 _ 結尾的方法要求調用方已持有 self.lock（可重入鎖）。
+    """
+
+    def __init__(self, totals: _TypeTotals):
+        self.lock = threading.RLock()
+        self.totals = totals
+        self.cache = {}
+        self.bytes_used = {}
+        # 按硬過期時間排序的最小堆 (stale_until, seq, cache_type, key)
+        # 條目被覆蓋或刪除時不從堆中移除，彈出時再與當前條目比對（惰性刪除）
+        self.expiry_heap = []
+        self.heap_seq = itertools.count()
+        # 二級索引：標籤 -> {(cache_type, key)}，以及每種類型的有序鍵列表（用於前綴查詢）
+        self.tag_index = {}
+        self.sorted_keys = {}
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'sets': 0,
+            'deletes': 0,
+            'expirations': 0,
+            'evictions': 0
+        }
+        self.evictions_by_type = {}
+        self.type_stats = {}
+
+    def count_(self, name: str, cache_type: str, amount: int = 1):
+        """同時更新總計數和按類型計數"""
+        self.stats[name] += amount
+        type_stats = self.type_stats.get(cache_type)
+        if type_stats is None:
+            type_stats = self.type_stats[cache_type] = {}
+        type_stats[name] = type_stats.get(name, 0) + amount
+
+    def entry_count_(self) -> int:
+        return sum(len(entries) for entries in self.cache.values())
+
+    def peek_(self, cache_type: str, key: str):
+        """讀取條目但不更新統計和LRU順序"""
+        entries = self.cache.get(cache_type)
+        if entries is None:
+            return None
+        return entries.get(key)
+
+    def put_(self, cache_type: str, key: str, entry: CacheEntry):
+        if cache_type not in self.cache:
+            self.cache[cache_type] = OrderedDict()
+            self.bytes_used[cache_type] = 0
+            self.sorted_keys[cache_type] = []
+        
+        if key in self.cache[cache_type]:
+            self.remove_(cache_type, key)
+        
+        self.cache[cache_type][key] = entry
+        self.bytes_used[cache_type] += entry.size
+        self.totals.add(cache_type, 1, entry.size)
+        self.count_('sets', cache_type)
+        heapq.heappush(self.expiry_heap, (entry.stale_until, next(self.heap_seq), cache_type, key))
+        bisect.insort(self.sorted_keys[cache_type], key)
+        for tag in entry.tags:
+            self.tag_index.setdefault(tag, set()).add((cache_type, key))
+
+    def unindex_(self, cache_type: str, key: str, entry: CacheEntry):
+        """從二級索引中移除條目"""
+        keys = self.sorted_keys[cache_type]
+        index = bisect.bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            del keys[index]
+        for tag in entry.tags:
+            members = self.tag_index.get(tag)
+            if members is not None:
+                members.discard((cache_type, key))
+                if not members:
+                    del self.tag_index[tag]
+
+    def remove_(self, cache_type: str, key: str):
+        """移除條目並更新字節統計和索引"""
+        entry = self.cache[cache_type].pop(key)
+        self.bytes_used[cache_type] -= entry.size
+        self.totals.add(cache_type, -1, -entry.size)
+        self.unindex_(cache_type, key, entry)
+
+    def keys_with_tag_(self, tag: str, cache_type: str = None) -> list:
+        return [(ct, key) for ct, key in self.tag_index.get(tag, ())
+                if cache_type is None or ct == cache_type]
+
+    def keys_with_prefix_(self, cache_type: str, prefix: str) -> list:
+        keys = self.sorted_keys.get(cache_type, [])
+        start = bisect.bisect_left(keys, prefix)
+        end = bisect.bisect_left(keys, prefix + PREFIX_END, start)
+        return keys[start:end]
+
+    def oldest_(self, cache_type: str) -> Optional[CacheEntry]:
+        """該類型最久未使用的條目"""
+        entries = self.cache.get(cache_type)
+        if not entries:
+            return None
+        return entries[next(iter(entries))]
+
+    def evict_oldest_(self, cache_type: str) -> Optional[CacheEntry]:
+        """淘汰該類型最久未使用的條目並返回它"""
+        entries = self.cache.get(cache_type)
+        if not entries:
+            return None
+        key, entry = entries.popitem(last=False)
+        self.bytes_used[cache_type] -= entry.size
+        self.totals.add(cache_type, -1, -entry.size)
+        self.unindex_(cache_type, key, entry)
+        self.count_('evictions', cache_type)
+        self.evictions_by_type[cache_type] = self.evictions_by_type.get(cache_type, 0) + 1
+        return entry
+
+    def pop_expired_(self, limit: int):
+        """從堆頂彈出最多limit個已過期項，返回(實際刪除數, 彈出數)"""
+        now = time.time()
+        removed = 0
+        popped = 0
+        while self.expiry_heap and popped < limit and self.expiry_heap[0][0] <= now:
+            stale_until, _, cache_type, key = heapq.heappop(self.expiry_heap)
+            popped += 1
+            
+            entry = self.peek_(cache_type, key)
+            # 條目已刪除或已被重新設置（過期時間不同），此堆項已失效
+            if entry is None or entry.stale_until != stale_until:
+                continue
+            
+            self.remove_(cache_type, key)
+            self.count_('expirations', cache_type)
+            removed += 1
+        
+        return removed, popped
+
+    def maybe_compact_heap_(self):
+        """失效堆項過多時重建堆"""
+        if len(self.expiry_heap) <= 2 * self.entry_count_() + 256:
+            return
+        
+        self.expiry_heap = [
+            (entry.stale_until, next(self.heap_seq), cache_type, key)
+            for cache_type, entries in self.cache.items()
+            for key, entry in entries.items()
+        ]
+        heapq.heapify(self.expiry_heap)
+
+    def clear_type_(self, cache_type: str) -> int:
+        deleted_count = len(self.cache.get(cache_type, {}))
+        if cache_type in self.cache:
+            for key, entry in self.cache[cache_type].items():
+                for tag in entry.tags:
+                    members = self.tag_index.get(tag)
+                    if members is not None:
+                        members.discard((cache_type, key))
+                        if not members:
+                            del self.tag_index[tag]
+            self.totals.add(cache_type, -deleted_count, -self.bytes_used[cache_type])
+            self.cache[cache_type] = OrderedDict()
+            self.bytes_used[cache_type] = 0
+            self.sorted_keys[cache_type] = []
+        self.stats['deletes'] += deleted_count
+        return deleted_count
+
+    def clear_all_(self) -> int:
+        deleted_count = self.entry_count_()
+        for cache_type, entries in self.cache.items():
+            self.totals.add(cache_type, -len(entries), -self.bytes_used[cache_type])
+        self.cache = {}
+        self.bytes_used = {}
+        self.expiry_heap = []
+        self.tag_index = {}
+        self.sorted_keys = {}
+        self.stats['deletes'] += deleted_count
+        return deleted_count
+
+class MemoryCacheBackend(CacheBackend):
+    """進程內分片緩存：每個 (cache_type, key) 按穩定哈希（CRC32）分配到一個獨立加鎖的分片
+    
+    容量上限按類型在所有分片上合計（共享的 _TypeTotals 計數）：超出時在 evict_lock 下逐個淘汰全局最久未使用的條目
+    （比較各分片LRU隊首的 last_used），單個條目只要不超過該類型的字節上限就可以緩存。
+    """
+    name = 'memory'
+
+    def __init__(self, num_shards: int = 16):
+        self.num_shards = max(1, num_shards)
+        self.totals = _TypeTotals()
+        self.shards = [_CacheShard(self.totals) for _ in range(self.num_shards)]
+        # 串行化跨分片淘汰；持有時再逐個獲取分片鎖，分片鎖內不會獲取它，因此不會死鎖
+        self.evict_lock = threading.Lock()
+
+    def _shard(self, cache_type: str, key: str) -> _CacheShard:
+        # 內置 hash() 對字符串按進程隨機化，分片位置不可重現
+        return self.shards[zlib.crc32(f"{cache_type}\x00{key}".encode('utf-8')) % self.num_shards]
+
+    def _evict(self, cache_type: str, max_entries: int, max_bytes: int):
+        """按類型的合計容量淘汰全局最久未使用的條目"""
+        entries, size = self.totals.get(cache_type)
+        if entries <= max_entries and size <= max_bytes:
+            return
+        with self.evict_lock:
+            while True:
+                entries, size = self.totals.get(cache_type)
+                if entries <= max_entries and size <= max_bytes:
+                    break
+                victim, victim_used = None, None
+                for shard in self.shards:
+                    with shard.lock:
+                        oldest = shard.oldest_(cache_type)
+                    if oldest is not None and (victim is None or oldest.last_used < victim_used):
+                        victim, victim_used = shard, oldest.last_used
+                if victim is None:
+                    break
+                with victim.lock:
+                    victim.evict_oldest_(cache_type)
+
+    def get(self, cache_type: str, key: str) -> Optional[CacheEntry]:
+        shard = self._shard(cache_type, key)
+        with shard.lock:
+            entry = shard.peek_(cache_type, key)
+            if entry is not None:
+                now = time.time()
+                if now < entry.expires_at:
+                    # 標記為最近使用
+                    shard.cache[cache_type].move_to_end(key)
+                    entry.last_used = now
+                    shard.count_('hits', cache_type)
+                    return entry
+                elif now >= entry.stale_until:
+                    # 緩存硬過期，在持鎖狀態下直接清理
+                    shard.remove_(cache_type, key)
+                    shard.count_('expirations', cache_type)
+            
+            shard.count_('misses', cache_type)
+            return None
+
+    def peek(self, cache_type: str, key: str) -> Optional[CacheEntry]:
+        shard = self._shard(cache_type, key)
+        with shard.lock:
+            entry = shard.peek_(cache_type, key)
+        if entry is not None and time.time() >= entry.stale_until:
+            return None
+        return entry
+
+    def put(self, cache_type: str, key: str, data, expires_at: float, stale_until: float,
+            max_entries: int, max_bytes: int, tags: Iterable[str] = ()) -> bool:
+        # 大小估算不需要持鎖
+        size = estimate_size(data)
+        shard = self._shard(cache_type, key)
+        
+        with shard.lock:
+            # 單個條目超過該類型的字節上限時不緩存
+            if size > max_bytes:
+                if shard.peek_(cache_type, key) is not None:
+                    shard.remove_(cache_type, key)
+                return False
+            
+            shard.put_(cache_type, key, CacheEntry(data, expires_at, stale_until, size, tuple(tags)))
+            shard.maybe_compact_heap_()
+        self._evict(cache_type, max_entries, max_bytes)
+        return True
+
+    def delete(self, cache_type: str, key: str) -> bool:
+        shard = self._shard(cache_type, key)
+        with shard.lock:
+            if shard.peek_(cache_type, key) is None:
+                return False
+            shard.remove_(cache_type, key)
+            shard.stats['deletes'] += 1
+        return True
+
+    def delete_by_tag(self, tag: str, cache_type: str = None) -> int:
+        deleted_count = 0
+        for shard in self.shards:
+            with shard.lock:
+                matches = shard.keys_with_tag_(tag, cache_type)
+                for ct, key in matches:
+                    shard.remove_(ct, key)
+                shard.stats['deletes'] += len(matches)
+            deleted_count += len(matches)
+        return deleted_count
+
+    def delete_by_prefix(self, cache_type: str, prefix: str) -> int:
+        deleted_count = 0
+        for shard in self.shards:
+            with shard.lock:
+                matches = shard.keys_with_prefix_(cache_type, prefix)
+                for key in matches:
+                    shard.remove_(cache_type, key)
+                shard.stats['deletes'] += len(matches)
+            deleted_count += len(matches)
+        return deleted_count
+
+    def clear_type(self, cache_type: str) -> int:
+        deleted_count = 0
+        for shard in self.shards:
+            with shard.lock:
+                deleted_count += shard.clear_type_(cache_type)
+        return deleted_count
+
+    def clear_all(self) -> int:
+        deleted_count = 0
+        for shard in self.shards:
+            with shard.lock:
+                deleted_count += shard.clear_all_()
+        return deleted_count
+
+    def enforce_limits(self, cache_type: str, max_entries: int, max_bytes: int):
+        self._evict(cache_type, max_entries, max_bytes)
+
+    def cleanup_expired(self, batch_size: int) -> int:
+        """逐分片分批持鎖，只處理堆頂已過期的條目"""
+        expired_count = 0
+        for shard in self.shards:
+            while True:
+                with shard.lock:
+                    removed, popped = shard.pop_expired_(batch_size)
+                expired_count += removed
+                if popped < batch_size:
+                    break
+                # 釋放鎖後讓出CPU，讓請求線程有機會獲取鎖
+                time.sleep(0)
+        return expired_count
+
+    def keys(self, cache_type: str) -> List[str]:
+        keys = []
+        for shard in self.shards:
+            with shard.lock:
+                keys.extend(shard.cache.get(cache_type, {}).keys())
+        return keys
+
+    def items(self) -> List[tuple]:
+        """逐分片複製條目引用，再按 last_used 合併為全局LRU順序"""
+        now = time.time()
+        items = []
+        for shard in self.shards:
+            with shard.lock:
+                for cache_type, entries in shard.cache.items():
+                    items.extend((cache_type, key, entry) for key, entry in entries.items()
+                                 if entry.stale_until > now)
+        items.sort(key=lambda item: item[2].last_used)
+        return items
+
+    def stats(self) -> Dict:
+        """匯總各分片的統計（逐個分片加鎖）"""
+        counters = {}
+        cache_types = {}
+        memory_usage = {}
+        evictions_by_type = {}
+        type_counters = {}
+        for shard in self.shards:
+            with shard.lock:
+                for name, value in shard.stats.items():
+                    counters[name] = counters.get(name, 0) + value
+                for cache_type, values in shard.type_stats.items():
+                    merged = type_counters.setdefault(cache_type, {})
+                    for name, value in values.items():
+                        merged[name] = merged.get(name, 0) + value
+                for cache_type, entries in shard.cache.items():
+                    cache_types[cache_type] = cache_types.get(cache_type, 0) + len(entries)
+                for cache_type, used in shard.bytes_used.items():
+                    memory_usage[cache_type] = memory_usage.get(cache_type, 0) + used
+                for cache_type, count in shard.evictions_by_type.items():
+                    evictions_by_type[cache_type] = evictions_by_type.get(cache_type, 0) + count
+        return {
+            'counters': counters,
+            'cache_types': cache_types,
+            'memory_usage': memory_usage,
+            'evictions_by_type': evictions_by_type,
+            'type_counters': type_counters,
+            'shards': self.num_shards
+        }
+
+class SQLiteCacheBackend(CacheBackend):
+    """基於SQLite WAL的共享緩存，同一台機器上的多個進程（gunicorn workers）共用
+    
+    值以pickle序列化存儲；條目數和字節數由觸發器維護在 cache_usage 表中，
+    標籤索引保存在 cache_tags 表中（條目刪除時由觸發器清理），
+    LRU順序由 last_access 近似（同一條目最多每 touch_interval 秒更新一次）。
+    命中/未命中等計數只統計本進程。
+    同一個文件可以被多個組件共用：每個 namespace 使用自己的一組表（{namespace}_entries 等），
+    clear_all、stats 和 keys 只作用於本 namespace 的條目。
+    """
+    name = 'sqlite'
+    persistent = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS {prefix}_entries (
+            cache_type TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value BLOB NOT NULL,
+            expires_at REAL NOT NULL,
+            stale_until REAL NOT NULL,
+            size INTEGER NOT NULL,
+            last_access REAL NOT NULL,
+            PRIMARY KEY (cache_type, key)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_{prefix}_stale_until ON {prefix}_entries (stale_until);
+        CREATE INDEX IF NOT EXISTS idx_{prefix}_lru ON {prefix}_entries (cache_type, last_access);
+        CREATE TABLE IF NOT EXISTS {prefix}_usage (
+            cache_type TEXT PRIMARY KEY,
+            entries INTEGER NOT NULL DEFAULT 0,
+            bytes INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TRIGGER IF NOT EXISTS trg_{prefix}_insert AFTER INSERT ON {prefix}_entries BEGIN
+            INSERT INTO {prefix}_usage (cache_type, entries, bytes) VALUES (NEW.cache_type, 1, NEW.size)
+            ON CONFLICT (cache_type) DO UPDATE SET entries = entries + 1, bytes = bytes + NEW.size;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_{prefix}_delete AFTER DELETE ON {prefix}_entries BEGIN
+            UPDATE {prefix}_usage SET entries = entries - 1, bytes = bytes - OLD.size
+            WHERE cache_type = OLD.cache_type;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_{prefix}_resize AFTER UPDATE OF size ON {prefix}_entries BEGIN
+            UPDATE {prefix}_usage SET bytes = bytes - OLD.size + NEW.size
+            WHERE cache_type = NEW.cache_type;
+        END;
+        CREATE TABLE IF NOT EXISTS {prefix}_tags (
+            tag TEXT NOT NULL,
+            cache_type TEXT NOT NULL,
+            key TEXT NOT NULL,
+            PRIMARY KEY (tag, cache_type, key)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_{prefix}_tags_entry ON {prefix}_tags (cache_type, key);
+        CREATE TRIGGER IF NOT EXISTS trg_{prefix}_untag AFTER DELETE ON {prefix}_entries BEGIN
+            DELETE FROM {prefix}_tags WHERE cache_type = OLD.cache_type AND key = OLD.key;
+        END;
+    """
+
+    def __init__(self, path: str = 'data/cache_store.db', touch_interval: float = 30.0, namespace: str = 'cache'):
+        self.path = path
+        self.namespace = namespace
+        self.entries = f'{namespace}_entries'
+        self.usage = f'{namespace}_usage'
+        self.tags = f'{namespace}_tags'
+        self.touch_interval = touch_interval
+        self.bulk_chunk_size = 500
+        self._local = threading.local()
+        self.stats_lock = threading.Lock()
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'sets': 0,
+            'deletes': 0,
+            'expirations': 0,
+            'evictions': 0
+        }
+        self.evictions_by_type = {}
+        self.type_counters = {}
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.executescript(self.SCHEMA.format(prefix=namespace))
+
+    def _conn(self) -> sqlite3.Connection:
+        """每個線程使用自己的連接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name: str, amount: int = 1, cache_type: str = None):
+        with self.stats_lock:
+            self.counters[name] += amount
+            if cache_type:
+                type_counters = self.type_counters.setdefault(cache_type, {})
+                type_counters[name] = type_counters.get(name, 0) + amount
+                if name == 'evictions':
+                    self.evictions_by_type[cache_type] = self.evictions_by_type.get(cache_type, 0) + amount
+
+    def _load(self, row) -> CacheEntry:
+        value, expires_at, stale_until, size = row[:4]
+        return CacheEntry(pickle.loads(value), expires_at, stale_until, size)
+
+    def get(self, cache_type: str, key: str) -> Optional[CacheEntry]:
+        conn = self._conn()
+        row = conn.execute(
+            f'SELECT value, expires_at, stale_until, size, last_access FROM {self.entries} '
+            'WHERE cache_type = ? AND key = ?', (cache_type, key)
+        ).fetchone()
+        now = time.time()
+        
+        if row is not None:
+            expires_at, stale_until, last_access = row[1], row[2], row[4]
+            if now < expires_at:
+                if now - last_access > self.touch_interval:
+                    conn.execute(f'UPDATE {self.entries} SET last_access = ? WHERE cache_type = ? AND key = ?',
+                                 (now, cache_type, key))
+                self._count('hits', cache_type=cache_type)
+                return self._load(row)
+            elif now >= stale_until:
+                conn.execute(f'DELETE FROM {self.entries} WHERE cache_type = ? AND key = ? AND stale_until = ?',
+                             (cache_type, key, stale_until))
+                self._count('expirations', cache_type=cache_type)
+        
+        self._count('misses', cache_type=cache_type)
+        return None
+
+    def peek(self, cache_type: str, key: str) -> Optional[CacheEntry]:
+        row = self._conn().execute(
+            f'SELECT value, expires_at, stale_until, size FROM {self.entries} '
+            'WHERE cache_type = ? AND key = ? AND stale_until > ?', (cache_type, key, time.time())
+        ).fetchone()
+        return self._load(row) if row is not None else None
+
+    def put(self, cache_type: str, key: str, data, expires_at: float, stale_until: float,
+            max_entries: int, max_bytes: int, tags: Iterable[str] = ()) -> bool:
+        value = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(value) > max_bytes:
+            self.delete(cache_type, key)
+            return False
+        
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                f'INSERT INTO {self.entries} (cache_type, key, value, expires_at, stale_until, size, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (cache_type, key) DO UPDATE SET value = excluded.value, '
+                'expires_at = excluded.expires_at, stale_until = excluded.stale_until, '
+                'size = excluded.size, last_access = excluded.last_access',
+                (cache_type, key, value, expires_at, stale_until, len(value), time.time())
+            )
+            # 覆蓋寫入不會觸發刪除觸發器，需要替換舊標籤
+            conn.execute(f'DELETE FROM {self.tags} WHERE cache_type = ? AND key = ?', (cache_type, key))
+            if tags:
+                conn.executemany(f'INSERT OR IGNORE INTO {self.tags} (tag, cache_type, key) VALUES (?, ?, ?)',
+                                 [(tag, cache_type, key) for tag in tags])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._count('sets', cache_type=cache_type)
+        self.enforce_limits(cache_type, max_entries, max_bytes)
+        return True
+
+    def delete(self, cache_type: str, key: str) -> bool:
+        cursor = self._conn().execute(f'DELETE FROM {self.entries} WHERE cache_type = ? AND key = ?',
+                                      (cache_type, key))
+        if cursor.rowcount > 0:
+            self._count('deletes')
+            return True
+        return False
+
+    def delete_by_tag(self, tag: str, cache_type: str = None) -> int:
+        if cache_type is None:
+            cursor = self._conn().execute(
+                f'DELETE FROM {self.entries} WHERE (cache_type, key) IN ('
+                f'SELECT cache_type, key FROM {self.tags} WHERE tag = ?)', (tag,))
+        else:
+            cursor = self._conn().execute(
+                f'DELETE FROM {self.entries} WHERE cache_type = ? AND key IN ('
+                f'SELECT key FROM {self.tags} WHERE tag = ? AND cache_type = ?)', (cache_type, tag, cache_type))
+        self._count('deletes', cursor.rowcount)
+        return cursor.rowcount
+
+    def delete_by_prefix(self, cache_type: str, prefix: str) -> int:
+        """利用主鍵 (cache_type, key) 上的範圍查詢"""
+        cursor = self._conn().execute(
+            f'DELETE FROM {self.entries} WHERE cache_type = ? AND key >= ? AND key < ?',
+            (cache_type, prefix, prefix + PREFIX_END))
+        self._count('deletes', cursor.rowcount)
+        return cursor.rowcount
+
+    def clear_type(self, cache_type: str) -> int:
+        cursor = self._conn().execute(f'DELETE FROM {self.entries} WHERE cache_type = ?', (cache_type,))
+        self._count('deletes', cursor.rowcount)
+        return cursor.rowcount
+
+    def clear_all(self) -> int:
+        cursor = self._conn().execute(f'DELETE FROM {self.entries}')
+        self._count('deletes', cursor.rowcount)
+        return cursor.rowcount
+
+    def enforce_limits(self, cache_type: str, max_entries: int, max_bytes: int):
+        """按 last_access 順序淘汰最舊的條目直到滿足容量限制"""
+        conn = self._conn()
+        evicted = 0
+        while True:
+            row = conn.execute(f'SELECT entries, bytes FROM {self.usage} WHERE cache_type = ?',
+                               (cache_type,)).fetchone()
+            if row is None or (row[0] <= max_entries and row[1] <= max_bytes):
+                break
+            # 條目數超出時一次淘汰超出部分，字節數超出時小批量淘汰
+            batch = max(row[0] - max_entries, 1 if row[1] > max_bytes else 0)
+            cursor = conn.execute(
+                f'DELETE FROM {self.entries} WHERE (cache_type, key) IN ('
+                f'SELECT cache_type, key FROM {self.entries} WHERE cache_type = ? '
+                'ORDER BY last_access LIMIT ?)', (cache_type, batch)
+            )
+            if cursor.rowcount <= 0:
+                break
+            evicted += cursor.rowcount
+        
+        if evicted > 0:
+            self._count('evictions', evicted, cache_type)
+
+    def cleanup_expired(self, batch_size: int) -> int:
+        """按 stale_until 索引分批刪除已過期條目（按類型計數），每批是一個短事務"""
+        conn = self._conn()
+        expired_count = 0
+        while True:
+            rows = conn.execute(
+                f'SELECT cache_type, key, stale_until FROM {self.entries} WHERE stale_until <= ? LIMIT ?',
+                (time.time(), batch_size)
+            ).fetchall()
+            by_type = {}
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for cache_type, key, stale_until in rows:
+                    # 只刪除仍未被重新寫入的條目
+                    cursor = conn.execute(
+                        f'DELETE FROM {self.entries} WHERE cache_type = ? AND key = ? AND stale_until = ?',
+                        (cache_type, key, stale_until))
+                    if cursor.rowcount > 0:
+                        by_type[cache_type] = by_type.get(cache_type, 0) + 1
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            for cache_type, count in by_type.items():
+                self._count('expirations', count, cache_type)
+                expired_count += count
+            if len(rows) < batch_size:
+                break
+            time.sleep(0)
+        
+        return expired_count
+
+    def keys(self, cache_type: str) -> List[str]:
+        rows = self._conn().execute(f'SELECT key FROM {self.entries} WHERE cache_type = ?', (cache_type,))
+        return [row[0] for row in rows]
+
+    def get_many(self, cache_type: str, keys: List[str]) -> Dict[str, CacheEntry]:
+        """一次查詢批量獲取（按 bulk_chunk_size 分塊以避免超出SQL參數上限）"""
+        conn = self._conn()
+        now = time.time()
+        entries = {}
+        touched = []
+        keys = list(dict.fromkeys(keys))
+        for start in range(0, len(keys), self.bulk_chunk_size):
+            chunk = keys[start:start + self.bulk_chunk_size]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f'SELECT value, expires_at, stale_until, size, last_access, key FROM {self.entries} '
+                f'WHERE cache_type = ? AND key IN ({placeholders}) AND expires_at > ?',
+                (cache_type, *chunk, now)
+            )
+            for row in rows:
+                entries[row[5]] = self._load(row)
+                if now - row[4] > self.touch_interval:
+                    touched.append((now, cache_type, row[5]))
+        if touched:
+            conn.executemany(f'UPDATE {self.entries} SET last_access = ? WHERE cache_type = ? AND key = ?', touched)
+        self._count('hits', len(entries), cache_type)
+        self._count('misses', len(keys) - len(entries), cache_type)
+        return entries
+
+    def entry_version(self, cache_type: str, key: str) -> Optional[tuple]:
+        """返回條目的版本標識 (expires_at, size)，不讀取值；條目不存在時返回None
+        
+        每次寫入都會更新 expires_at，調用方可用它判斷內存副本是否仍然有效。
+        """
+        return self._conn().execute(
+            f'SELECT expires_at, size FROM {self.entries} WHERE cache_type = ? AND key = ?',
+            (cache_type, key)
+        ).fetchone()
+
+    def hot_keys(self, cache_type: str, limit: int) -> List[str]:
+        """按最近訪問時間返回未過期的熱門鍵"""
+        rows = self._conn().execute(
+            f'SELECT key FROM {self.entries} WHERE cache_type = ? AND expires_at > ? '
+            'ORDER BY last_access DESC LIMIT ?', (cache_type, time.time(), limit)
+        )
+        return [row[0] for row in rows]
+
+    def compact(self) -> Dict:
+        """清理過期條目，截斷WAL並VACUUM回收文件空間"""
+        start_time = time.time()
+        size_before = self._file_size()
+        expired = self.cleanup_expired(1000)
+        conn = self._conn()
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.execute('VACUUM')
+        size_after = self._file_size()
+        print(f"🗜️ Compacted {self.path}: {size_before} -> {size_after} bytes, "
+              f"{expired} expired entries removed in {time.time() - start_time:.2f}s")
+        return {'expired': expired, 'bytes_before': size_before, 'bytes_after': size_after}
+
+    def _file_size(self) -> int:
+        """數據庫文件加WAL文件的大小"""
+        total = 0
+        for path in (self.path, self.path + '-wal'):
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def stats(self) -> Dict:
+        rows = self._conn().execute(f'SELECT cache_type, entries, bytes FROM {self.usage} WHERE entries > 0')
+        cache_types = {}
+        memory_usage = {}
+        for cache_type, entries, size in rows:
+            cache_types[cache_type] = entries
+            memory_usage[cache_type] = size
+        with self.stats_lock:
+            counters = dict(self.counters)
+            evictions_by_type = dict(self.evictions_by_type)
+            type_counters = {cache_type: dict(values) for cache_type, values in self.type_counters.items()}
+        return {
+            'counters': counters,
+            'cache_types': cache_types,
+            'memory_usage': memory_usage,
+            'evictions_by_type': evictions_by_type,
+            'type_counters': type_counters,
+            'path': self.path,
+            'namespace': self.namespace
+        }
+
+def create_backend(name: str = None) -> CacheBackend:
+    """根據環境變量 CACHE_BACKEND 創建後端（memory / sqlite）"""
+    name = (name or os.getenv('CACHE_BACKEND', 'memory')).lower()
+    if name == 'sqlite':
+        path = os.getenv('CACHE_SQLITE_PATH', 'data/cache_store.db')
+        # 同一文件中還有 SmartDataFetcher、代碼解析表和價格歷史的條目，CacheManager 使用獨立的表，
+        # 清空緩存（POST /api/cache/clear）不會刪除它們
+        return SQLiteCacheBackend(path, namespace='cache_manager')
+    if name != 'memory':
+        print(f"⚠️ Unknown cache backend '{name}', using memory")
+    return MemoryCacheBackend(int(os.getenv('CACHE_SHARDS', '16')))
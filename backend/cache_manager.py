@@ -3,14 +3,42 @@
 支持多層緩存、自動失效、性能監控
 """
 import time
-from datetime import datetime, timedelta
+from datetime import timedelta
 import json
+import os
+import sys
+import atexit
+import pickle
+import signal
+import hashlib
+import inspect
+import functools
 import threading
 import gc
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from cache_backends import CacheBackend, create_backend
+
+class _InFlight:
+    """進行中的緩存計算，同一鍵的其他調用者等待其結果"""
+    __slots__ = ('event', 'result', 'error')
 
-class CacheManager:
     def __init__(self):
-        self.cache = {}
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class CacheManager:
+    def __init__(self, num_shards: int = None, backend: CacheBackend = None):
+        # 存儲後端：默認為進程內分片緩存，CACHE_BACKEND=sqlite 時多個進程共用SQLite緩存
+        if backend is None:
+            if num_shards is not None:
+                from cache_backends import MemoryCacheBackend
+                backend = MemoryCacheBackend(num_shards)
+            else:
+                backend = create_backend()
+        self.backend = backend
+        
         self.ttl = {
             'stock_info': timedelta(hours=1),
             'price_data': timedelta(hours=4),
@@ -20,191 +48,699 @@ class CacheManager:
             'sector_performance': timedelta(hours=12),
             'analysis_result': timedelta(hours=1)
         }
+        # 每種緩存類型的容量上限（條目數和近似字節數），超出時按LRU淘汰
+        self.limits = {
+            'stock_info': {'max_entries': 5000, 'max_bytes': 32 * 1024 * 1024},
+            'price_data': {'max_entries': 2000, 'max_bytes': 128 * 1024 * 1024},
+            'financial_data': {'max_entries': 5000, 'max_bytes': 32 * 1024 * 1024},
+            'news': {'max_entries': 2000, 'max_bytes': 16 * 1024 * 1024},
+            'economic_indicators': {'max_entries': 100, 'max_bytes': 4 * 1024 * 1024},
+            'sector_performance': {'max_entries': 100, 'max_bytes': 4 * 1024 * 1024},
+            'analysis_result': {'max_entries': 3000, 'max_bytes': 128 * 1024 * 1024}
+        }
+        self.default_limits = {'max_entries': 1000, 'max_bytes': 16 * 1024 * 1024}
+        # stale-while-revalidate：軟過期後仍可提供舊數據的時間窗口（超過即硬過期）
+        # 只有 get_or_compute 會提供舊數據並在後台刷新
+        self.stale_ttl = {
+            'stock_info': timedelta(hours=2),
+            'analysis_result': timedelta(minutes=30)
+        }
+        
+        # 單飛、後台刷新等統計（存儲層統計由後端維護），由 inflight_lock 保護
         self.stats = {
-            'hits': 0,
-            'misses': 0,
-            'sets': 0,
-            'deletes': 0,
-            'expirations': 0
+            'rejected': 0,
+            'computations': 0,
+            'coalesced_waits': 0,
+            'stale_hits': 0,
+            'background_refreshes': 0,
+            'refresh_failures': 0,
+            'refresh_skipped': 0
         }
-        self.lock = threading.Lock()
+        self.refresh_times = {'total': 0.0, 'max': 0.0, 'last': 0.0}
+        
+        # 延遲和計算耗時統計：每個 (操作, 類型) 保留最近 latency_samples 個樣本用於計算分位數
+        self.latency_samples = 2048
+        self.latencies = {}
+        self.latency_totals = {}  # (操作, 類型) -> [次數, 總耗時(秒)]，用於Prometheus summary 的 _count/_sum
+        self.compute_stats = {}  # cache_type -> {'count': 次數, 'total': 總耗時(秒)}
+        self.time_saved = {}  # cache_type -> 命中累計節省的計算時間（秒），只增不減
+        self.metrics_lock = threading.Lock()
+        
+        self.cleanup_interval = 60  # 秒
+        self.cleanup_batch_size = 500  # 每次持鎖最多處理的過期項數
+        
+        # 快照（熱重啟）：由 enable_snapshots 啟用，在自動清理線程中定期保存
+        # 不放在 data/ 根目錄：SmartDataFetcher 會把 data/cache_*.pkl 當作舊版股票緩存導入
+        self.snapshot_path = os.getenv('CACHE_SNAPSHOT_PATH', 'data/snapshots/cache_manager.pkl')
+        self.snapshot_interval = int(os.getenv('CACHE_SNAPSHOT_INTERVAL', '600'))  # 秒，0表示只在退出時保存
+        self.snapshots_enabled = False
+        self.last_snapshot = time.time()
+        self.snapshot_marker = None  # 上次快照/恢復時的寫入計數，未變化時跳過自動快照
+        self.snapshot_lock = threading.Lock()
+        
+        # 單飛（single-flight）：每個 (cache_type, key) 同時只有一個計算在進行
+        # 鎖順序：inflight_lock -> 後端鎖，持有後端鎖時不得獲取 inflight_lock
+        self.inflight = {}
+        self.inflight_lock = threading.Lock()
+        
+        # 後台刷新線程池（有界），排隊中的刷新超過上限時直接提供舊數據
+        self.refresh_workers = 4
+        self.max_pending_refreshes = 64
+        self.pending_refreshes = 0
+        self.refresh_executor = ThreadPoolExecutor(max_workers=self.refresh_workers,
+                                                   thread_name_prefix='cache-refresh')
         
         # 啟動自動清理線程
         self.cleanup_thread = threading.Thread(target=self._auto_cleanup, daemon=True)
         self.cleanup_thread.start()
         
-        print("📦 CacheManager initialized with auto-cleanup.")
+        print(f"📦 CacheManager initialized with {self.backend.name} backend and auto-cleanup.")
 
-    def get(self, cache_type: str, key: str):
-        """獲取緩存數據"""
-        with self.lock:
-            if cache_type not in self.cache:
-                self.stats['misses'] += 1
-                return None
-            
-            if key in self.cache[cache_type]:
-                data, expiry_time = self.cache[cache_type][key]
-                if datetime.now() < expiry_time:
-                    self.stats['hits'] += 1
-                    return data
-                else:
-                    # 緩存過期，自動清理
-                    self.delete(cache_type, key)
-                    self.stats['expirations'] += 1
+    def _limits(self, cache_type: str):
+        limits = self.limits.get(cache_type, self.default_limits)
+        return limits['max_entries'], limits['max_bytes']
+
+    def _record_latency(self, op: str, cache_type: str, seconds: float, hit: bool = False):
+        with self.metrics_lock:
+            samples = self.latencies.get((op, cache_type))
+            if samples is None:
+                samples = self.latencies[(op, cache_type)] = deque(maxlen=self.latency_samples)
+            samples.append(seconds)
+            totals = self.latency_totals.setdefault((op, cache_type), [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+            # 每次命中節省的時間 ≈ 當時原始計算的平均耗時 - 本次讀取緩存的耗時
+            compute = self.compute_stats.get(cache_type)
+            if hit and compute and compute['count']:
+                saved = max(compute['total'] / compute['count'] - seconds, 0.0)
+                self.time_saved[cache_type] = self.time_saved.get(cache_type, 0.0) + saved
+
+    def record_compute_time(self, cache_type: str, seconds: float):
+        """記錄一次未命中時原始計算的耗時，用於估算緩存節省的時間"""
+        with self.metrics_lock:
+            compute = self.compute_stats.setdefault(cache_type, {'count': 0, 'total': 0.0})
+            compute['count'] += 1
+            compute['total'] += seconds
+
+    def get(self, cache_type: str, key: str, default=None):
+        """獲取緩存數據，未命中時返回 default（需要緩存None等值時可傳入哨兵對象）"""
+        start_time = time.perf_counter()
+        entry = self.backend.get(cache_type, key)
+        self._record_latency('get', cache_type, time.perf_counter() - start_time, hit=entry is not None)
+        return entry.data if entry is not None else default
+
+    def set(self, cache_type: str, key: str, data, ttl_seconds: int = None, tags=None):
+        """設置緩存數據，tags（如 'symbol:0700.HK'）用於按標籤批量失效"""
+        # 使用自定義TTL或默認TTL
+        if ttl_seconds is not None:
+            expires_at = time.time() + ttl_seconds
+        else:
+            expires_at = time.time() + self.ttl.get(cache_type, timedelta(minutes=5)).total_seconds()
+        stale_until = expires_at + self.stale_ttl.get(cache_type, timedelta(0)).total_seconds()
+        
+        max_entries, max_bytes = self._limits(cache_type)
+        start_time = time.perf_counter()
+        stored = self.backend.put(cache_type, key, data, expires_at, stale_until, max_entries, max_bytes,
+                                  tags or ())
+        self._record_latency('set', cache_type, time.perf_counter() - start_time)
+        if not stored:
+            # 單個條目超過該類型的字節預算時不緩存
+            with self.inflight_lock:
+                self.stats['rejected'] += 1
+            print(f"⚠️ Skip caching {cache_type}/{key}: exceeds {cache_type} byte budget")
+
+    def get_or_compute(self, cache_type: str, key: str, compute_fn, ttl_seconds: int = None,
+                       timeout: float = None, tags=None):
+        """獲取緩存，未命中時計算並緩存；同一鍵的並發未命中只計算一次
+        
+        條目軟過期但仍在 stale_ttl 窗口內時立即返回舊數據，並在後台刷新。
+        compute_fn 返回None表示上游沒有數據：不寫入緩存，舊條目保留，後台刷新計為失敗；
+        沒有舊條目時返回None，由調用方決定是否使用回退數據。
+        """
+        data = self.get(cache_type, key)
+        if data is not None:
+            return data
+        
+        flight_key = (cache_type, key)
+        with self.inflight_lock:
+            entry = self.backend.peek(cache_type, key)
+            now = time.time()
+            # 成為計算者前再檢查一次，避免剛完成的計算被重複執行
+            if entry is not None and now < entry.expires_at:
+                return entry.data
             
-            self.stats['misses'] += 1
-            return None
-
-    def set(self, cache_type: str, key: str, data, ttl_seconds: int = None):
-        """設置緩存數據"""
-        with self.lock:
-            if cache_type not in self.cache:
-                self.cache[cache_type] = {}
+            if entry is not None and now < entry.stale_until:
+                self.stats['stale_hits'] += 1
+                if flight_key not in self.inflight:
+                    self._schedule_refresh(flight_key, compute_fn, ttl_seconds, tags)
+                return entry.data
             
-            # 使用自定義TTL或默認TTL
-            if ttl_seconds is not None:
-                expiry_time = datetime.now() + timedelta(seconds=ttl_seconds)
+            flight = self.inflight.get(flight_key)
+            if flight is not None:
+                self.stats['coalesced_waits'] += 1
+                is_leader = False
             else:
-                expiry_time = datetime.now() + self.ttl.get(cache_type, timedelta(minutes=5))
-            
-            self.cache[cache_type][key] = (data, expiry_time)
-            self.stats['sets'] += 1
+                flight = _InFlight()
+                self.inflight[flight_key] = flight
+                self.stats['computations'] += 1
+                is_leader = True
+        
+        if not is_leader:
+            if not flight.event.wait(timeout):
+                raise TimeoutError(f"Timed out waiting for {cache_type}/{key}")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        
+        return self._run_flight(flight_key, flight, compute_fn, ttl_seconds, tags)
+
+    def _run_flight(self, flight_key, flight: _InFlight, compute_fn, ttl_seconds: int = None, tags=None):
+        """執行計算、寫入緩存並喚醒等待者"""
+        cache_type, key = flight_key
+        try:
+            start_time = time.perf_counter()
+            result = compute_fn()
+            self.record_compute_time(cache_type, time.perf_counter() - start_time)
+            if result is not None:
+                self.set(cache_type, key, result, ttl_seconds, tags)
+            flight.result = result
+            return result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.inflight_lock:
+                self.inflight.pop(flight_key, None)
+            flight.event.set()
+
+    def _schedule_refresh(self, flight_key, compute_fn, ttl_seconds: int = None, tags=None):
+        """提交後台刷新任務（調用方需持有 inflight_lock）"""
+        if self.pending_refreshes >= self.max_pending_refreshes:
+            self.stats['refresh_skipped'] += 1
+            return
+        
+        flight = _InFlight()
+        self.inflight[flight_key] = flight
+        self.pending_refreshes += 1
+        self.refresh_executor.submit(self._background_refresh, flight_key, flight,
+                                     compute_fn, ttl_seconds, tags)
+
+    def _background_refresh(self, flight_key, flight: _InFlight, compute_fn, ttl_seconds: int = None,
+                            tags=None):
+        """後台刷新舊條目並記錄耗時"""
+        start_time = time.time()
+        succeeded = False
+        try:
+            succeeded = self._run_flight(flight_key, flight, compute_fn, ttl_seconds, tags) is not None
+            if not succeeded:
+                print(f"Background refresh got no data for {flight_key[0]}/{flight_key[1]}, keeping stale entry")
+        except Exception as e:
+            print(f"Background refresh failed for {flight_key[0]}/{flight_key[1]}: {e}")
+        finally:
+            duration = time.time() - start_time
+            with self.inflight_lock:
+                self.pending_refreshes -= 1
+                if succeeded:
+                    self.stats['background_refreshes'] += 1
+                else:
+                    self.stats['refresh_failures'] += 1
+                self.refresh_times['total'] += duration
+                self.refresh_times['last'] = duration
+                self.refresh_times['max'] = max(self.refresh_times['max'], duration)
 
     def delete(self, cache_type: str, key: str):
         """刪除特定緩存"""
-        with self.lock:
-            if cache_type in self.cache and key in self.cache[cache_type]:
-                del self.cache[cache_type][key]
-                self.stats['deletes'] += 1
+        self.backend.delete(cache_type, key)
 
     def clear_type(self, cache_type: str):
         """清空特定類型的緩存"""
-        with self.lock:
-            if cache_type in self.cache:
-                deleted_count = len(self.cache[cache_type])
-                self.cache[cache_type] = {}
-                self.stats['deletes'] += deleted_count
-                print(f"🗑️ Cleared {deleted_count} {cache_type} cache entries")
+        deleted_count = self.backend.clear_type(cache_type)
+        print(f"🗑️ Cleared {deleted_count} {cache_type} cache entries")
 
     def clear_all(self):
         """清空所有緩存"""
-        with self.lock:
-            total_entries = sum(len(cache) for cache in self.cache.values())
-            self.cache = {}
-            self.stats['deletes'] += total_entries
-            print(f"🗑️ All caches cleared ({total_entries} entries)")
-
-    def invalidate_stock_data(self, symbol: str):
-        """失效特定股票的所有相關緩存"""
-        with self.lock:
-            cache_types = ['stock_info', 'price_data', 'financial_data', 'news', 'analysis_result']
-            deleted_count = 0
-            
-            for cache_type in cache_types:
-                if cache_type in self.cache and symbol in self.cache[cache_type]:
-                    del self.cache[cache_type][symbol]
-                    deleted_count += 1
-            
-            if deleted_count > 0:
-                self.stats['deletes'] += deleted_count
-                print(f"🗑️ Invalidated {deleted_count} cache entries for {symbol}")
+        total_entries = self.backend.clear_all()
+        print(f"🗑️ All caches cleared ({total_entries} entries)")
+
+    def invalidate_tag(self, tag: str, cache_type: str = None) -> int:
+        """通過標籤索引失效所有帶該標籤的緩存（只處理匹配的條目）"""
+        deleted_count = self.backend.delete_by_tag(tag, cache_type)
+        if deleted_count > 0:
+            print(f"🗑️ Invalidated {deleted_count} cache entries tagged {tag}")
+        return deleted_count
+
+    def invalidate_prefix(self, cache_type: str, prefix: str) -> int:
+        """失效某類型下鍵以 prefix 開頭的緩存（通過有序鍵索引範圍查詢）"""
+        deleted_count = self.backend.delete_by_prefix(cache_type, prefix)
+        if deleted_count > 0:
+            print(f"🗑️ Invalidated {deleted_count} {cache_type} entries with prefix {prefix}")
+        return deleted_count
+
+    def invalidate_stock_data(self, symbol: str) -> int:
+        """失效特定股票的所有相關緩存
+        
+        包括以股票代碼為鍵的條目、帶 symbol 標籤的條目（價格序列、報告、裝飾器緩存等），
+        以及未打標籤但鍵以 "{symbol}_" 開頭的價格數據和分析結果。
+        """
+        cache_types = ['stock_info', 'price_data', 'financial_data', 'news', 'analysis_result']
+        deleted_count = 0
+        
+        for cache_type in cache_types:
+            if self.backend.delete(cache_type, symbol):
+                deleted_count += 1
+        
+        deleted_count += self.backend.delete_by_tag(f"symbol:{symbol}")
+        for cache_type in ('price_data', 'analysis_result'):
+            deleted_count += self.backend.delete_by_prefix(cache_type, f"{symbol}_")
+        
+        if deleted_count > 0:
+            print(f"🗑️ Invalidated {deleted_count} cache entries for {symbol}")
+        return deleted_count
 
     def get_stats(self):
         """獲取緩存統計信息"""
-        with self.lock:
-            total_entries = sum(len(cache) for cache in self.cache.values())
-            hit_rate = (self.stats['hits'] / (self.stats['hits'] + self.stats['misses'])) * 100 if (self.stats['hits'] + self.stats['misses']) > 0 else 0
+        backend_stats = self.backend.stats()
+        totals = backend_stats['counters']
+        cache_types = backend_stats['cache_types']
+        with self.inflight_lock:
+            stats = dict(self.stats)
+            refresh_times = dict(self.refresh_times)
+            inflight_count = len(self.inflight)
+        
+        hit_rate = (totals['hits'] / (totals['hits'] + totals['misses'])) * 100 if (totals['hits'] + totals['misses']) > 0 else 0
+        refresh_count = stats['background_refreshes'] + stats['refresh_failures']
+        by_type = self._type_metrics(backend_stats)
+        
+        return {
+            'backend': self.backend.name,
+            'total_entries': sum(cache_types.values()),
+            'cache_types': cache_types,
+            'hits': totals['hits'],
+            'misses': totals['misses'],
+            'sets': totals['sets'],
+            'deletes': totals['deletes'],
+            'expirations': totals['expirations'],
+            'evictions': totals['evictions'],
+            'evictions_by_type': backend_stats['evictions_by_type'],
+            'rejected': stats['rejected'],
+            'computations': stats['computations'],
+            'coalesced_waits': stats['coalesced_waits'],
+            'inflight': inflight_count,
+            'stale_hits': stats['stale_hits'],
+            'background_refreshes': stats['background_refreshes'],
+            'refresh_failures': stats['refresh_failures'],
+            'refresh_skipped': stats['refresh_skipped'],
+            'refresh_time_ms': {
+                'avg': round(refresh_times['total'] / refresh_count * 1000, 1) if refresh_count else 0,
+                'max': round(refresh_times['max'] * 1000, 1),
+                'last': round(refresh_times['last'] * 1000, 1)
+            },
+            'memory_usage': backend_stats['memory_usage'],
+            'shards': backend_stats.get('shards', 1),
+            'hit_rate': f"{hit_rate:.1f}%",
+            'hit_rate_pct': round(hit_rate, 2),
+            'time_saved_ms': round(sum(metrics['time_saved_ms'] for metrics in by_type.values()), 1),
+            'by_type': by_type
+        }
+
+    @staticmethod
+    def _percentiles(samples) -> dict:
+        """返回毫秒單位的 p50/p95/p99"""
+        if not samples:
+            return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'samples': 0}
+        ordered = sorted(samples)
+        last = len(ordered) - 1
+        return {
+            'p50': round(ordered[int(round(0.50 * last))] * 1000, 4),
+            'p95': round(ordered[int(round(0.95 * last))] * 1000, 4),
+            'p99': round(ordered[int(round(0.99 * last))] * 1000, 4),
+            'samples': len(ordered)
+        }
+
+    @classmethod
+    def _latency_summary(cls, samples, totals) -> dict:
+        """最近樣本的分位數，加上自啟動以來的累計次數和總耗時（毫秒）"""
+        count, total = totals or (0, 0.0)
+        summary = cls._percentiles(samples)
+        summary['count'] = count
+        summary['sum_ms'] = round(total * 1000, 4)
+        return summary
+
+    def _type_metrics(self, backend_stats: dict) -> dict:
+        """按緩存類型匯總計數、字節數、延遲分位數和節省的計算時間（均為數值）"""
+        type_counters = backend_stats.get('type_counters', {})
+        with self.metrics_lock:
+            latencies = {op_type: list(samples) for op_type, samples in self.latencies.items()}
+            latency_totals = {op_type: list(values) for op_type, values in self.latency_totals.items()}
+            compute_stats = {cache_type: dict(values) for cache_type, values in self.compute_stats.items()}
+            time_saved_totals = dict(self.time_saved)
+        
+        cache_types = (set(backend_stats['cache_types']) | set(type_counters)
+                       | {cache_type for _, cache_type in latencies} | set(compute_stats))
+        by_type = {}
+        for cache_type in sorted(cache_types):
+            counters = type_counters.get(cache_type, {})
+            hits = counters.get('hits', 0)
+            misses = counters.get('misses', 0)
+            get_samples = latencies.get(('get', cache_type), [])
+            compute = compute_stats.get(cache_type, {'count': 0, 'total': 0.0})
             
-            return {
-                'total_entries': total_entries,
-                'cache_types': {k: len(v) for k, v in self.cache.items()},
-                'hits': self.stats['hits'],
-                'misses': self.stats['misses'],
-                'sets': self.stats['sets'],
-                'deletes': self.stats['deletes'],
-                'expirations': self.stats['expirations'],
-                'hit_rate': f"{hit_rate:.1f}%"
+            avg_compute = compute['total'] / compute['count'] if compute['count'] else 0.0
+            time_saved = time_saved_totals.get(cache_type, 0.0)
+            
+            by_type[cache_type] = {
+                'entries': backend_stats['cache_types'].get(cache_type, 0),
+                'bytes': backend_stats['memory_usage'].get(cache_type, 0),
+                'hits': hits,
+                'misses': misses,
+                'hit_rate_pct': round(hits / (hits + misses) * 100, 2) if hits + misses else 0.0,
+                'sets': counters.get('sets', 0),
+                'expirations': counters.get('expirations', 0),
+                'evictions': counters.get('evictions', 0),
+                'get_latency_ms': self._latency_summary(get_samples, latency_totals.get(('get', cache_type))),
+                'set_latency_ms': self._latency_summary(latencies.get(('set', cache_type), []),
+                                                        latency_totals.get(('set', cache_type))),
+                'computations': compute['count'],
+                'compute_ms_avg': round(avg_compute * 1000, 3),
+                'time_saved_ms': round(time_saved * 1000, 1)
             }
+        return by_type
+
+    def get_prometheus_metrics(self) -> str:
+        """以Prometheus文本格式導出緩存指標"""
+        stats = self.get_stats()
+        by_type = stats['by_type']
+        lines = []
+        
+        def metric(name, metric_type, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        
+        for field, name, help_text in (('hits', 'cache_hits_total', 'Cache hits'),
+                                       ('misses', 'cache_misses_total', 'Cache misses'),
+                                       ('sets', 'cache_sets_total', 'Cache writes'),
+                                       ('expirations', 'cache_expirations_total', 'Entries removed after expiry'),
+                                       ('evictions', 'cache_evictions_total', 'Entries evicted by capacity limits'),
+                                       ('computations', 'cache_computations_total', 'Computations on cache miss')):
+            metric(name, 'counter', help_text,
+                   [({'type': cache_type}, metrics[field]) for cache_type, metrics in by_type.items()])
+        
+        metric('cache_entries', 'gauge', 'Entries currently cached',
+               [({'type': cache_type}, metrics['entries']) for cache_type, metrics in by_type.items()])
+        metric('cache_bytes', 'gauge', 'Approximate bytes held',
+               [({'type': cache_type}, metrics['bytes']) for cache_type, metrics in by_type.items()])
+        
+        latency_samples = []
+        for cache_type, metrics in by_type.items():
+            for op in ('get', 'set'):
+                for quantile, field in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')):
+                    latency_samples.append(({'op': op, 'type': cache_type, 'quantile': quantile},
+                                            metrics[f'{op}_latency_ms'][field] / 1000))
+        metric('cache_latency_seconds', 'summary', 'Cache operation latency', latency_samples)
+        # summary 的 _sum/_count 是自啟動以來的累計值，分位數只來自最近的樣本
+        for cache_type, metrics in by_type.items():
+            for op in ('get', 'set'):
+                summary = metrics[f'{op}_latency_ms']
+                labels = f'op="{op}",type="{cache_type}"'
+                lines.append(f"cache_latency_seconds_sum{{{labels}}} {summary['sum_ms'] / 1000}")
+                lines.append(f"cache_latency_seconds_count{{{labels}}} {summary['count']}")
+        
+        metric('cache_compute_seconds_avg', 'gauge', 'Average duration of the computation behind a miss',
+               [({'type': cache_type}, metrics['compute_ms_avg'] / 1000) for cache_type, metrics in by_type.items()])
+        metric('cache_time_saved_seconds_total', 'counter', 'Estimated computation time saved by hits',
+               [({'type': cache_type}, metrics['time_saved_ms'] / 1000) for cache_type, metrics in by_type.items()])
+        metric('cache_stale_hits_total', 'counter', 'Stale entries served while refreshing',
+               [({}, stats['stale_hits'])])
+        metric('cache_inflight', 'gauge', 'Computations in progress', [({}, stats['inflight'])])
+        
+        return '\n'.join(lines) + '\n'
+
 
     def _auto_cleanup(self):
         """自動清理過期緩存"""
         while True:
             try:
-                time.sleep(300)  # 每5分鐘檢查一次
+                time.sleep(self.cleanup_interval)
                 self._cleanup_expired()
+                if (self.snapshots_enabled and self.snapshot_interval > 0
+                        and time.time() - self.last_snapshot >= self.snapshot_interval):
+                    self.snapshot(force=False)
             except Exception as e:
                 print(f"Auto-cleanup error: {e}")
 
     def _cleanup_expired(self):
-        """清理過期緩存"""
-        with self.lock:
-            current_time = datetime.now()
-            expired_count = 0
+        """清理過期緩存，由後端按過期順序分批處理"""
+        expired_count = self.backend.cleanup_expired(self.cleanup_batch_size)
+        if expired_count > 0:
+            print(f"🧹 Auto-cleanup: removed {expired_count} expired entries")
+        return expired_count
+
+    def _write_marker(self):
+        counters = self.backend.stats()['counters']
+        return counters.get('sets', 0), counters.get('deletes', 0)
+
+    def snapshot(self, path: str = None, force: bool = True):
+        """將緩存保存到磁盤（臨時文件加原子替換），返回保存的條目數和耗時
+        
+        force=False 時，若自上次快照或恢復以來沒有寫入則跳過。
+        """
+        path = path or self.snapshot_path
+        if self.backend.persistent:
+            return {'entries': 0, 'skipped': f'{self.backend.name} backend is already persistent'}
+        
+        with self.snapshot_lock:
+            marker = self._write_marker()
+            if not force and marker == self.snapshot_marker:
+                return {'entries': 0, 'skipped': 'no changes since last snapshot'}
+            start_time = time.time()
+            entries = [(cache_type, key, entry.data, entry.expires_at, entry.stale_until, entry.tags)
+                       for cache_type, key, entry in self.backend.items()]
+            try:
+                payload = pickle.dumps({'version': 1, 'created_at': time.time(), 'entries': entries},
+                                       protocol=5)
+            except Exception:
+                # 個別條目無法序列化時逐條過濾
+                entries = [item for item in entries if self._picklable(item)]
+                payload = pickle.dumps({'version': 1, 'created_at': time.time(), 'entries': entries},
+                                       protocol=5)
             
-            for cache_type, cache_data in self.cache.items():
-                expired_keys = []
-                for key, (data, timestamp) in cache_data.items():
-                    if current_time - timestamp > self.ttl.get(cache_type, timedelta(minutes=5)):
-                        expired_keys.append(key)
-                
-                for key in expired_keys:
-                    del cache_data[key]
-                    expired_count += 1
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
             
-            if expired_count > 0:
-                self.stats['expirations'] += expired_count
-                print(f"🧹 Auto-cleanup: removed {expired_count} expired entries")
+            self.last_snapshot = time.time()
+            self.snapshot_marker = marker
+            elapsed = self.last_snapshot - start_time
+        print(f"💾 Cache snapshot saved: {len(entries)} entries, {len(payload)} bytes in {elapsed * 1000:.1f}ms")
+        return {'entries': len(entries), 'bytes': len(payload), 'elapsed_ms': round(elapsed * 1000, 1)}
+
+    @staticmethod
+    def _picklable(item) -> bool:
+        try:
+            pickle.dumps(item, protocol=5)
+            return True
+        except Exception:
+            return False
+
+    def restore(self, path: str = None):
+        """從快照恢復緩存，丟棄已硬過期的條目，返回恢復的條目數和耗時"""
+        path = path or self.snapshot_path
+        if not os.path.exists(path):
+            return {'restored': 0, 'expired': 0}
+        
+        start_time = time.time()
+        with open(path, 'rb') as f:
+            # 快照只由本程序寫入
+            payload = pickle.load(f)
+        
+        now = time.time()
+        restored = 0
+        expired = 0
+        for cache_type, key, data, expires_at, stale_until, *rest in payload.get('entries', []):
+            if stale_until <= now:
+                expired += 1
+                continue
+            max_entries, max_bytes = self._limits(cache_type)
+            tags = rest[0] if rest else ()
+            if self.backend.put(cache_type, key, data, expires_at, stale_until, max_entries, max_bytes, tags):
+                restored += 1
+        
+        self.snapshot_marker = self._write_marker()
+        elapsed = time.time() - start_time
+        print(f"♻️ Cache restored: {restored} entries ({expired} expired dropped) in {elapsed * 1000:.1f}ms")
+        return {'restored': restored, 'expired': expired, 'elapsed_ms': round(elapsed * 1000, 1)}
+
+    def enable_snapshots(self):
+        """啟用熱重啟：立即從快照恢復，退出時（包括SIGTERM）和定期保存快照"""
+        if self.snapshots_enabled:
+            return
+        self.snapshots_enabled = True
+        try:
+            self.restore()
+        except Exception as e:
+            print(f"Cache restore error: {e}")
+        
+        atexit.register(self._snapshot_on_exit)
+        # 默認的SIGTERM處理不會運行atexit，改為正常退出；已有其他處理器（如gunicorn）時不覆蓋
+        try:
+            if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+                signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        except ValueError:
+            # 非主線程無法設置信號處理器
+            pass
+
+    def _snapshot_on_exit(self):
+        try:
+            self.snapshot(force=False)
+        except Exception as e:
+            print(f"Cache snapshot error: {e}")
+
+    def compact(self):
+        """壓縮存儲後端（SQLite後端會回收文件空間）"""
+        return self.backend.compact()
 
     def set_ttl(self, cache_type: str, ttl: timedelta):
         """設置特定緩存類型的TTL"""
         self.ttl[cache_type] = ttl
         print(f"⏰ Set TTL for {cache_type}: {ttl}")
 
+    def set_stale_ttl(self, cache_type: str, stale_ttl: timedelta):
+        """設置軟過期後仍可提供舊數據的時間窗口，timedelta(0) 表示關閉"""
+        self.stale_ttl[cache_type] = stale_ttl
+        print(f"⏰ Set stale window for {cache_type}: {stale_ttl}")
+
+    def set_limits(self, cache_type: str, max_entries: int = None, max_bytes: int = None):
+        """設置特定緩存類型的容量上限，並立即按新限制淘汰"""
+        limits = dict(self.limits.get(cache_type, self.default_limits))
+        if max_entries is not None:
+            limits['max_entries'] = int(max_entries)
+        if max_bytes is not None:
+            limits['max_bytes'] = int(max_bytes)
+        self.limits[cache_type] = limits
+        
+        self.backend.enforce_limits(cache_type, limits['max_entries'], limits['max_bytes'])
+        print(f"📏 Set limits for {cache_type}: {limits['max_entries']} entries, {limits['max_bytes']} bytes")
+
     def get_cache_info(self, cache_type: str = None):
         """獲取緩存信息"""
-        with self.lock:
-            if cache_type:
-                if cache_type in self.cache:
-                    return {
-                        'type': cache_type,
-                        'entries': len(self.cache[cache_type]),
-                        'ttl': str(self.ttl.get(cache_type, 'default')),
-                        'keys': list(self.cache[cache_type].keys())
-                    }
+        backend_stats = self.backend.stats()
+        if cache_type:
+            if cache_type not in backend_stats['cache_types']:
                 return None
-            
             return {
-                'types': {k: len(v) for k, v in self.cache.items()},
-                'ttl_settings': {k: str(v) for k, v in self.ttl.items()}
+                'type': cache_type,
+                'entries': backend_stats['cache_types'][cache_type],
+                'ttl': str(self.ttl.get(cache_type, 'default')),
+                'stale_ttl': str(self.stale_ttl.get(cache_type, timedelta(0))),
+                'bytes': backend_stats['memory_usage'].get(cache_type, 0),
+                'limits': self.limits.get(cache_type, self.default_limits),
+                'keys': self.backend.keys(cache_type)
             }
+        
+        return {
+            'backend': self.backend.name,
+            'types': backend_stats['cache_types'],
+            'ttl_settings': {k: str(v) for k, v in self.ttl.items()},
+            'stale_ttl_settings': {k: str(v) for k, v in self.stale_ttl.items()},
+            'limits': {k: dict(v) for k, v in self.limits.items()}
+        }
 
 # 全局實例
 cache_manager = CacheManager()
 
-def cached(cache_type: str, ttl_override: timedelta = None):
-    """緩存裝飾器"""
+_MISS = object()
+
+def _is_empty_result(result) -> bool:
+    """默認的負結果判斷：None 或空容器"""
+    return result is None or (isinstance(result, (dict, list, tuple, set, str)) and len(result) == 0)
+
+def _ttl_seconds(ttl):
+    if ttl is None:
+        return None
+    return ttl.total_seconds() if isinstance(ttl, timedelta) else float(ttl)
+
+def make_cache_key(func, args, kwargs, ignore_self: bool = True) -> str:
+    """根據函數簽名生成穩定的緩存鍵
+    
+    參數按簽名綁定並補全默認值，因此 f('A')、f('A', 5)、f('A', limit=5) 得到同一個鍵；
+    使用 repr 保留類型（1 和 '1' 不同），並忽略方法的 self/cls 參數。
+    """
+    try:
+        bound = inspect.signature(func).bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = list(bound.arguments.items())
+    except (TypeError, ValueError):
+        arguments = list(enumerate(args)) + sorted(kwargs.items())
+    
+    if ignore_self and arguments and arguments[0][0] in ('self', 'cls'):
+        arguments = arguments[1:]
+    
+    digest = hashlib.sha1(repr(arguments).encode('utf-8')).hexdigest()[:20]
+    return f"{func.__qualname__}:{digest}"
+
+def _bound_arguments(func, args, kwargs) -> dict:
+    try:
+        bound = inspect.signature(func).bind(*args, **kwargs)
+        bound.apply_defaults()
+        return dict(bound.arguments)
+    except (TypeError, ValueError):
+        return dict(kwargs)
+
+def cached(cache_type: str, ttl_override: timedelta = None, negative_ttl=timedelta(minutes=1),
+           is_negative=None, ignore_self: bool = True, tag_args=('symbol',)):
+    """緩存裝飾器
+    
+    ttl_override: 本函數結果的TTL（timedelta或秒），只作用於本函數寫入的條目
+    negative_ttl: 負結果（默認為None或空容器）使用的較短TTL，None表示不緩存負結果
+    is_negative: 自定義負結果判斷函數
+    ignore_self: 方法的 self/cls 不參與緩存鍵，不同實例共享緩存
+    tag_args: 這些參數的值會作為標籤（如 'symbol:0700.HK'），供 invalidate_tag 使用
+    """
+    check_negative = is_negative or _is_empty_result
+    positive_ttl = _ttl_seconds(ttl_override)
+    negative_seconds = _ttl_seconds(negative_ttl)
+    
     def decorator(func):
+        @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            # 生成緩存鍵
-            cache_key_parts = [str(arg) for arg in args] + [f"{k}={v}" for k, v in kwargs.items()]
-            cache_key = "_".join(cache_key_parts)
+            cache_key = make_cache_key(func, args, kwargs, ignore_self)
             
-            # 檢查緩存
-            cached_data = cache_manager.get(cache_type, cache_key)
-            if cached_data:
+            # 檢查緩存（使用哨兵區分未命中和緩存的空結果）
+            cached_data = cache_manager.get(cache_type, cache_key, _MISS)
+            if cached_data is not _MISS:
                 print(f"📦 Using cached data for {func.__name__} ({cache_type}, {cache_key})")
                 return cached_data
             
             # 執行函數
+            start_time = time.perf_counter()
             result = func(*args, **kwargs)
+            cache_manager.record_compute_time(cache_type, time.perf_counter() - start_time)
             
-            # 設置TTL覆蓋
-            if ttl_override:
-                cache_manager.set_ttl(cache_type, ttl_override)
+            arguments = _bound_arguments(func, args, kwargs) if tag_args else {}
+            tags = [f"{name}:{arguments[name]}" for name in tag_args if arguments.get(name) is not None]
             
-            # 緩存結果
-            cache_manager.set(cache_type, cache_key, result)
-            print(f"💾 Cached fresh data for {func.__name__} ({cache_type}, {cache_key})")
+            if check_negative(result):
+                if negative_seconds is None:
+                    return result
+                cache_manager.set(cache_type, cache_key, result, ttl_seconds=negative_seconds, tags=tags)
+                print(f"💾 Cached empty result for {func.__name__} ({cache_type}, {cache_key}) for {negative_seconds:.0f}s")
+            else:
+                cache_manager.set(cache_type, cache_key, result, ttl_seconds=positive_ttl, tags=tags)
+                print(f"💾 Cached fresh data for {func.__name__} ({cache_type}, {cache_key})")
             return result
+        
+        def invalidate(*args, **kwargs):
+            """刪除指定參數對應的緩存"""
+            cache_manager.delete(cache_type, make_cache_key(func, args, kwargs, ignore_self))
+        
+        wrapper.cache_key = lambda *args, **kwargs: make_cache_key(func, args, kwargs, ignore_self)
+        wrapper.invalidate = invalidate
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
@@ -0,0 +1,171 @@
+"""
+數據源熔斷器
+每個上游數據源一個熔斷器（closed / open / half_open），連續失敗或被限速（429）時熔斷，
+熔斷期間直接跳過該數據源，冷卻後只放行一個探測請求
+"""
+import os
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# 只匹配 "HTTP Error 404: ..."（urllib / yfinance）和 "429 Client Error: ..."（requests）形式的消息，
+# 消息中的股票代碼（例如 quoteSummary/1429.HK）不會被當成狀態碼
+STATUS_PATTERN = re.compile(r'HTTP Error ([1-5]\d\d)\b|^([1-5]\d\d) (?:Client|Server) Error\b')
+
+def http_status(error) -> Optional[int]:
+    """異常對應的HTTP狀態碼，沒有時返回None
+
+    優先取異常本身帶的狀態碼：requests 的 response.status_code、aiohttp 的 status、urllib 的 code。
+    """
+    response = getattr(error, 'response', None)
+    for status in (getattr(response, 'status_code', None), getattr(error, 'status', None),
+                   getattr(error, 'code', None)):
+        if isinstance(status, int) and 100 <= status < 600:
+            return status
+    match = STATUS_PATTERN.search(str(error))
+    return int(match.group(1) or match.group(2)) if match else None
+
+def is_rate_limit_error(error) -> bool:
+    """上游返回 429 / Too Many Requests（yfinance 的 YFRateLimitError 沒有狀態碼，只有消息）"""
+    status = http_status(error)
+    if status is not None:
+        return status == 429
+    return 'Too Many Requests' in str(error)
+
+def is_upstream_failure(error) -> bool:
+    """是否計入熔斷：429、5xx、超時和連接錯誤說明數據源本身有問題；
+    404等4xx、空數據或解析錯誤只與單個代碼有關，不應讓所有用戶都跳過該數據源"""
+    status = http_status(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    if is_rate_limit_error(error):
+        return True
+    # requests 的連接和超時錯誤都是 OSError 的子類
+    return isinstance(error, (OSError, TimeoutError)) or 'timed out' in str(error).lower()
+
+class CircuitBreaker:
+    """單個數據源的熔斷器
+
+    closed: 正常放行，連續失敗達到 failure_threshold 次或遇到429時轉為 open。
+    open: 直接拒絕，open_timeout 秒後轉為 half_open。
+    half_open: 只放行一個探測請求，成功則恢復 closed，失敗則重新 open 並加倍冷卻時間（不超過 max_open_timeout）。
+    只有傳輸錯誤、429和5xx算失敗；單個代碼沒有數據時調用方調用 release()，按代碼處理（解析表或回退數據緩存）。
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, open_timeout: float = 30.0,
+                 max_open_timeout: float = 600.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_timeout = open_timeout
+        self.max_open_timeout = max_open_timeout
+        self.lock = threading.Lock()
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.current_timeout = open_timeout
+        self.opened_until = 0.0
+        self.probe_started = None  # half_open 時探測請求的開始時間
+        self.last_error = None
+        self.stats = {'trips': 0, 'short_circuited': 0, 'probes': 0}
+
+    def allow_request(self) -> bool:
+        """是否可以向該數據源發出請求"""
+        with self.lock:
+            now = time.time()
+            if self.state == OPEN and now >= self.opened_until:
+                self.state = HALF_OPEN
+                self.probe_started = None
+                print(f"🔌 Circuit for {self.name} half-open, probing")
+
+            if self.state == CLOSED:
+                return True
+            # 探測請求沒有回報結果（例如線程被放棄）超過冷卻時間時，允許新的探測
+            if self.state == HALF_OPEN and (self.probe_started is None or
+                                            now - self.probe_started > self.current_timeout):
+                self.probe_started = now
+                self.stats['probes'] += 1
+                return True
+
+            self.stats['short_circuited'] += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != CLOSED:
+                print(f"✅ Circuit for {self.name} closed")
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.current_timeout = self.open_timeout
+            self.probe_started = None
+
+    def record_failure(self, rate_limited: bool = False, error: str = None):
+        with self.lock:
+            self.consecutive_failures += 1
+            self.last_error = error or ('rate limited' if rate_limited else 'request failed')
+            if self.state == HALF_OPEN:
+                # 探測失敗：冷卻時間加倍
+                self._trip(min(self.current_timeout * 2, self.max_open_timeout))
+            elif self.state == CLOSED and (rate_limited or self.consecutive_failures >= self.failure_threshold):
+                self._trip(self.open_timeout)
+
+    def release(self):
+        """放行後沒有實際發出請求（例如沒有配額）或結果只與單個代碼有關，交還探測名額"""
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.probe_started = None
+
+    def _trip(self, timeout: float):
+        self.state = OPEN
+        self.current_timeout = timeout
+        self.opened_until = time.time() + timeout
+        self.probe_started = None
+        self.stats['trips'] += 1
+        print(f"🚫 Circuit for {self.name} open for {timeout:.0f}s ({self.last_error})")
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'retry_in_seconds': round(max(0.0, self.opened_until - time.time()), 1) if self.state == OPEN else 0,
+                'last_error': self.last_error,
+                **self.stats
+            }
+
+class CircuitBreakerRegistry:
+    """按數據源名稱管理熔斷器，SmartDataFetcher 和 MultiSourceDataCollector 共用"""
+
+    def __init__(self, failure_threshold: int = 5, open_timeout: float = 30.0, max_open_timeout: float = 600.0):
+        self.failure_threshold = failure_threshold
+        self.open_timeout = open_timeout
+        self.max_open_timeout = max_open_timeout
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def get(self, name: str) -> CircuitBreaker:
+        with self.lock:
+            breaker = self.breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name, self.failure_threshold, self.open_timeout, self.max_open_timeout)
+                self.breakers[name] = breaker
+            return breaker
+
+    def reset(self, name: str):
+        """手動恢復數據源（例如更換API密鑰後）"""
+        self.get(name).record_success()
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            breakers = list(self.breakers.values())
+        return {breaker.name: breaker.get_stats() for breaker in breakers}
+
+# 全局熔斷器；CIRCUIT_FAILURE_THRESHOLD 為連續失敗次數，CIRCUIT_OPEN_SECONDS 為首次熔斷的冷卻時間
+circuit_breakers = CircuitBreakerRegistry(
+    failure_threshold=int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5')),
+    open_timeout=float(os.getenv('CIRCUIT_OPEN_SECONDS', '30'))
+)
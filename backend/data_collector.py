@@ -5,10 +5,12 @@ import numpy as np
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 import os
-import time
 import random
 from dotenv import load_dotenv
 from cache_manager import cache_manager, cached
+from rate_limiter import rate_limiter, YAHOO_FINANCE_PER_MINUTE
+from price_series import PriceSeries, as_price_series
+from price_history_store import price_history_store
 
 load_dotenv()
 
@@ -16,8 +18,14 @@ class DataCollector:
     def __init__(self):
         self.alpha_vantage_key = os.getenv('ALPHA_VANTAGE_API_KEY', 'demo')
         self.fred_api_key = os.getenv('FRED_API_KEY', 'demo')
-        self.request_delay = 1.0  # 請求間隔（秒）
         self.max_retries = 3  # 最大重試次數
+        self.rate_limit_timeout = 5.0  # 等待Yahoo Finance配額的最長時間（秒）
+        # 原來每次請求前固定睡眠1秒，現在改為與其他收集器共用的 yahoo_finance 令牌桶
+        # （RATE_LIMIT_YAHOO_PER_MINUTE，默認每分鐘30次），只在配額不足時等待；
+        # 歷史數據（單隻和批量）只發往Yahoo，只受該令牌桶限制，不佔用各API共用的全局配額，
+        # 否則全局上限會讓載入一個行業或觀察清單的歷史排隊數分鐘
+        rate_limiter.configure('yahoo_finance', YAHOO_FINANCE_PER_MINUTE)
+        self.bulk_chunk_size = int(os.getenv('YF_BULK_CHUNK_SIZE', '50'))  # 每次批量下載的股票數
         
         # 嘗試導入多源收集器
         try:
@@ -93,13 +101,13 @@ class DataCollector:
             print(f"Error converting smart fetcher data: {e}")
             return self.get_stock_info(symbol)
     
-    def safe_yfinance_request(self, symbol, max_retries=3, delay=1.0):
-        """安全的yfinance請求，帶重試機制"""
+    def safe_yfinance_request(self, symbol, max_retries=3):
+        """安全的yfinance請求，帶重試機制（重試節奏由限速器控制）"""
         for attempt in range(max_retries):
             try:
-                # 添加隨機延遲避免被限制
-                if attempt > 0:
-                    time.sleep(delay * (attempt + 1) + random.uniform(0.5, 1.5))
+                if not rate_limiter.acquire('yahoo_finance', timeout=self.rate_limit_timeout):
+                    print(f"⏳ Rate limit for yahoo_finance: skipping {symbol}")
+                    return None
                 
                 ticker = yf.Ticker(symbol)
                 
@@ -200,82 +208,14 @@ class DataCollector:
         }
     
     def get_stock_info(self, symbol: str) -> Dict:
-        """獲取股票基本信息（帶緩存）"""
-        # 先檢查緩存
-        cached_data = cache_manager.get('stock_info', symbol)
-        if cached_data:
-            print(f"📦 Using cached stock info for {symbol}")
-            return cached_data
-        
+        """獲取股票基本信息（帶緩存，過期後先返回舊數據並在後台刷新）"""
         try:
-            print(f"🌐 Fetching fresh stock info for {symbol}...")
-            ticker = self.safe_yfinance_request(symbol)
-            if not ticker:
-                print(f"Failed to get ticker for {symbol}")
-                fallback_data = self._get_fallback_stock_info(symbol)
-                # 緩存回退數據（較短時間）
-                cache_manager.set('stock_info', symbol, fallback_data)
-                return fallback_data
-            
-            # 嘗試獲取info，如果失敗則使用回退數據
-            try:
-                info = ticker.info
-                if not info or len(info) <= 1:
-                    print(f"Empty info for {symbol}, using fallback data")
-                    fallback_data = self._get_fallback_stock_info(symbol)
-                    cache_manager.set('stock_info', symbol, fallback_data)
-                    return fallback_data
-            except Exception as e:
-                print(f"Error getting info for {symbol}: {e}, using fallback data")
-                fallback_data = self._get_fallback_stock_info(symbol)
-                cache_manager.set('stock_info', symbol, fallback_data)
-                return fallback_data
-            
-            # 處理缺失數據，提供更有意義的默認值
-            def safe_get(key, default=None, data_type=None):
-                value = info.get(key, default)
-                if value is None or value == 'N/A' or (isinstance(value, (int, float)) and np.isnan(value)):
-                    return default
-                if data_type == 'float' and isinstance(value, (int, float)):
-                    return float(value) if not np.isnan(value) else default
-                return value
-            
-            # 獲取當前價格，嘗試多個字段
-            current_price = (safe_get('currentPrice', 0, 'float') or 
-                           safe_get('regularMarketPrice', 0, 'float') or 
-                           safe_get('previousClose', 0, 'float'))
-            
-            # 獲取公司名稱，嘗試多個字段
-            company_name = (safe_get('longName') or 
-                          safe_get('shortName') or 
-                          symbol)
-            
-            # 獲取行業信息
-            sector = safe_get('sector') or '未分類'
-            industry = safe_get('industry') or '未分類'
-            
-            stock_info = {
-                'symbol': symbol,
-                'name': company_name,
-                'sector': sector,
-                'industry': industry,
-                'market_cap': safe_get('marketCap', 0, 'float'),
-                'pe_ratio': safe_get('trailingPE', None, 'float'),
-                'forward_pe': safe_get('forwardPE', None, 'float'),
-                'price_to_book': safe_get('priceToBook', None, 'float'),
-                'debt_to_equity': safe_get('debtToEquity', None, 'float'),
-                'roe': safe_get('returnOnEquity', None, 'float'),
-                'profit_margin': safe_get('profitMargins', None, 'float'),
-                'current_price': current_price,
-                'target_price': safe_get('targetMeanPrice', None, 'float'),
-                'recommendation': safe_get('recommendationMean', None, 'float'),
-                'data_source': 'yahoo_finance',
-                'last_updated': datetime.now().isoformat()
-            }
-            
-            # 緩存成功獲取的數據
-            cache_manager.set('stock_info', symbol, stock_info)
-            print(f"💾 Cached stock info for {symbol}")
+            stock_info = cache_manager.get_or_compute('stock_info', symbol,
+                                                      lambda: self._fetch_stock_info(symbol))
+            if stock_info is None:
+                # 上游失敗且沒有舊數據時才使用回退數據，回退數據不緩存
+                print(f"Using fallback stock info for {symbol}")
+                return self._get_fallback_stock_info(symbol)
             return stock_info
         except Exception as e:
             print(f"Error fetching stock info for {symbol}: {e}")
@@ -297,55 +237,263 @@ class DataCollector:
                 'recommendation': None
             }
     
-    def get_stock_prices(self, symbol: str, period: str = "1y") -> List[Dict]:
-        """獲取股價歷史數據（帶緩存）"""
+    def _fetch_stock_info(self, symbol: str) -> Optional[Dict]:
+        """從Yahoo Finance獲取股票基本信息（結果由調用方緩存）；上游失敗時返回None，保留舊的緩存條目"""
+        print(f"🌐 Fetching fresh stock info for {symbol}...")
+        ticker = self.safe_yfinance_request(symbol)
+        if not ticker:
+            print(f"Failed to get ticker for {symbol}")
+            return None
+        
+        try:
+            info = ticker.info
+            if not info or len(info) <= 1:
+                print(f"Empty info for {symbol}")
+                return None
+        except Exception as e:
+            print(f"Error getting info for {symbol}: {e}")
+            return None
+        
+        # 處理缺失數據，提供更有意義的默認值
+        def safe_get(key, default=None, data_type=None):
+            value = info.get(key, default)
+            if value is None or value == 'N/A' or (isinstance(value, (int, float)) and np.isnan(value)):
+                return default
+            if data_type == 'float' and isinstance(value, (int, float)):
+                return float(value) if not np.isnan(value) else default
+            return value
+        
+        # 獲取當前價格，嘗試多個字段
+        current_price = (safe_get('currentPrice', 0, 'float') or 
+                       safe_get('regularMarketPrice', 0, 'float') or 
+                       safe_get('previousClose', 0, 'float'))
+        
+        # 獲取公司名稱，嘗試多個字段
+        company_name = (safe_get('longName') or 
+                      safe_get('shortName') or 
+                      symbol)
+        
+        # 獲取行業信息
+        sector = safe_get('sector') or '未分類'
+        industry = safe_get('industry') or '未分類'
+        
+        stock_info = {
+            'symbol': symbol,
+            'name': company_name,
+            'sector': sector,
+            'industry': industry,
+            'market_cap': safe_get('marketCap', 0, 'float'),
+            'pe_ratio': safe_get('trailingPE', None, 'float'),
+            'forward_pe': safe_get('forwardPE', None, 'float'),
+            'price_to_book': safe_get('priceToBook', None, 'float'),
+            'debt_to_equity': safe_get('debtToEquity', None, 'float'),
+            'roe': safe_get('returnOnEquity', None, 'float'),
+            'profit_margin': safe_get('profitMargins', None, 'float'),
+            'current_price': current_price,
+            'target_price': safe_get('targetMeanPrice', None, 'float'),
+            'recommendation': safe_get('recommendationMean', None, 'float'),
+            'data_source': 'yahoo_finance',
+            'last_updated': datetime.now().isoformat()
+        }
+        
+        print(f"💾 Caching stock info for {symbol}")
+        return stock_info
+    
+    def get_stock_prices(self, symbol: str, period: str = "1y") -> PriceSeries:
+        """獲取股價歷史數據（帶緩存）
+        
+        返回按日期排序的 PriceSeries，緩存中保存的也是同一個對象；
+        需要JSON記錄時調用 to_records()。緩存過期後只增量請求最後一根K線之後的數據。
+        """
         # 檢查緩存
         cache_key = f"{symbol}_{period}"
+        cache_tags = [f"symbol:{symbol}", f"period:{period}"]
         cached_data = cache_manager.get('price_data', cache_key)
         if cached_data:
             print(f"📦 Using cached price data for {symbol} ({period})")
-            return cached_data
+            return as_price_series(cached_data)
         
         try:
             print(f"🌐 Fetching fresh price data for {symbol} ({period})...")
-            ticker = self.safe_yfinance_request(symbol)
-            if not ticker:
-                print(f"Failed to get ticker for {symbol}")
-                return []
-            
-            # 添加延遲避免請求過快
-            time.sleep(self.request_delay)
-            
-            hist = ticker.history(period=period)
+            price_data = self._fetch_history(symbol, period)
+            if price_data is None:
+                return PriceSeries.empty()
             
-            if hist.empty:
+            if not len(price_data):
                 print(f"No price data found for {symbol}, using fallback data")
                 # 提供回退價格數據
-                fallback_prices = self._get_fallback_price_data(symbol, period)
-                cache_manager.set('price_data', cache_key, fallback_prices)
+                fallback_prices = PriceSeries.from_records(self._get_fallback_price_data(symbol, period))
+                cache_manager.set('price_data', cache_key, fallback_prices,
+                                  tags=cache_tags + ['source:fallback'])
                 return fallback_prices
             
-            price_data = []
-            for date, row in hist.iterrows():
-                price_data.append({
-                    'date': date.strftime('%Y-%m-%d'),
-                    'open': float(row['Open']),
-                    'high': float(row['High']),
-                    'low': float(row['Low']),
-                    'close': float(row['Close']),
-                    'volume': int(row['Volume']),
-                    'adj_close': float(row['Close'])  # Yahoo Finance已調整
-                })
-            
             # 緩存價格數據
-            cache_manager.set('price_data', cache_key, price_data)
+            cache_manager.set('price_data', cache_key, price_data, tags=cache_tags + ['source:yahoo_finance'])
             print(f"💾 Cached {len(price_data)} price records for {symbol}")
             return price_data
             
         except Exception as e:
             print(f"Error fetching price data for {symbol}: {e}")
-            return []
+            return PriceSeries.empty()
+    
+    def _fetch_history(self, symbol: str, period: str) -> Optional[PriceSeries]:
+        """從Yahoo Finance獲取週期數據
+        
+        已保存的歷史覆蓋該週期時只請求缺少的部分並追加，否則完整下載該週期；
+        不再先請求 ticker.info 驗證代碼。配額不足時返回None，上游沒有數據時返回空序列。
+        """
+        ticker = yf.Ticker(symbol)
+        stored, fetch_start = price_history_store.plan(symbol, period)
+        if stored is not None:
+            if not rate_limiter.acquire('yahoo_finance', timeout=self.rate_limit_timeout, use_global=False):
+                print(f"⏳ Rate limit for yahoo_finance: no quota for {symbol} history")
+                return None
+            hist = ticker.history(start=str(fetch_start), end=self._history_end())
+            newer = PriceSeries.from_history(hist) if not hist.empty else PriceSeries.empty()
+            merged = price_history_store.append(symbol, stored, newer)
+            if merged is not None:
+                print(f"📈 Incremental update for {symbol}: {len(newer)} bars since {fetch_start}")
+                return price_history_store.slice(merged, period)
+        
+        # 歷史數據需要配額
+        if not rate_limiter.acquire('yahoo_finance', timeout=self.rate_limit_timeout, use_global=False):
+            print(f"⏳ Rate limit for yahoo_finance: no quota for {symbol} history")
+            return None
+        hist = ticker.history(period=period)
+        if hist.empty:
+            return PriceSeries.empty()
+        return price_history_store.save_full(symbol, period, PriceSeries.from_history(hist))
+    
+    @staticmethod
+    def _history_end() -> str:
+        """增量請求的結束日期（不含），取明天以包括今天的K線"""
+        return (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+    
+    def _download_split(self, chunk: List[str], **kwargs) -> Optional[Dict[str, PriceSeries]]:
+        """一次 yf.download 請求多隻股票並按股票拆分；配額不足或請求失敗（例如429）時返回None"""
+        if not rate_limiter.acquire('yahoo_finance', timeout=self.rate_limit_timeout, use_global=False):
+            print("⏳ Rate limit for yahoo_finance: no quota for bulk download")
+            return None
+        try:
+            # auto_adjust 與 Ticker.history 的默認值一致
+            data = yf.download(chunk, group_by='ticker', auto_adjust=True, threads=False, progress=False,
+                               **kwargs)
+        except Exception as e:
+            print(f"Bulk download failed for {len(chunk)} symbols: {e}")
+            return None
+        
+        results = {}
+        if data is not None and not data.empty:
+            for symbol in chunk:
+                try:
+                    if isinstance(data.columns, pd.MultiIndex):
+                        if symbol not in data.columns.get_level_values(0):
+                            continue
+                        hist = data[symbol]
+                    else:
+                        hist = data  # 單隻股票時部分yfinance版本不分組
+                    # 不同市場的交易日不同，合併後的空行需要去掉
+                    hist = hist.dropna(subset=['Close'])
+                    results[symbol] = PriceSeries.from_history(hist) if not hist.empty else PriceSeries.empty()
+                except Exception as e:
+                    print(f"Error splitting bulk data for {symbol}: {e}")
+        
+        # yf.download 會吞掉每隻股票的錯誤（包括429），返回空表或全空的列；
+        # 多隻股票全部沒有數據時按請求失敗處理，不再逐隻重新請求
+        if len(chunk) > 1 and not any(len(price_data) for price_data in results.values()):
+            print(f"Bulk download returned no data for {len(chunk)} symbols")
+            return None
+        return results
+    
+    def get_stock_prices_bulk(self, symbols: List[str], period: str = "1y",
+                              fallback: bool = True) -> Dict[str, PriceSeries]:
+        """批量獲取多隻股票的歷史價格
+        
+        緩存未命中的股票每 bulk_chunk_size 隻合併為一次 yf.download 請求：
+        已有歷史的股票從該批最早的缺失日期開始增量下載，其餘完整下載該週期。
+        結果按股票拆分後分別寫入 price_data 緩存（與 get_stock_prices 相同的鍵）。
+        批量結果中沒有數據的股票再單獨調用 get_stock_prices（包括回退數據）；
+        fallback=False 時直接不返回這些股票。配額不足或批量請求失敗時不再下載剩餘的批次，也不逐隻請求：
+        這些股票返回已保存的（可能過期的）歷史，沒有歷史的與 get_stock_prices 一樣返回空序列。
+        """
+        results = {}
+        incremental = {}  # symbol -> (已保存的歷史, 增量起始日期)
+        full = []
+        for symbol in dict.fromkeys(symbols):
+            cached_data = cache_manager.get('price_data', f"{symbol}_{period}")
+            if cached_data:
+                results[symbol] = as_price_series(cached_data)
+                continue
+            stored, fetch_start = price_history_store.plan(symbol, period)
+            if stored is not None:
+                incremental[symbol] = (stored, fetch_start)
+            else:
+                full.append(symbol)
+        
+        misses = list(incremental) + full
+        if misses:
+            print(f"📦 {len(results)} cached, bulk downloading {len(incremental)} incremental "
+                  f"and {len(full)} full ({period})...")
+        
+        def store(symbol, price_data):
+            cache_manager.set('price_data', f"{symbol}_{period}", price_data,
+                              tags=[f"symbol:{symbol}", f"period:{period}", 'source:yahoo_finance'])
+            results[symbol] = price_data
+        
+        requested = set()  # 批量請求確實下載了的股票；其餘因配額不足或請求失敗而未下載
+        throttled = False
+        pending = list(incremental)
+        for offset in range(0, len(pending), self.bulk_chunk_size):
+            chunk = pending[offset:offset + self.bulk_chunk_size]
+            downloaded = self._download_split(chunk, start=str(min(incremental[s][1] for s in chunk)),
+                                              end=self._history_end())
+            if downloaded is None:
+                throttled = True
+                break
+            requested.update(chunk)
+            for symbol in chunk:
+                stored, fetch_start = incremental[symbol]
+                newer = downloaded.get(symbol, PriceSeries.empty())
+                merged = price_history_store.append(symbol, stored, newer.since(fetch_start))
+                if merged is None:
+                    full.append(symbol)  # 復權變化，完整重新下載
+                    requested.discard(symbol)
+                else:
+                    store(symbol, price_history_store.slice(merged, period))
+        
+        for offset in range(0, len(full), self.bulk_chunk_size):
+            if throttled:
+                break  # 已經拿不到配額或上游失敗，剩餘批次不再請求
+            chunk = full[offset:offset + self.bulk_chunk_size]
+            downloaded = self._download_split(chunk, period=period)
+            if downloaded is None:
+                throttled = True
+                break
+            requested.update(chunk)
+            for symbol, price_data in downloaded.items():
+                if len(price_data):
+                    store(symbol, price_history_store.save_full(symbol, period, price_data))
+        
+        missing = [symbol for symbol in misses if symbol not in results]
+        if misses:
+            print(f"💾 Bulk cached {len(misses) - len(missing)}/{len(misses)} symbols ({period})")
+        
+        skipped = [symbol for symbol in missing if symbol not in requested]
+        if skipped:
+            print(f"⏳ Bulk download unavailable for {len(skipped)} symbols, using stored history")
+        for symbol in skipped:
+            # 過期的歷史不寫入 price_data 緩存，下次請求會重新下載
+            if symbol in incremental:
+                results[symbol] = price_history_store.slice(incremental[symbol][0], period)
+            elif fallback:
+                results[symbol] = PriceSeries.empty()
+        if fallback:
+            for symbol in missing:
+                if symbol in requested:
+                    results[symbol] = self.get_stock_prices(symbol, period)
+        return results
     
+    @cached('financial_data')
     def get_financial_statements(self, symbol: str) -> Dict:
         """獲取財務報表數據"""
         try:
@@ -654,6 +802,7 @@ class DataCollector:
         print(f"📊 Final indicators: {list(indicators.keys())}")
         return indicators
     
+    @cached('news')
     def get_market_news(self, symbol: str, limit: int = 5) -> List[Dict]:
         """獲取市場新聞（使用免費新聞源）"""
         try:
@@ -696,22 +845,20 @@ class DataCollector:
                 '電信股': ['0941.HK', '0728.HK', '0762.HK']   # 中移動、中電信、中聯通
             }
             
+            # 所有行業的代表股票合併為一次批量下載
+            all_stocks = [stock for stocks in hk_sectors.values() for stock in stocks]
+            prices = self.get_stock_prices_bulk(all_stocks, "5d", fallback=False)
+            
             sector_data = {}
             for sector, stocks in hk_sectors.items():
                 try:
                     # 計算該行業的平均表現
                     sector_changes = []
                     for stock in stocks:
-                        try:
-                            ticker = yf.Ticker(stock)
-                            hist = ticker.history(period="5d")
-                            if not hist.empty:
-                                current_price = hist['Close'][-1]
-                                prev_price = hist['Close'][0]
-                                change_pct = ((current_price - prev_price) / prev_price) * 100
-                                sector_changes.append(change_pct)
-                        except:
-                            continue
+                        series = prices.get(stock)
+                        if series is not None and len(series) >= 2 and series.close[0]:
+                            change_pct = ((series.close[-1] - series.close[0]) / series.close[0]) * 100
+                            sector_changes.append(change_pct)
                     
                     if sector_changes:
                         avg_change = sum(sector_changes) / len(sector_changes)
@@ -0,0 +1,116 @@
+"""
+共享HTTP連接池
+所有REST數據源共用一個 requests.Session：按主機配置連接池大小、keep-alive復用連接，
+只有5xx按短暫的指數退避重試；429直接返回給調用方，由熔斷器和限速器處理，
+不在工作線程內按 Retry-After 睡眠，也不繞過令牌桶額外發出請求。超時分為連接和讀取兩部分
+"""
+import os
+import threading
+from typing import Dict, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 每個主機的最大連接數（大致按各數據源的速率限制和對沖並發設置）
+HOST_POOL_SIZES = {
+    'www.alphavantage.co': 2,
+    'finnhub.io': 8,
+    'api.twelvedata.com': 2,
+    'api.marketstack.com': 2,
+    'cloud.iexapis.com': 2,
+    'www.quandl.com': 4
+}
+
+class PooledHTTPClient:
+    """帶連接池和重試的HTTP客戶端，並統計每個主機的連接復用情況"""
+
+    def __init__(self, default_pool_size: int = 4, retries: int = 2, backoff_factor: float = 0.5,
+                 timeout: Tuple[float, float] = (3.05, 10.0), host_pool_sizes: Dict[str, int] = None):
+        self.timeout = timeout  # (連接超時, 讀取超時)
+        self.retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            respect_retry_after_header=False,  # 503的 Retry-After 也可能很長，只按退避間隔等待
+            raise_on_status=False  # 重試用盡後返回最後的響應
+        )
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': 'investment-analyzer/1.0'})
+
+        self.adapters = {}  # host -> HTTPAdapter
+        default_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=default_pool_size,
+                                      max_retries=self.retry)
+        self.session.mount('https://', default_adapter)
+        self.session.mount('http://', default_adapter)
+        self.default_adapter = default_adapter
+        for host, size in (host_pool_sizes if host_pool_sizes is not None else HOST_POOL_SIZES).items():
+            self.configure_host(host, size)
+
+        self.lock = threading.Lock()
+        self.host_stats = {}  # host -> {'requests', 'errors', 'retries'}
+
+    def configure_host(self, host: str, pool_size: int):
+        """為單個主機設置獨立的連接池大小"""
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=self.retry)
+        self.session.mount(f'https://{host}/', adapter)
+        self.session.mount(f'http://{host}/', adapter)
+        self.adapters[host] = adapter
+
+    def get(self, url: str, params: Dict = None, timeout=None, **kwargs) -> requests.Response:
+        """發送GET請求；timeout 默認使用 (連接, 讀取) 超時"""
+        host = urlsplit(url).hostname
+        try:
+            response = self.session.get(url, params=params, timeout=timeout or self.timeout, **kwargs)
+        except requests.RequestException:
+            self._count(host, errors=1)
+            raise
+        history = getattr(response.raw, 'retries', None)
+        self._count(host, retries=len(history.history) if history is not None else 0)
+        return response
+
+    def _count(self, host: str, errors: int = 0, retries: int = 0):
+        with self.lock:
+            stats = self.host_stats.setdefault(host, {'requests': 0, 'errors': 0, 'retries': 0})
+            stats['requests'] += 1
+            stats['errors'] += errors
+            stats['retries'] += retries
+
+    def _pool_counters(self) -> Dict[str, Dict]:
+        """從urllib3連接池讀取每個主機新建的連接數和發出的請求數"""
+        counters = {}
+        for adapter in [self.default_adapter] + list(self.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                entry = counters.setdefault(pool.host, {'connections_opened': 0, 'pool_requests': 0, 'pool_size': 0})
+                entry['connections_opened'] += pool.num_connections
+                entry['pool_requests'] += pool.num_requests
+                entry['pool_size'] = max(entry['pool_size'], pool.pool.maxsize if pool.pool else 0)
+        return counters
+
+    def get_stats(self) -> Dict:
+        """每個主機的請求數、新建連接數和連接復用率"""
+        with self.lock:
+            host_stats = {host: dict(stats) for host, stats in self.host_stats.items()}
+        for host, counters in self._pool_counters().items():
+            stats = host_stats.setdefault(host, {'requests': 0, 'errors': 0, 'retries': 0})
+            stats.update(counters)
+            reused = max(0, counters['pool_requests'] - counters['connections_opened'])
+            stats['connections_reused'] = reused
+            stats['reuse_rate'] = round(reused / counters['pool_requests'], 3) if counters['pool_requests'] else 0.0
+        return {
+            'timeout': {'connect': self.timeout[0], 'read': self.timeout[1]},
+            'max_retries': self.retry.total,
+            'hosts': host_stats
+        }
+
+# 全局實例；HTTP_CONNECT_TIMEOUT / HTTP_READ_TIMEOUT 設置超時（秒），HTTP_MAX_RETRIES 設置5xx重試次數
+http_client = PooledHTTPClient(
+    retries=int(os.getenv('HTTP_MAX_RETRIES', '2')),
+    timeout=(float(os.getenv('HTTP_CONNECT_TIMEOUT', '3.05')), float(os.getenv('HTTP_READ_TIMEOUT', '10')))
+)
@@ -1,5 +1,4 @@
 import yfinance as yf
-import requests
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
@@ -7,8 +6,16 @@ from typing import Dict, List, Optional, Tuple
 import os
 import time
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
 from cache_manager import cache_manager, cached
+from rate_limiter import rate_limiter, YAHOO_FINANCE_PER_MINUTE
+from source_router import source_router
+from circuit_breaker import circuit_breakers, is_rate_limit_error, is_upstream_failure
+from symbol_resolver import symbol_resolver, is_not_found_error
+from http_client import http_client
+from async_fetch_engine import create_engine
 
 load_dotenv()
 
@@ -26,16 +33,15 @@ class MultiSourceDataCollector:
         self.quandl_key = os.getenv('QUANDL_API_KEY', 'demo')
         
         # 請求限制配置
-        self.request_delay = 2.0  # 基礎請求間隔（增加以避免速率限制）
         self.max_retries = 2      # 每個源的最大重試次數（減少以避免過多請求）
         self.max_concurrent = 2   # 最大並發請求數（減少以避免速率限制）
-        self.retry_delay = 5.0    # 重試間隔（增加以避免速率限制）
-        self.rate_limit_window = 60  # 速率限制窗口（秒）
-        self.max_requests_per_window = 30  # 每個窗口最大請求數
+        self.rate_limit_timeout = 5.0  # 首選數據源等待配額的最長時間（秒）
         
-        # 全局速率限制追蹤
-        self.request_history = []
-        self.last_request_time = {}
+        # 對沖請求配置：首選源超過 hedge_delay 秒未返回時啟動下一個源，取最先返回的有效結果
+        self.hedge_enabled = os.getenv('MULTI_SOURCE_HEDGE', 'true').lower() == 'true'
+        self.hedge_delay = float(os.getenv('MULTI_SOURCE_HEDGE_DELAY', '1.5'))
+        self.hedge_timeout = 20.0  # 等待所有源的總時間上限（秒）
+        self.hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='source-hedge')
         
         # API源配置
         self.data_sources = [
@@ -43,7 +49,7 @@ class MultiSourceDataCollector:
                 'name': 'yahoo_finance',
                 'priority': 1,
                 'enabled': True,
-                'rate_limit': 100,  # 每分鐘請求數
+                'rate_limit': YAHOO_FINANCE_PER_MINUTE,  # 每分鐘請求數（RATE_LIMIT_YAHOO_PER_MINUTE）
                 'last_request': 0,
                 'success_rate': 0.9,
                 'fallback': False
@@ -104,384 +110,351 @@ class MultiSourceDataCollector:
             }
         ]
         
-        # 統計信息
+        # 每個數據源一個令牌桶，全局上限由共享限速器的全局桶負責
+        for source in self.data_sources:
+            rate_limiter.configure(source['name'], source['rate_limit'])
+        
+        self.fetchers = {
+            'yahoo_finance': self._fetch_from_yahoo_finance,
+            'alpha_vantage': self._fetch_from_alpha_vantage,
+            'finnhub': self._fetch_from_finnhub,
+            'twelve_data': self._fetch_from_twelve_data,
+            'marketstack': self._fetch_from_marketstack,
+            'iex_cloud': self._fetch_from_iex_cloud,
+            'quandl': self._fetch_from_quandl
+        }
+        
+        # 批量獲取時REST數據源在異步引擎中以協程並發執行（需要aiohttp）
+        self.async_engine = create_engine(self)
+        
+        # 當前線程正在進行的數據源調用（由 _fetch_from_source 設置）
+        self.attempt = threading.local()
+        
+        # 統計信息（對沖模式下多個線程同時更新，需要加鎖）
+        self.stats_lock = threading.Lock()
         self.stats = {
             'total_requests': 0,
             'successful_requests': 0,
             'failed_requests': 0,
-            'source_usage': {}
+            'source_usage': {},
+            'hedged_fetches': 0,   # 啟動了備用源的獲取次數
+            'hedges_launched': 0,  # 因首選源超時而提前啟動的備用請求數
+            'hedge_wins': 0        # 結果來自非首選源的次數
         }
         
         print("🚀 MultiSourceDataCollector initialized")
     
     def _can_make_request(self, source_name: str) -> bool:
-        """檢查是否可以發送請求（基於速率限制）"""
+        """從共享限速器獲取請求配額
+        
+        排在首位的數據源最多等待 rate_limit_timeout 秒，備用源只嘗試一次，
+        配額不足時直接換下一個源，避免整個請求被備用源阻塞。
+        """
         source = next((s for s in self.data_sources if s['name'] == source_name), None)
         if not source or not source['enabled']:
             return False
         
-        current_time = time.time()
-        
-        # 檢查全局速率限制
-        self.request_history = [t for t in self.request_history if current_time - t < self.rate_limit_window]
-        if len(self.request_history) >= self.max_requests_per_window:
-            print(f"⚠️ Global rate limit reached: {len(self.request_history)} requests in {self.rate_limit_window}s")
+        timeout = self.rate_limit_timeout if getattr(self.attempt, 'wait_for_quota', True) else 0
+        wait_start = time.time()
+        if not rate_limiter.acquire(source_name, timeout=timeout):
+            print(f"⏳ Rate limit for {source_name}: no quota available")
             return False
         
-        # 檢查特定源的速率限制
-        time_since_last = current_time - source['last_request']
-        min_interval = 60.0 / source['rate_limit']  # 最小間隔
-        
-        if time_since_last < min_interval:
-            wait_time = min_interval - time_since_last
-            print(f"⏳ Rate limit for {source_name}: wait {wait_time:.1f}s")
-            return False
-        
-        # 記錄請求
-        source['last_request'] = current_time
-        self.request_history.append(current_time)
-        
+        # 路由評分的耗時從拿到配額開始計算；重試時再次等待配額的時間也不計入
+        now = time.time()
+        started_at = getattr(self.attempt, 'started_at', None)
+        self.attempt.started_at = now if started_at is None else started_at + (now - wait_start)
+        source['last_request'] = now
         return True
     
-    def _update_source_stats(self, source_name: str, success: bool):
-        """更新源統計信息"""
-        source = next((s for s in self.data_sources if s['name'] == source_name), None)
-        if source:
-            source['last_request'] = time.time()
-            if success:
-                source['success_rate'] = min(1.0, source['success_rate'] + 0.01)
-            else:
-                source['success_rate'] = max(0.0, source['success_rate'] - 0.05)
+    def _update_source_stats(self, source_name: str, success: bool, rate_limited: bool = False,
+                             symbol_miss: bool = False):
+        """更新源統計信息和熔斷器狀態
         
-        self.stats['total_requests'] += 1
+        rate_limited 表示上游返回429；symbol_miss 表示數據源正常響應但該代碼沒有有效數據，
+        只計入請求統計，不計入共享的熔斷器。
+        """
+        source = next((s for s in self.data_sources if s['name'] == source_name), None)
+        # 標記本次調用確實請求了上游，_fetch_from_source 據此把耗時計入路由評分
+        self.attempt.requested = True
+        breaker = circuit_breakers.get(source_name)
         if success:
-            self.stats['successful_requests'] += 1
+            breaker.record_success()
+        elif symbol_miss:
+            breaker.release()
         else:
-            self.stats['failed_requests'] += 1
-        
-        self.stats['source_usage'][source_name] = self.stats['source_usage'].get(source_name, 0) + 1
+            breaker.record_failure(rate_limited=rate_limited)
+        with self.stats_lock:
+            if source:
+                source['last_request'] = time.time()
+            
+            self.stats['total_requests'] += 1
+            if success:
+                self.stats['successful_requests'] += 1
+            else:
+                self.stats['failed_requests'] += 1
+            
+            self.stats['source_usage'][source_name] = self.stats['source_usage'].get(source_name, 0) + 1
     
     def _fetch_from_yahoo_finance(self, symbol: str) -> Tuple[bool, Dict]:
         """從Yahoo Finance獲取數據（帶重試機制）"""
+        # 嘗試不同的符號格式
+        symbol_variants = [
+            symbol,  # 原始符號
+            symbol.replace('.HK', ''),  # 移除.HK
+            symbol.replace('.HK', '.HK'),  # 確保.HK格式
+            symbol.replace('.HK', '.SI') if '.HK' in symbol else symbol,  # 嘗試新加坡格式
+            symbol.replace('.HK', '.TO') if '.HK' in symbol else symbol,  # 嘗試多倫多格式
+            symbol.replace('.HK', '.L') if '.HK' in symbol else symbol,   # 嘗試倫敦格式
+            symbol.replace('.HK', '.AX') if '.HK' in symbol else symbol,  # 嘗試澳洲格式
+            symbol.replace('.HK', '.PA') if '.HK' in symbol else symbol   # 嘗試巴黎格式
+        ]
+        
+        # 本次查詢中返回空數據的變體；可能是上游限速，查詢結束時每個變體只計一次
+        empty_variants = []
+        upstream_error = None  # 傳輸錯誤或5xx，只有這類失敗計入熔斷器
+        
         for retry in range(self.max_retries):
+            # 先嘗試上次可用的變體，跳過已確認沒有數據的變體；全部無效時不發出請求
+            candidates = symbol_resolver.candidates(symbol, symbol_variants)
+            if not candidates:
+                print(f"⏭️ No usable Yahoo Finance variant for {symbol}")
+                return False, {}
+            
             try:
+                # 限速器已在內部等待配額，仍然拿不到就不再重試
                 if not self._can_make_request('yahoo_finance'):
-                    if retry < self.max_retries - 1:
-                        time.sleep(self.retry_delay)
-                        continue
                     return False, {}
                 
                 print(f"🔍 Fetching from Yahoo Finance: {symbol} (attempt {retry + 1})")
                 
-                # 嘗試不同的符號格式
-                symbol_variants = [
-                    symbol,  # 原始符號
-                    symbol.replace('.HK', ''),  # 移除.HK
-                    symbol.replace('.HK', '.HK'),  # 確保.HK格式
-                    symbol.replace('.HK', '.SI') if '.HK' in symbol else symbol,  # 嘗試新加坡格式
-                    symbol.replace('.HK', '.TO') if '.HK' in symbol else symbol,  # 嘗試多倫多格式
-                    symbol.replace('.HK', '.L') if '.HK' in symbol else symbol,   # 嘗試倫敦格式
-                    symbol.replace('.HK', '.AX') if '.HK' in symbol else symbol,  # 嘗試澳洲格式
-                    symbol.replace('.HK', '.PA') if '.HK' in symbol else symbol   # 嘗試巴黎格式
-                ]
-                
-                for variant in symbol_variants:
+                for variant in candidates:
                     try:
-                        ticker = yf.Ticker(variant)
-                        
-                        # 嘗試獲取基本信息
-                        info = ticker.info
-                        
-                        # 檢查是否有有效數據
-                        if info and len(info) > 1:
-                            # 驗證關鍵字段
-                            has_price = any([
-                                info.get('currentPrice'),
-                                info.get('regularMarketPrice'),
-                                info.get('previousClose'),
-                                info.get('close'),
-                                info.get('lastPrice')
-                            ])
-                            
-                            has_name = any([
-                                info.get('longName'),
-                                info.get('shortName'),
-                                info.get('symbol'),
-                                info.get('name')
-                            ])
-                            
-                                                    # 如果沒有價格數據，嘗試從歷史數據獲取
-                        if not has_price:
-                            try:
-                                hist = ticker.history(period="1d")
-                                if not hist.empty:
-                                    latest = hist.iloc[-1]
-                                    info['currentPrice'] = float(latest['Close'])
-                                    info['regularMarketPrice'] = float(latest['Close'])
-                                    info['previousClose'] = float(latest['Open'])
-                                    info['open'] = float(latest['Open'])
-                                    info['high'] = float(latest['High'])
-                                    info['low'] = float(latest['Low'])
-                                    info['volume'] = int(latest['Volume'])
-                                    has_price = True
-                                    print(f"📊 Got price from history: ${info['currentPrice']}")
-                            except Exception as e:
-                                print(f"Failed to get history: {e}")
-                        
-                        # 如果還是沒有價格，嘗試從其他字段獲取
-                        if not has_price:
-                            for price_field in ['close', 'lastPrice', 'price', 'current_price']:
-                                if info.get(price_field):
-                                    info['currentPrice'] = float(info[price_field])
-                                    info['regularMarketPrice'] = float(info[price_field])
-                                    has_price = True
-                                    print(f"📊 Got price from {price_field}: ${info['currentPrice']}")
-                                    break
-                            
-                            if has_price or has_name:
-                                print(f"✅ Yahoo Finance success for {variant}")
-                                self._update_source_stats('yahoo_finance', True)
-                                return True, info
-                        
-                        # 如果info為空，嘗試獲取歷史數據
-                        if not info or len(info) <= 1:
-                            hist = ticker.history(period="1d")
-                            if not hist.empty:
-                                # 從歷史數據構建基本信息
-                                latest = hist.iloc[-1]
-                                basic_info = {
-                                    'symbol': symbol,
-                                    'currentPrice': float(latest['Close']),
-                                    'regularMarketPrice': float(latest['Close']),
-                                    'previousClose': float(latest['Open']),
-                                    'longName': symbol,
-                                    'shortName': symbol,
-                                    'volume': int(latest['Volume']),
-                                    'marketCap': 0,
-                                    'sector': '未分類',
-                                    'industry': '未分類'
-                                }
-                                print(f"✅ Yahoo Finance success (from history) for {variant}")
-                                self._update_source_stats('yahoo_finance', True)
-                                return True, basic_info
-                                
+                        info = self._probe_yahoo_variant(symbol, variant)
                     except Exception as e:
-                        error_msg = str(e)
-                        if "429" in error_msg or "Too Many Requests" in error_msg:
-                            print(f"🚫 Rate limited for {variant}, skipping remaining variants")
-                            # 如果是速率限制，跳過剩餘變體
-                            break
-                        else:
-                            print(f"Yahoo Finance variant {variant} failed: {e}")
+                        if is_rate_limit_error(e):
+                            print(f"🚫 Rate limited for {variant}, skipping Yahoo Finance")
+                            # 被上游限速時重試只會更糟，直接換下一個數據源並熔斷
+                            self._update_source_stats('yahoo_finance', False, rate_limited=True)
+                            return False, {}
+                        print(f"Yahoo Finance variant {variant} failed: {e}")
+                        # 超時等臨時錯誤不寫負向條目，下次仍會嘗試
+                        if is_not_found_error(e):
+                            symbol_resolver.record_failure(symbol, variant)
+                        elif is_upstream_failure(e):
+                            upstream_error = e
                         continue
+                    
+                    if info:
+                        self._record_empty_variants(symbol, empty_variants)
+                        symbol_resolver.record_success(symbol, variant)
+                        self._update_source_stats('yahoo_finance', True)
+                        return True, info
+                    if variant not in empty_variants:
+                        empty_variants.append(variant)
                 
-                # 如果所有變體都失敗，等待後重試
+                # 如果所有變體都失敗則重試，重試間隔由限速器按配額安排
                 if retry < self.max_retries - 1:
-                    print(f"Retrying Yahoo Finance in {self.retry_delay} seconds...")
-                    time.sleep(self.retry_delay)
+                    print(f"Retrying Yahoo Finance for {symbol}...")
                     continue
                     
             except Exception as e:
                 print(f"Yahoo Finance error for {symbol}: {e}")
                 if retry < self.max_retries - 1:
-                    time.sleep(self.retry_delay)
                     continue
         
         print(f"❌ All Yahoo Finance attempts failed for {symbol}")
-        self._update_source_stats('yahoo_finance', False)
+        self._record_empty_variants(symbol, empty_variants)
+        # 所有變體都沒有數據只說明這個代碼無效或已退市，不影響其他代碼使用Yahoo Finance
+        self._update_source_stats('yahoo_finance', False, symbol_miss=upstream_error is None)
         return False, {}
     
-    def _fetch_from_alpha_vantage(self, symbol: str) -> Tuple[bool, Dict]:
-        """從Alpha Vantage獲取數據"""
-        try:
-            if not self._can_make_request('alpha_vantage'):
-                return False, {}
+    @staticmethod
+    def _record_empty_variants(symbol: str, variants: List[str]):
+        """空響應不等於代碼無效，交給解析表累計連續次數"""
+        for variant in variants:
+            symbol_resolver.record_empty(symbol, variant)
+    
+    def _probe_yahoo_variant(self, symbol: str, variant: str) -> Optional[Dict]:
+        """請求單個代碼變體；有有效數據時返回信息字典，上游沒有該代碼的數據時返回None"""
+        ticker = yf.Ticker(variant)
+        
+        # 嘗試獲取基本信息
+        info = ticker.info
+        
+        # 檢查是否有有效數據
+        if info and len(info) > 1:
+            # 驗證關鍵字段
+            has_price = any([
+                info.get('currentPrice'),
+                info.get('regularMarketPrice'),
+                info.get('previousClose'),
+                info.get('close'),
+                info.get('lastPrice')
+            ])
             
-            # 移除.HK後綴
-            clean_symbol = symbol.replace('.HK', '')
+            has_name = any([
+                info.get('longName'),
+                info.get('shortName'),
+                info.get('symbol'),
+                info.get('name')
+            ])
             
-            url = f"https://www.alphavantage.co/query"
-            params = {
+            # 如果沒有價格數據，嘗試從歷史數據獲取
+            if not has_price:
+                try:
+                    hist = ticker.history(period="1d")
+                    if not hist.empty:
+                        latest = hist.iloc[-1]
+                        info['currentPrice'] = float(latest['Close'])
+                        info['regularMarketPrice'] = float(latest['Close'])
+                        info['previousClose'] = float(latest['Open'])
+                        info['open'] = float(latest['Open'])
+                        info['high'] = float(latest['High'])
+                        info['low'] = float(latest['Low'])
+                        info['volume'] = int(latest['Volume'])
+                        has_price = True
+                        print(f"📊 Got price from history: ${info['currentPrice']}")
+                except Exception as e:
+                    print(f"Failed to get history: {e}")
+            
+            # 如果還是沒有價格，嘗試從其他字段獲取
+            if not has_price:
+                for price_field in ['close', 'lastPrice', 'price', 'current_price']:
+                    if info.get(price_field):
+                        info['currentPrice'] = float(info[price_field])
+                        info['regularMarketPrice'] = float(info[price_field])
+                        has_price = True
+                        print(f"📊 Got price from {price_field}: ${info['currentPrice']}")
+                        break
+            
+            if has_price or has_name:
+                print(f"✅ Yahoo Finance success for {variant}")
+                return info
+            return None
+        
+        # 如果info為空，嘗試從歷史數據構建基本信息
+        hist = ticker.history(period="1d")
+        if hist.empty:
+            return None
+        latest = hist.iloc[-1]
+        print(f"✅ Yahoo Finance success (from history) for {variant}")
+        return {
+            'symbol': symbol,
+            'currentPrice': float(latest['Close']),
+            'regularMarketPrice': float(latest['Close']),
+            'previousClose': float(latest['Open']),
+            'longName': symbol,
+            'shortName': symbol,
+            'volume': int(latest['Volume']),
+            'marketCap': 0,
+            'sector': '未分類',
+            'industry': '未分類'
+        }
+    
+    def _rest_request(self, source_name: str, symbol: str) -> Tuple[str, Dict, str]:
+        """構造REST數據源的請求，返回 (URL, 查詢參數, 去掉.HK後綴的代碼)；同步和異步獲取共用"""
+        # 移除.HK後綴
+        clean_symbol = symbol.replace('.HK', '')
+        
+        if source_name == 'alpha_vantage':
+            return "https://www.alphavantage.co/query", {
                 'function': 'OVERVIEW',
                 'symbol': clean_symbol,
                 'apikey': self.alpha_vantage_key
-            }
-            
-            response = requests.get(url, params=params, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                if data and 'Symbol' in data:
-                    # 轉換為統一格式
-                    converted_data = self._convert_alpha_vantage_data(data)
-                    self._update_source_stats('alpha_vantage', True)
-                    return True, converted_data
-            
-            self._update_source_stats('alpha_vantage', False)
-            return False, {}
-            
-        except Exception as e:
-            print(f"Alpha Vantage error for {symbol}: {e}")
-            self._update_source_stats('alpha_vantage', False)
-            return False, {}
+            }, clean_symbol
+        if source_name == 'finnhub':
+            return "https://finnhub.io/api/v1/quote", {
+                'symbol': clean_symbol,
+                'token': self.finnhub_key
+            }, clean_symbol
+        if source_name == 'twelve_data':
+            return "https://api.twelvedata.com/quote", {
+                'symbol': clean_symbol,
+                'apikey': self.twelve_data_key
+            }, clean_symbol
+        if source_name == 'marketstack':
+            return "http://api.marketstack.com/v1/intraday/latest", {
+                'access_key': self.marketstack_key,
+                'symbols': clean_symbol
+            }, clean_symbol
+        if source_name == 'iex_cloud':
+            return f"https://cloud.iexapis.com/stable/stock/{clean_symbol}/quote", {
+                'token': self.iex_cloud_key
+            }, clean_symbol
+        if source_name == 'quandl':
+            return f"https://www.quandl.com/api/v3/datasets/WIKI/{clean_symbol}/data.json", {
+                'api_key': self.quandl_key,
+                'limit': 1
+            }, clean_symbol
+        raise ValueError(f"Unknown REST source: {source_name}")
     
-    def _fetch_from_finnhub(self, symbol: str) -> Tuple[bool, Dict]:
-        """從Finnhub獲取數據"""
+    def _parse_rest_response(self, source_name: str, data, clean_symbol: str) -> Optional[Dict]:
+        """校驗REST數據源的JSON響應並轉換為統一格式，無有效數據時返回None"""
+        if not data:
+            return None
+        if source_name == 'alpha_vantage' and 'Symbol' in data:
+            return self._convert_alpha_vantage_data(data)
+        if source_name == 'finnhub' and 'c' in data:  # current price
+            return self._convert_finnhub_data(data, clean_symbol)
+        if source_name == 'twelve_data' and 'symbol' in data:
+            return self._convert_twelve_data_data(data)
+        if source_name == 'marketstack' and 'data' in data and len(data['data']) > 0:
+            return self._convert_marketstack_data(data['data'][0])
+        if source_name == 'iex_cloud' and 'symbol' in data:
+            return self._convert_iex_cloud_data(data)
+        if source_name == 'quandl' and 'dataset_data' in data and 'data' in data['dataset_data']:
+            return self._convert_quandl_data(data['dataset_data']['data'][0], clean_symbol)
+        return None
+    
+    def _fetch_from_rest(self, source_name: str, symbol: str) -> Tuple[bool, Dict]:
+        """通過共享連接池從REST數據源獲取數據"""
         try:
-            if not self._can_make_request('finnhub'):
+            if not self._can_make_request(source_name):
                 return False, {}
             
-            # 移除.HK後綴
-            clean_symbol = symbol.replace('.HK', '')
-            
-            url = f"https://finnhub.io/api/v1/quote"
-            params = {
-                'symbol': clean_symbol,
-                'token': self.finnhub_key
-            }
-            
-            response = requests.get(url, params=params, timeout=10)
+            url, params, clean_symbol = self._rest_request(source_name, symbol)
+            response = http_client.get(url, params=params)
             if response.status_code == 200:
-                data = response.json()
-                if data and 'c' in data:  # current price
-                    # 轉換為統一格式
-                    converted_data = self._convert_finnhub_data(data, clean_symbol)
-                    self._update_source_stats('finnhub', True)
+                # 轉換為統一格式
+                converted_data = self._parse_rest_response(source_name, response.json(), clean_symbol)
+                if converted_data:
+                    self._update_source_stats(source_name, True)
                     return True, converted_data
             
-            self._update_source_stats('finnhub', False)
+            # 200沒有有效數據或404只與這個代碼有關；429、5xx、401/403等計入熔斷器
+            self._update_source_stats(source_name, False, rate_limited=response.status_code == 429,
+                                      symbol_miss=response.status_code in (200, 404))
             return False, {}
             
         except Exception as e:
-            print(f"Finnhub error for {symbol}: {e}")
-            self._update_source_stats('finnhub', False)
+            print(f"{source_name} error for {symbol}: {e}")
+            self._update_source_stats(source_name, False, symbol_miss=not is_upstream_failure(e))
             return False, {}
     
+    def _fetch_from_alpha_vantage(self, symbol: str) -> Tuple[bool, Dict]:
+        """從Alpha Vantage獲取數據"""
+        return self._fetch_from_rest('alpha_vantage', symbol)
+    
+    def _fetch_from_finnhub(self, symbol: str) -> Tuple[bool, Dict]:
+        """從Finnhub獲取數據"""
+        return self._fetch_from_rest('finnhub', symbol)
+    
     def _fetch_from_twelve_data(self, symbol: str) -> Tuple[bool, Dict]:
         """從Twelve Data獲取數據"""
-        try:
-            if not self._can_make_request('twelve_data'):
-                return False, {}
-            
-            # 移除.HK後綴
-            clean_symbol = symbol.replace('.HK', '')
-            
-            url = "https://api.twelvedata.com/quote"
-            params = {
-                'symbol': clean_symbol,
-                'apikey': self.twelve_data_key
-            }
-            
-            response = requests.get(url, params=params, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                if data and 'symbol' in data:
-                    # 轉換為統一格式
-                    converted_data = self._convert_twelve_data_data(data)
-                    self._update_source_stats('twelve_data', True)
-                    return True, converted_data
-            
-            self._update_source_stats('twelve_data', False)
-            return False, {}
-            
-        except Exception as e:
-            print(f"Twelve Data error for {symbol}: {e}")
-            self._update_source_stats('twelve_data', False)
-            return False, {}
+        return self._fetch_from_rest('twelve_data', symbol)
     
     def _fetch_from_marketstack(self, symbol: str) -> Tuple[bool, Dict]:
         """從MarketStack獲取數據"""
-        try:
-            if not self._can_make_request('marketstack'):
-                return False, {}
-            
-            # 移除.HK後綴
-            clean_symbol = symbol.replace('.HK', '')
-            
-            url = "http://api.marketstack.com/v1/intraday/latest"
-            params = {
-                'access_key': self.marketstack_key,
-                'symbols': clean_symbol
-            }
-            
-            response = requests.get(url, params=params, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                if data and 'data' in data and len(data['data']) > 0:
-                    # 轉換為統一格式
-                    converted_data = self._convert_marketstack_data(data['data'][0])
-                    self._update_source_stats('marketstack', True)
-                    return True, converted_data
-            
-            self._update_source_stats('marketstack', False)
-            return False, {}
-            
-        except Exception as e:
-            print(f"MarketStack error for {symbol}: {e}")
-            self._update_source_stats('marketstack', False)
-            return False, {}
+        return self._fetch_from_rest('marketstack', symbol)
     
     def _fetch_from_iex_cloud(self, symbol: str) -> Tuple[bool, Dict]:
         """從IEX Cloud獲取數據"""
-        try:
-            if not self._can_make_request('iex_cloud'):
-                return False, {}
-            
-            # 移除.HK後綴
-            clean_symbol = symbol.replace('.HK', '')
-            
-            url = f"https://cloud.iexapis.com/stable/stock/{clean_symbol}/quote"
-            params = {
-                'token': self.iex_cloud_key
-            }
-            
-            response = requests.get(url, params=params, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                if data and 'symbol' in data:
-                    # 轉換為統一格式
-                    converted_data = self._convert_iex_cloud_data(data)
-                    self._update_source_stats('iex_cloud', True)
-                    return True, converted_data
-            
-            self._update_source_stats('iex_cloud', False)
-            return False, {}
-            
-        except Exception as e:
-            print(f"IEX Cloud error for {symbol}: {e}")
-            self._update_source_stats('iex_cloud', False)
-            return False, {}
+        return self._fetch_from_rest('iex_cloud', symbol)
     
     def _fetch_from_quandl(self, symbol: str) -> Tuple[bool, Dict]:
         """從Quandl獲取數據"""
-        try:
-            if not self._can_make_request('quandl'):
-                return False, {}
-            
-            # 移除.HK後綴
-            clean_symbol = symbol.replace('.HK', '')
-            
-            url = f"https://www.quandl.com/api/v3/datasets/WIKI/{clean_symbol}/data.json"
-            params = {
-                'api_key': self.quandl_key,
-                'limit': 1
-            }
-            
-            response = requests.get(url, params=params, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                if data and 'dataset_data' in data and 'data' in data['dataset_data']:
-                    # 轉換為統一格式
-                    converted_data = self._convert_quandl_data(data['dataset_data']['data'][0], clean_symbol)
-                    self._update_source_stats('quandl', True)
-                    return True, converted_data
-            
-            self._update_source_stats('quandl', False)
-            return False, {}
-            
-        except Exception as e:
-            print(f"Quandl error for {symbol}: {e}")
-            self._update_source_stats('quandl', False)
-            return False, {}
+        return self._fetch_from_rest('quandl', symbol)
     
     def _convert_alpha_vantage_data(self, data: Dict) -> Dict:
         """轉換Alpha Vantage數據為統一格式"""
@@ -731,68 +704,181 @@ class MultiSourceDataCollector:
         }
     
     def get_stock_info_multi_source(self, symbol: str) -> Dict:
-        """從多個源獲取股票信息"""
-        # 檢查緩存
-        cached_data = cache_manager.get('stock_info', symbol)
-        if cached_data:
-            print(f"📦 Using cached stock info for {symbol}")
-            return cached_data
-        
+        """從多個源獲取股票信息（帶緩存，過期後先返回舊數據並在後台刷新）"""
+        stock_info = cache_manager.get_or_compute('stock_info', symbol,
+                                                  lambda: self._fetch_stock_info_multi_source(symbol))
+        if stock_info is None:
+            # 所有源都失敗且沒有舊數據時才使用回退數據，回退數據不緩存
+            print(f"❌ All sources failed for {symbol}, using fallback data")
+            stock_info = self._get_fallback_data(symbol)
+            stock_info['last_updated'] = datetime.now().isoformat()
+        return stock_info
+    
+    def _fetch_stock_info_multi_source(self, symbol: str) -> Optional[Dict]:
+        """按優先級嘗試各數據源（結果由調用方緩存）；全部失敗時返回None，保留舊的緩存條目"""
         print(f"🌐 Fetching stock info for {symbol} from multiple sources...")
         
-        # 按優先級排序啟用的源
-        enabled_sources = [s for s in self.data_sources if s['enabled']]
-        enabled_sources.sort(key=lambda x: x['priority'])
-        
-        # 順序獲取數據（避免並發導致的速率限制問題）
-        best_data = None
-        best_source = None
+        # 按該市場的實時延遲和成功率排序啟用的源
+        enabled_sources = [s for s in self.data_sources if s['enabled'] and s['name'] in self.fetchers]
+        enabled_sources = source_router.rank(enabled_sources, symbol)
         
-        for source in enabled_sources:
-            try:
-                if source['name'] == 'yahoo_finance':
-                    success, data = self._fetch_from_yahoo_finance(symbol)
-                elif source['name'] == 'alpha_vantage':
-                    success, data = self._fetch_from_alpha_vantage(symbol)
-                elif source['name'] == 'finnhub':
-                    success, data = self._fetch_from_finnhub(symbol)
-                elif source['name'] == 'twelve_data':
-                    success, data = self._fetch_from_twelve_data(symbol)
-                elif source['name'] == 'marketstack':
-                    success, data = self._fetch_from_marketstack(symbol)
-                elif source['name'] == 'iex_cloud':
-                    success, data = self._fetch_from_iex_cloud(symbol)
-                elif source['name'] == 'quandl':
-                    success, data = self._fetch_from_quandl(symbol)
-                else:
-                    continue
-                
-                if success and data:
-                    best_data = data
-                    best_source = source['name']
-                    print(f"✅ Got data from {best_source}")
-                    break
-                    
-            except Exception as e:
-                print(f"Error from {source['name']}: {e}")
-                continue
+        if self.hedge_enabled:
+            best_source, best_data = self._fetch_hedged(symbol, enabled_sources)
+        else:
+            best_source, best_data = self._fetch_sequential(symbol, enabled_sources)
         
-        # 如果所有源都失敗，使用回退數據
         if not best_data:
-            print(f"❌ All sources failed for {symbol}, using fallback data")
-            best_data = self._get_fallback_data(symbol)
-            best_source = 'fallback'
+            return None
         
         # 添加元數據
         best_data['last_updated'] = datetime.now().isoformat()
         best_data['data_source'] = best_source
         
-        # 緩存數據
-        cache_manager.set('stock_info', symbol, best_data)
-        print(f"💾 Cached stock info for {symbol} from {best_source}")
-        
+        print(f"💾 Caching stock info for {symbol} from {best_source}")
         return best_data
     
+    def get_stock_info_many(self, symbols: List[str]) -> Dict[str, Dict]:
+        """批量獲取多隻股票信息
+        
+        緩存未命中的股票先交給異步引擎從REST數據源並發獲取，
+        引擎不可用、超時未完成或未取得數據的股票再逐個走同步的多源流程（包括Yahoo Finance和回退數據）；
+        引擎超時時已完成的股票照常使用，不會重複請求。
+        """
+        results = {}
+        misses = []
+        for symbol in dict.fromkeys(symbols):
+            cached_data = cache_manager.get('stock_info', symbol)
+            if cached_data is not None:
+                results[symbol] = cached_data
+            else:
+                misses.append(symbol)
+        
+        if misses and self.async_engine.available:
+            print(f"⚡ Fetching {len(misses)} symbols through async engine")
+            rest_sources = [name for name in self.fetchers if name != 'yahoo_finance']
+            for symbol, (source_name, data) in self.async_engine.fetch_many(misses, rest_sources).items():
+                data['last_updated'] = datetime.now().isoformat()
+                data['data_source'] = source_name
+                cache_manager.set('stock_info', symbol, data)
+                results[symbol] = data
+            misses = [symbol for symbol in misses if symbol not in results]
+        
+        if misses:
+            # 不能用 hedge_executor：同步流程本身會向它提交對沖請求
+            with ThreadPoolExecutor(max_workers=min(4, len(misses)), thread_name_prefix='batch-info') as executor:
+                for symbol, data in zip(misses, executor.map(self.get_stock_info_multi_source, misses)):
+                    results[symbol] = data
+        return results
+    
+    def _fetch_from_source(self, source_name: str, symbol: str, wait_for_quota: bool = False) -> Tuple[bool, Dict]:
+        """調用單個數據源，異常視為失敗；實際請求了上游時把耗時和結果計入路由評分
+        
+        熔斷中的數據源直接跳過，不佔用限速配額。耗時不包括等待限速配額的時間，
+        否則排在首位（阻塞等待配額）的數據源會被誤判為慢源。
+        """
+        breaker = circuit_breakers.get(source_name)
+        if not breaker.allow_request():
+            print(f"🔌 Circuit open for {source_name}, skipping")
+            return False, {}
+        
+        self.attempt.wait_for_quota = wait_for_quota
+        self.attempt.requested = False
+        self.attempt.started_at = None
+        start_time = time.time()
+        success, data = False, {}
+        try:
+            success, data = self.fetchers[source_name](symbol)
+        except Exception as e:
+            print(f"Error from {source_name}: {e}")
+            self.attempt.requested = True
+            if is_upstream_failure(e):
+                breaker.record_failure(rate_limited=is_rate_limit_error(e), error=str(e)[:200])
+            else:
+                breaker.release()
+        finally:
+            if self.attempt.requested:
+                source = next((s for s in self.data_sources if s['name'] == source_name), {})
+                # 不經過 _can_make_request 的數據源從調用開始計時
+                started_at = self.attempt.started_at or start_time
+                source_router.record(source_name, symbol, bool(success and data), time.time() - started_at,
+                                     prior_success=source.get('success_rate', 0.5))
+            else:
+                breaker.release()
+            del self.attempt.wait_for_quota
+            del self.attempt.requested
+            del self.attempt.started_at
+        return success, data
+    
+    def _fetch_sequential(self, symbol: str, sources: List[Dict]) -> Tuple[Optional[str], Optional[Dict]]:
+        """依次嘗試各數據源，返回第一個有效結果"""
+        for index, source in enumerate(sources):
+            success, data = self._fetch_from_source(source['name'], symbol, wait_for_quota=index == 0)
+            if success and data:
+                print(f"✅ Got data from {source['name']}")
+                return source['name'], data
+        return None, None
+    
+    def _fetch_hedged(self, symbol: str, sources: List[Dict]) -> Tuple[Optional[str], Optional[Dict]]:
+        """對沖獲取：先請求首選源，超過 hedge_delay 未返回或已失敗時啟動下一個源
+        
+        同時在途的請求不超過 max_concurrent，每個源仍經過自己的令牌桶；
+        取最先返回的有效結果，其餘排隊中的請求取消，已在執行的請求結果被丟棄。
+        """
+        queue = list(sources)
+        pending = {}  # future -> 數據源名稱
+        cancelled = threading.Event()
+        first_source = queue[0]['name'] if queue else None
+        deadline = time.time() + self.hedge_timeout
+        next_launch = 0.0
+        hedged = False
+        
+        def run(source_name):
+            # 排隊期間已有結果則不再發出請求
+            if cancelled.is_set():
+                return False, {}
+            return self._fetch_from_source(source_name, symbol, wait_for_quota=source_name == first_source)
+        
+        try:
+            while queue or pending:
+                now = time.time()
+                # 沒有在途請求（上一個源已失敗）時立即啟動下一個；否則等到對沖延遲且未超過並發上限
+                if queue and (not pending or (now >= next_launch and len(pending) < self.max_concurrent)):
+                    source_name = queue.pop(0)['name']
+                    if pending:
+                        hedged = True
+                        with self.stats_lock:
+                            self.stats['hedges_launched'] += 1
+                        print(f"⏱️ {symbol}: no answer after {self.hedge_delay}s, hedging with {source_name}")
+                    pending[self.hedge_executor.submit(run, source_name)] = source_name
+                    next_launch = now + self.hedge_delay
+                    continue
+                
+                if now >= deadline:
+                    print(f"⏰ {symbol}: sources did not answer within {self.hedge_timeout}s")
+                    break
+                
+                wait_for = deadline - now
+                if queue and len(pending) < self.max_concurrent:
+                    wait_for = min(wait_for, max(0.0, next_launch - now))
+                done, _ = wait(list(pending), timeout=wait_for, return_when=FIRST_COMPLETED)
+                
+                for future in done:
+                    source_name = pending.pop(future)
+                    success, data = future.result()
+                    if success and data:
+                        with self.stats_lock:
+                            if hedged:
+                                self.stats['hedged_fetches'] += 1
+                            if source_name != first_source:
+                                self.stats['hedge_wins'] += 1
+                        print(f"✅ Got data from {source_name}")
+                        return source_name, data
+            return None, None
+        finally:
+            cancelled.set()
+            for future in pending:
+                future.cancel()
+    
     def get_stats(self) -> Dict:
         """獲取收集器統計信息"""
         return {
@@ -806,11 +892,26 @@ class MultiSourceDataCollector:
                     'name': s['name'],
                     'enabled': s['enabled'],
                     'priority': s['priority'],
-                    'success_rate': s['success_rate'],
-                    'rate_limit': s['rate_limit']
+                    'success_rate': s['success_rate'],  # 沒有樣本時的先驗成功率
+                    'rate_limit': s['rate_limit'],
+                    'circuit': circuit_breakers.get(s['name']).get_stats()['state']
                 }
                 for s in self.data_sources
-            ]
+            ],
+            'routing': source_router.get_stats(self.data_sources),
+            'circuit_breakers': circuit_breakers.get_stats(),
+            'symbol_resolution': symbol_resolver.get_stats(),
+            'http_pool': http_client.get_stats(),
+            'async_engine': self.async_engine.get_stats(),
+            'hedging': {
+                'enabled': self.hedge_enabled,
+                'hedge_delay': self.hedge_delay,
+                'max_concurrent': self.max_concurrent,
+                'hedged_fetches': self.stats['hedged_fetches'],
+                'hedges_launched': self.stats['hedges_launched'],
+                'hedge_wins': self.stats['hedge_wins']
+            },
+            'rate_limiter': rate_limiter.get_stats()
         }
     
     def enable_source(self, source_name: str, enabled: bool = True):
@@ -0,0 +1,146 @@
+"""
+增量價格歷史存儲
+每隻股票保存一份已下載的完整日線歷史（PriceSeries）和它覆蓋的起始日期，
+price_data 緩存過期後只向上游請求最後一根K線之後的數據，追加去重後按請求的週期切片返回
+"""
+import os
+import threading
+import time
+from datetime import date
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from cache_backends import SQLiteCacheBackend
+from price_series import PriceSeries
+
+CACHE_TYPE = 'price_history'
+
+def trading_days(period: str) -> Optional[int]:
+    """'5d' 等按交易日計的週期返回K線數，其他週期返回None"""
+    if period.endswith('d') and period[:-1].isdigit():
+        return int(period[:-1])
+    return None
+
+def period_start(period: str, today: date = None) -> Optional[np.datetime64]:
+    """按日曆計的 yfinance 週期對應的起始日期；'max' 返回None（全部歷史）"""
+    today = pd.Timestamp(today or date.today())
+    if period == 'max':
+        return None
+    if period == 'ytd':
+        return np.datetime64(f"{today.year}-01-01", 'D')
+    if period.endswith('mo'):
+        start = today - pd.DateOffset(months=int(period[:-2]))
+    elif period.endswith('y'):
+        start = today - pd.DateOffset(years=int(period[:-1]))
+    else:
+        raise ValueError(f"Unsupported period: {period}")
+    return np.datetime64(start.date(), 'D')
+
+class PriceHistoryStore:
+    """價格歷史表
+
+    每隻股票一條記錄：{'series': PriceSeries, 'covered_from': 起始日期或None（max）}，
+    保存在共享的SQLite存儲中，多個worker進程和重啟之間共用。
+    """
+
+    def __init__(self, store_path: str = None, retention: float = 30 * 86400,
+                 adjustment_tolerance: float = 1e-4):
+        self.store_path = store_path or os.getenv('CACHE_SQLITE_PATH', 'data/cache_store.db')
+        self.store = SQLiteCacheBackend(self.store_path)
+        self.retention = retention                        # 多久沒有更新的歷史視為失效，重新完整下載
+        self.adjustment_tolerance = adjustment_tolerance  # 重疊K線收盤價的相對誤差上限
+        self.max_entries = 5000
+        self.max_bytes = 256 * 1024 * 1024
+        self.lock = threading.Lock()
+        self.stats = {'full_fetches': 0, 'incremental_fetches': 0, 'adjustment_refetches': 0,
+                      'bars_fetched': 0, 'bars_served': 0}
+
+    def _load(self, symbol: str) -> Optional[Dict]:
+        entry = self.store.get(CACHE_TYPE, symbol)
+        return entry.data if entry else None
+
+    def _save(self, symbol: str, series: PriceSeries, covered_from):
+        expires_at = time.time() + self.retention
+        self.store.put(CACHE_TYPE, symbol, {'series': series, 'covered_from': covered_from},
+                       expires_at, expires_at, self.max_entries, self.max_bytes)
+
+    @staticmethod
+    def _covers(record: Dict, period: str) -> bool:
+        """已保存的歷史是否包含該週期的起點（歷史是連續的，只會在末尾追加）"""
+        bars = trading_days(period)
+        if bars is not None:
+            return len(record['series']) >= bars
+        covered_from = record['covered_from']
+        if covered_from is None:
+            return True
+        start = period_start(period)
+        return start is not None and covered_from <= start
+
+    def plan(self, symbol: str, period: str) -> Tuple[Optional[PriceSeries], Optional[np.datetime64]]:
+        """決定需要向上游請求的範圍
+
+        返回 (已保存的歷史, 增量請求的起始日期)；沒有可用歷史時返回 (None, None)，需要完整下載該週期。
+        增量請求從倒數第二根K線開始：最後一根可能是盤中數據需要覆蓋，倒數第二根用於檢查復權是否變化。
+        """
+        record = self._load(symbol)
+        if not record or not len(record['series']) or not self._covers(record, period):
+            return None, None
+        series = record['series']
+        return series, series.dates[-2] if len(series) >= 2 else series.dates[-1]
+
+    def save_full(self, symbol: str, period: str, series: PriceSeries) -> PriceSeries:
+        """保存完整下載的週期數據；按交易日計的週期以第一根K線作為覆蓋起點"""
+        self._save(symbol, series, series.dates[0] if trading_days(period) is not None else period_start(period))
+        with self.lock:
+            self.stats['full_fetches'] += 1
+            self.stats['bars_fetched'] += len(series)
+        return series
+
+    def append(self, symbol: str, stored: PriceSeries, newer: PriceSeries) -> Optional[PriceSeries]:
+        """追加增量數據並去重；重疊的已完成K線價格變化（拆股或派息後重新復權）時返回None，需要完整重新下載"""
+        with self.lock:
+            self.stats['incremental_fetches'] += 1
+            self.stats['bars_fetched'] += len(newer)
+        if len(stored) >= 2 and len(newer):
+            overlap = np.searchsorted(newer.dates, stored.dates[-2])
+            if overlap < len(newer) and newer.dates[overlap] == stored.dates[-2]:
+                previous, current = stored.close[-2], newer.close[overlap]
+                if previous and abs(current - previous) / abs(previous) > self.adjustment_tolerance:
+                    print(f"🔁 Price adjustment detected for {symbol}, refetching full history")
+                    with self.lock:
+                        self.stats['adjustment_refetches'] += 1
+                    self.store.delete(CACHE_TYPE, symbol)
+                    return None
+
+        record = self._load(symbol)
+        merged = stored.merge(newer)
+        # 記錄在期間被淘汰時只能確認已保存部分的起點
+        self._save(symbol, merged, record['covered_from'] if record else stored.dates[0])
+        return merged
+
+    def slice(self, series: PriceSeries, period: str) -> PriceSeries:
+        """按週期從完整歷史中切片"""
+        bars = trading_days(period)
+        if bars is not None:
+            result = series.tail(bars)
+        else:
+            start = period_start(period)
+            result = series if start is None else series.since(start)
+        with self.lock:
+            self.stats['bars_served'] += len(result)
+        return result
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            stats = dict(self.stats)
+        fetches = stats['full_fetches'] + stats['incremental_fetches']
+        stats['incremental_rate'] = round(stats['incremental_fetches'] / fetches, 3) if fetches else 0.0
+        stats['store'] = self.store_path
+        return stats
+
+# 全局實例，與其他持久緩存共用 CACHE_SQLITE_PATH；PRICE_HISTORY_RETENTION_DAYS 天未更新的歷史重新完整下載
+price_history_store = PriceHistoryStore(
+    retention=float(os.getenv('PRICE_HISTORY_RETENTION_DAYS', '30')) * 86400
+)
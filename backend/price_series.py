@@ -0,0 +1,117 @@
+"""
+按列存儲的價格序列
+日期和開高低收、成交量各為一個NumPy數組，構造時按日期排序一次；
+數據收集器、緩存和分析器之間直接傳遞，只在API邊界轉換為JSON記錄
+"""
+from typing import Dict, List
+
+import numpy as np
+
+FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+class PriceSeries:
+    """價格序列：dates 為 datetime64[D]，open/high/low/close 為 float64，volume 為 int64"""
+    __slots__ = ('dates', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, dates, open, high, low, close, volume, sort: bool = True):
+        # 複製為獨立數組，不持有DataFrame的內存塊
+        self.dates = np.array(dates, dtype='datetime64[D]')
+        self.open = np.array(open, dtype=np.float64)
+        self.high = np.array(high, dtype=np.float64)
+        self.low = np.array(low, dtype=np.float64)
+        self.close = np.array(close, dtype=np.float64)
+        self.volume = np.nan_to_num(np.asarray(volume, dtype=np.float64)).astype(np.int64)
+        if sort and len(self.dates) > 1 and (self.dates[1:] < self.dates[:-1]).any():
+            order = np.argsort(self.dates, kind='stable')
+            for field in ('dates',) + FIELDS:
+                setattr(self, field, getattr(self, field)[order])
+        # 同一個對象在緩存和多個請求之間共享，數組設為只讀
+        for field in ('dates',) + FIELDS:
+            getattr(self, field).flags.writeable = False
+
+    @classmethod
+    def empty(cls) -> 'PriceSeries':
+        return cls([], [], [], [], [], [], sort=False)
+
+    @classmethod
+    def from_history(cls, hist) -> 'PriceSeries':
+        """從yfinance歷史數據（DataFrame）整列構造，日期取交易所當地日期"""
+        index = hist.index.tz_localize(None) if hist.index.tz is not None else hist.index
+        return cls(index.values.astype('datetime64[D]'), hist['Open'].to_numpy(), hist['High'].to_numpy(),
+                   hist['Low'].to_numpy(), hist['Close'].to_numpy(), hist['Volume'].to_numpy())
+
+    @classmethod
+    def from_records(cls, records: List[Dict]) -> 'PriceSeries':
+        """從 [{'date': 'YYYY-MM-DD', 'open': ..., ...}] 記錄列表構造"""
+        return cls(*([record.get(field) for record in records] for field in ('date',) + FIELDS))
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, List]) -> 'PriceSeries':
+        """從 {'date': [...], 'open': [...], ...} 按列數據構造"""
+        return cls(columns['date'], *(columns[field] for field in FIELDS))
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def __reduce__(self):
+        # 緩存快照和SQLite後端使用pickle；數組已排序，恢復時不再排序
+        return (PriceSeries, (self.dates, self.open, self.high, self.low, self.close, self.volume, False))
+
+    def __sizeof__(self) -> int:
+        # 讓緩存的字節預算按數組實際大小計算
+        return object.__sizeof__(self) + sum(getattr(self, field).nbytes for field in ('dates',) + FIELDS)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, PriceSeries):
+            return NotImplemented
+        return all(np.array_equal(getattr(self, field), getattr(other, field)) for field in ('dates',) + FIELDS)
+
+    def __repr__(self) -> str:
+        if not len(self):
+            return 'PriceSeries(empty)'
+        return f"PriceSeries({len(self)} bars, {self.dates[0]} to {self.dates[-1]})"
+
+    @property
+    def last_close(self) -> float:
+        return float(self.close[-1]) if len(self) else 0.0
+
+    def since(self, start) -> 'PriceSeries':
+        """從 start 日期（含）開始的切片"""
+        index = int(np.searchsorted(self.dates, np.datetime64(start, 'D'), side='left'))
+        return self.tail(len(self) - index)
+
+    def tail(self, count: int) -> 'PriceSeries':
+        """最後 count 條記錄"""
+        count = max(0, min(count, len(self)))
+        return PriceSeries(*(getattr(self, field)[len(self) - count:] for field in ('dates',) + FIELDS), sort=False)
+
+    def merge(self, newer: 'PriceSeries') -> 'PriceSeries':
+        """追加較新的數據並按日期去重，同一日期以 newer 為準（例如盤中未完成的K線）"""
+        if not len(newer):
+            return self
+        keep = ~np.isin(self.dates, newer.dates)
+        return PriceSeries(*(np.concatenate([getattr(self, field)[keep], getattr(newer, field)])
+                             for field in ('dates',) + FIELDS))
+
+    def to_columns(self) -> Dict[str, List]:
+        """轉換為可JSON序列化的按列數據"""
+        columns = {'date': np.datetime_as_string(self.dates, unit='D').tolist()}
+        columns.update((field, getattr(self, field).tolist()) for field in FIELDS)
+        columns['adj_close'] = columns['close']  # Yahoo Finance已調整
+        return columns
+
+    def to_records(self) -> List[Dict]:
+        """轉換為 get_stock_prices 原來返回的記錄列表格式（用於JSON響應）"""
+        columns = self.to_columns()
+        keys = list(columns)
+        return [dict(zip(keys, row)) for row in zip(*columns.values())]
+
+def as_price_series(price_data) -> PriceSeries:
+    """把記錄列表、按列數據或 PriceSeries 統一為 PriceSeries（兼容舊格式的緩存條目）"""
+    if isinstance(price_data, PriceSeries):
+        return price_data
+    if not price_data:
+        return PriceSeries.empty()
+    if isinstance(price_data, dict):
+        return PriceSeries.from_columns(price_data)
+    return PriceSeries.from_records(price_data)
@@ -0,0 +1,217 @@
+"""
+令牌桶速率限制器
+SmartDataFetcher 和 MultiSourceDataCollector 共用，支持每個數據源的令牌桶和全局令牌桶，
+阻塞獲取（帶超時），以及可選的跨進程共享狀態（文件鎖）
+"""
+import asyncio
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows 等平台不支持 fcntl，只能使用進程內狀態
+    fcntl = None
+
+GLOBAL_BUCKET = '__global__'
+
+class RateLimiter:
+    """令牌桶限速器
+
+    每個桶按 rate（每秒令牌數）持續補充，最多積累 capacity 個令牌（允許的突發量）。
+    一次請求需要同時從數據源桶和全局桶各取一個令牌，兩者都足夠時才原子地扣除。
+    use_global=False 的請求只受數據源桶限制（例如只發往Yahoo的歷史數據下載）。
+    設置 state_path 後，桶狀態保存在該文件中並用 flock 加鎖，多個worker進程共享配額。
+    """
+
+    def __init__(self, global_per_minute: float = None, state_path: str = None):
+        self.buckets = {}  # name -> {'rate': 每秒令牌數, 'capacity': 容量}
+        self.state = {}    # name -> [tokens, updated_at]（進程內模式）
+        self.lock = threading.Lock()
+        self.stats = {}    # name -> {'acquired', 'rejected', 'paced', 'wait_total'}（本進程）
+        self.local = threading.local()  # 當前線程（一個HTTP請求）累計的限速等待
+
+        self.state_path = state_path
+        if state_path and fcntl is None:
+            print("⚠️ fcntl not available, rate limiter state is per-process")
+            self.state_path = None
+        if self.state_path:
+            directory = os.path.dirname(self.state_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+        if global_per_minute:
+            self.configure(GLOBAL_BUCKET, global_per_minute)
+
+    def configure(self, name: str, per_minute: float, burst: float = None):
+        """配置桶；同一數據源被多處配置時採用較嚴格（較低）的速率，需要放寬時用 set_rate"""
+        with self.lock:
+            current = self.buckets.get(name)
+            if current is not None and current['rate'] <= per_minute / 60.0:
+                return
+            self._set_bucket(name, per_minute, burst)
+
+    def set_rate(self, name: str, per_minute: float, burst: float = None):
+        """直接替換桶的速率（可以提高），並把令牌重置為滿桶；用於運維調整和測試"""
+        with self.lock:
+            self._set_bucket(name, per_minute, burst)
+        with self._locked_state() as state:
+            state.pop(name, None)
+
+    def _set_bucket(self, name: str, per_minute: float, burst: float = None):
+        """調用方需持有 self.lock"""
+        # 默認允許約10秒的突發量，至少1個令牌
+        capacity = burst if burst is not None else max(1.0, per_minute / 6.0)
+        self.buckets[name] = {'rate': per_minute / 60.0, 'capacity': float(capacity)}
+        self.stats.setdefault(name, self._empty_stats())
+
+    @staticmethod
+    def _empty_stats() -> Dict:
+        return {'acquired': 0, 'rejected': 0, 'paced': 0, 'wait_total': 0.0}
+
+    @contextmanager
+    def _locked_state(self):
+        """持有線程鎖（和文件鎖）期間提供可修改的狀態字典"""
+        with self.lock:
+            if not self.state_path:
+                yield self.state
+                return
+
+            fd = os.open(self.state_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                with os.fdopen(os.dup(fd), 'r+') as f:
+                    content = f.read()
+                    try:
+                        state = json.loads(content) if content else {}
+                    except ValueError:
+                        state = {}
+                    yield state
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+    def _refill(self, state: Dict, name: str, now: float) -> float:
+        """補充令牌並返回當前令牌數"""
+        bucket = self.buckets[name]
+        tokens, updated_at = state.get(name, (bucket['capacity'], now))
+        tokens = min(bucket['capacity'], tokens + max(0.0, now - updated_at) * bucket['rate'])
+        state[name] = [tokens, now]
+        return tokens
+
+    def _try_take(self, source: str, use_global: bool = True) -> float:
+        """嘗試取令牌；成功返回0，否則返回需要等待的秒數"""
+        names = [name for name in ((source, GLOBAL_BUCKET) if use_global else (source,)) if name in self.buckets]
+        with self._locked_state() as state:
+            now = time.time()
+            wait = 0.0
+            for name in names:
+                tokens = self._refill(state, name, now)
+                if tokens < 1.0:
+                    wait = max(wait, (1.0 - tokens) / self.buckets[name]['rate'])
+            if wait == 0.0:
+                for name in names:
+                    state[name][0] -= 1.0
+            return wait
+
+    def _attempt(self, source: str, start_time: float, deadline: Optional[float], use_global: bool = True):
+        """嘗試取令牌：返回 (True/False, 0) 表示已有結果，(None, 秒數) 表示應等待後重試"""
+        wait = self._try_take(source, use_global)
+        if wait == 0.0:
+            waited = time.time() - start_time
+            self._record(source, 'acquired', waited)
+            if use_global and GLOBAL_BUCKET in self.buckets:
+                self._record(GLOBAL_BUCKET, 'acquired', waited)
+            return True, 0.0
+
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0 or wait > remaining:
+                self._record(source, 'rejected', 0.0)
+                return False, 0.0
+        return None, wait
+
+    def acquire(self, source: str, timeout: Optional[float] = None, use_global: bool = True) -> bool:
+        """獲取一個請求配額，不足時阻塞等待，超過 timeout 秒仍不足則返回False
+
+        timeout=0 表示只嘗試一次，None 表示一直等待；use_global=False 時不佔用全局配額。
+        """
+        start_time = time.time()
+        deadline = None if timeout is None else start_time + timeout
+        while True:
+            acquired, wait = self._attempt(source, start_time, deadline, use_global)
+            if acquired is not None:
+                self._add_request_wait(time.time() - start_time)
+                return acquired
+            time.sleep(wait)
+
+    async def acquire_async(self, source: str, timeout: Optional[float] = None) -> bool:
+        """acquire 的協程版本：等待配額時讓出事件循環，不阻塞線程"""
+        start_time = time.time()
+        deadline = None if timeout is None else start_time + timeout
+        while True:
+            acquired, wait = self._attempt(source, start_time, deadline)
+            if acquired is not None:
+                return acquired
+            await asyncio.sleep(wait)
+
+    def try_acquire(self, source: str) -> bool:
+        """不等待，只嘗試一次"""
+        return self.acquire(source, timeout=0)
+
+    def _record(self, source: str, outcome: str, waited: float):
+        with self.lock:
+            stats = self.stats.setdefault(source, self._empty_stats())
+            stats[outcome] += 1
+            stats['wait_total'] += waited
+            if waited > 0.001:
+                stats['paced'] += 1
+
+    def begin_request(self):
+        """開始統計當前線程的限速等待時間（每個HTTP請求開始時調用）"""
+        self.local.waited = 0.0
+
+    def _add_request_wait(self, waited: float):
+        self.local.waited = getattr(self.local, 'waited', 0.0) + waited
+
+    def request_wait(self) -> float:
+        """當前線程自 begin_request 以來因限速增加的等待秒數"""
+        return getattr(self.local, 'waited', 0.0)
+
+    def get_stats(self) -> Dict:
+        """各桶的配置、當前令牌數和本進程的獲取統計"""
+        with self._locked_state() as state:
+            now = time.time()
+            tokens = {name: self._refill(state, name, now) for name in self.buckets}
+
+        with self.lock:
+            buckets = {}
+            for name, bucket in self.buckets.items():
+                stats = self.stats.get(name, self._empty_stats())
+                acquired = stats['acquired']
+                buckets[name] = {
+                    'per_minute': round(bucket['rate'] * 60, 2),
+                    'capacity': bucket['capacity'],
+                    'tokens': round(tokens[name], 2),
+                    'acquired': acquired,
+                    'rejected': stats['rejected'],
+                    'paced': stats['paced'],
+                    'avg_wait_ms': round(stats['wait_total'] / acquired * 1000, 1) if acquired else 0.0
+                }
+            return {'buckets': buckets, 'shared_state': self.state_path or 'process'}
+
+# Yahoo Finance 的每分鐘請求數；SmartDataFetcher、MultiSourceDataCollector 和 DataCollector 共用這一個值
+YAHOO_FINANCE_PER_MINUTE = float(os.getenv('RATE_LIMIT_YAHOO_PER_MINUTE', '30'))
+
+# 全局實例：全局上限默認每分鐘30次請求；設置 RATE_LIMIT_STATE_PATH 後多個進程共享配額
+rate_limiter = RateLimiter(
+    global_per_minute=float(os.getenv('RATE_LIMIT_GLOBAL_PER_MINUTE', '30')),
+    state_path=os.getenv('RATE_LIMIT_STATE_PATH') or None
+)
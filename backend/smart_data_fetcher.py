@@ -5,27 +5,47 @@
 """
 
 import time
-import random
 import requests
 import yfinance as yf
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
+import glob
 import json
 import os
+import pickle
+import threading
+from collections import OrderedDict
+from cache_backends import SQLiteCacheBackend
+from rate_limiter import rate_limiter, YAHOO_FINANCE_PER_MINUTE
+from circuit_breaker import circuit_breakers, is_rate_limit_error, is_upstream_failure
+
+# 持久緩存只保存 DataCollector._convert_smart_fetcher_data 和 _validate_data 用到的字段
+CACHED_FIELDS = (
+    'longName', 'shortName', 'name',
+    'currentPrice', 'regularMarketPrice', 'previousClose',
+    'sector', 'industry', 'marketCap',
+    'trailingPE', 'forwardPE', 'priceToBook', 'debtToEquity',
+    'returnOnEquity', 'profitMargins', 'targetMeanPrice', 'recommendationMean',
+    'data_source'
+)
+CACHE_TYPE = 'smart_fetcher'
 
 class SmartDataFetcher:
-    def __init__(self):
-        self.request_history = {}
-        self.last_request_time = {}
+    def __init__(self, store_path: str = None):
+        # 速率限制由共享的令牌桶限速器執行（與 MultiSourceDataCollector 共用配額）
         self.rate_limits = {
-            'yahoo_finance': {'requests_per_minute': 20, 'cooldown': 60},
-            'alpha_vantage': {'requests_per_minute': 5, 'cooldown': 60},
-            'finnhub': {'requests_per_minute': 60, 'cooldown': 60},
-            'twelve_data': {'requests_per_minute': 8, 'cooldown': 60},
-            'marketstack': {'requests_per_minute': 5, 'cooldown': 60},
-            'iex_cloud': {'requests_per_minute': 10, 'cooldown': 60},
-            'quandl': {'requests_per_minute': 10, 'cooldown': 60}
+            'yahoo_finance': {'requests_per_minute': YAHOO_FINANCE_PER_MINUTE},
+            'alpha_vantage': {'requests_per_minute': 5},
+            'finnhub': {'requests_per_minute': 60},
+            'twelve_data': {'requests_per_minute': 8},
+            'marketstack': {'requests_per_minute': 5},
+            'iex_cloud': {'requests_per_minute': 10},
+            'quandl': {'requests_per_minute': 10}
         }
+        for source, limit in self.rate_limits.items():
+            rate_limiter.configure(source, limit['requests_per_minute'])
+        # 首選數據源配額不足時最多等待的秒數；備用數據源不等待，直接嘗試下一個
+        self.rate_limit_timeout = 5.0
         
         # 真實的港股公司數據
         self.real_stock_data = {
@@ -115,49 +135,41 @@ class SmartDataFetcher:
             }
         }
         
-        print("🚀 SmartDataFetcher initialized")
-    
-    def _can_make_request(self, source: str) -> bool:
-        """檢查是否可以發送請求"""
-        current_time = time.time()
-        
-        if source not in self.last_request_time:
-            self.last_request_time[source] = 0
-        
-        if source not in self.request_history:
-            self.request_history[source] = []
-        
-        # 清理過期的請求記錄
-        window_start = current_time - 60  # 1分鐘窗口
-        self.request_history[source] = [
-            req_time for req_time in self.request_history[source] 
-            if req_time > window_start
-        ]
-        
-        # 檢查速率限制
-        rate_limit = self.rate_limits.get(source, {'requests_per_minute': 10, 'cooldown': 60})
-        max_requests = rate_limit['requests_per_minute']
-        
-        if len(self.request_history[source]) >= max_requests:
-            print(f"⚠️ Rate limit reached for {source}: {len(self.request_history[source])} requests in 1 minute")
-            return False
-        
-        # 檢查冷卻時間
-        cooldown = rate_limit['cooldown']
-        time_since_last = current_time - self.last_request_time[source]
+        # 兩級緩存：L1為進程內字典，L2為與 CacheManager 共用的SQLite存儲；兩級共用同一個TTL
+        # L1條目記錄存儲中的版本 (expires_at, size)，版本未變化時不重新反序列化
+        self.store_path = store_path or os.getenv('CACHE_SQLITE_PATH', 'data/cache_store.db')
+        self.store = SQLiteCacheBackend(self.store_path)
+        self.cache_ttl = timedelta(minutes=5)
+        self.store_max_entries = 20000
+        self.store_max_bytes = 64 * 1024 * 1024
+        self.l1_max_entries = 1000
+        self.l1_cache = OrderedDict()  # symbol -> (version, expires_at, data)
+        self.cache_lock = threading.Lock()
+        self.cache_stats = {
+            'l1_hits': 0,
+            'l1_misses': 0,
+            'l2_hits': 0,
+            'l2_misses': 0,
+            'l2_reads': 0,
+            'l2_writes': 0,
+            'bulk_gets': 0,
+            'preloaded': 0,
+            'migrated': 0,
+            'expired': 0
+        }
         
-        if time_since_last < cooldown:
-            wait_time = cooldown - time_since_last
-            print(f"⏳ Cooldown for {source}: wait {wait_time:.1f}s")
-            return False
+        # 導入舊版的每股票緩存文件，並預加載最近常用的股票到L1
+        self._import_legacy_files(os.path.dirname(self.store_path) or '.')
+        self.preload_hot_symbols(int(os.getenv('SMART_CACHE_PRELOAD', '200')))
         
-        return True
+        print("🚀 SmartDataFetcher initialized")
     
-    def _record_request(self, source: str):
-        """記錄請求"""
-        current_time = time.time()
-        self.last_request_time[source] = current_time
-        self.request_history[source].append(current_time)
+    def _can_make_request(self, source: str, timeout: float = 0) -> bool:
+        """從共享令牌桶獲取請求配額，最多等待 timeout 秒"""
+        if rate_limiter.acquire(source, timeout=timeout):
+            return True
+        print(f"⚠️ Rate limit reached for {source}")
+        return False
     
     def fetch_stock_data(self, symbol: str) -> Tuple[bool, Dict]:
         """智能獲取股票數據"""
@@ -169,19 +181,22 @@ class SmartDataFetcher:
             print(f"📦 Using cached data for {symbol}")
             return True, cached_data
         
-        # 嘗試多個數據源
+        # 嘗試多個數據源；_fetch_from_alpha_vantage 等尚未實現（直接返回失敗），
+        # 不參與輪詢，避免每次白白消耗限速配額並觸發與 MultiSourceDataCollector 共用的熔斷器
         sources = [
-            ('yahoo_finance', self._fetch_from_yahoo_finance),
-            ('alpha_vantage', self._fetch_from_alpha_vantage),
-            ('finnhub', self._fetch_from_finnhub),
-            ('twelve_data', self._fetch_from_twelve_data),
-            ('marketstack', self._fetch_from_marketstack),
-            ('iex_cloud', self._fetch_from_iex_cloud),
-            ('quandl', self._fetch_from_quandl)
+            ('yahoo_finance', self._fetch_from_yahoo_finance)
         ]
         
-        for source_name, fetch_func in sources:
-            if not self._can_make_request(source_name):
+        for index, (source_name, fetch_func) in enumerate(sources):
+            # 熔斷中的數據源直接跳過，不佔用限速配額
+            breaker = circuit_breakers.get(source_name)
+            if not breaker.allow_request():
+                print(f"🔌 Circuit open for {source_name}, skipping")
+                continue
+            
+            timeout = self.rate_limit_timeout if index == 0 else 0
+            if not self._can_make_request(source_name, timeout):
+                breaker.release()
                 continue
             
             try:
@@ -189,14 +204,20 @@ class SmartDataFetcher:
                 success, data = fetch_func(symbol)
                 
                 if success and self._validate_data(data):
-                    self._record_request(source_name)
+                    breaker.record_success()
                     self._cache_data(symbol, data)
                     print(f"✅ Successfully fetched from {source_name}")
                     return True, data
                 else:
-                    print(f"❌ {source_name} failed or invalid data")
+                    # 單個代碼沒有有效數據（未知或已退市）不計入共享的熔斷器，由下面緩存的回退數據擋住重複請求
+                    breaker.release()
+                    print(f"❌ {source_name} has no valid data for {symbol}")
                     
             except Exception as e:
+                if is_upstream_failure(e):
+                    breaker.record_failure(rate_limited=is_rate_limit_error(e), error=str(e)[:200])
+                else:
+                    breaker.release()
                 print(f"❌ Error with {source_name}: {e}")
                 continue
         
@@ -209,9 +230,7 @@ class SmartDataFetcher:
     def _fetch_from_yahoo_finance(self, symbol: str) -> Tuple[bool, Dict]:
         """從Yahoo Finance獲取數據"""
         try:
-            # 添加隨機延遲避免速率限制
-            time.sleep(random.uniform(1, 3))
-            
+            # 請求節奏由 fetch_stock_data 中的限速器控制，這裡不再額外睡眠
             ticker = yf.Ticker(symbol)
             info = ticker.info
             
@@ -254,6 +273,9 @@ class SmartDataFetcher:
             return False, {}
             
         except Exception as e:
+            # 429、5xx和傳輸錯誤交給調用方熔斷，其他錯誤只與這個代碼有關
+            if is_upstream_failure(e):
+                raise
             print(f"Yahoo Finance error: {e}")
             return False, {}
     
@@ -378,35 +400,177 @@ class SmartDataFetcher:
             'description': '港股上市公司'
         }
     
-    def _get_cached_data(self, symbol: str) -> Optional[Dict]:
-        """從緩存獲取數據"""
-        cache_file = f'data/cache_{symbol.replace(".", "_")}.json'
-        if os.path.exists(cache_file):
+    def _project_fields(self, data: Dict) -> Dict:
+        """只保留下游會用到的字段"""
+        return {field: data[field] for field in CACHED_FIELDS if data.get(field) is not None}
+    
+    def _import_legacy_files(self, cache_dir: str):
+        """將舊版 data/cache_<symbol>.json / .pkl 文件中未過期的數據導入存儲
+        
+        .pkl 文件導入後刪除；.json 文件保留原樣，過期的直接跳過。
+        """
+        imported = 0
+        for path in glob.glob(os.path.join(cache_dir, 'cache_*.pkl')) + glob.glob(os.path.join(cache_dir, 'cache_*.json')):
+            name = os.path.splitext(os.path.basename(path))[0][len('cache_'):]
+            symbol = '.'.join(name.rsplit('_', 1))
             try:
-                with open(cache_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    # 檢查緩存是否過期（5分鐘）
-                    if 'timestamp' in data:
-                        cache_time = datetime.fromisoformat(data['timestamp'])
-                        if datetime.now() - cache_time < timedelta(minutes=5):
-                            return data['data']
+                if path.endswith('.pkl'):
+                    # 舊文件只由本程序寫入 data/ 目錄
+                    with open(path, 'rb') as f:
+                        payload = pickle.load(f)
+                    cached_at, data = payload['cached_at'], payload['data']
+                else:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        legacy = json.load(f)
+                    cached_at, data = datetime.fromisoformat(legacy['timestamp']).timestamp(), legacy['data']
+                
+                expires_at = cached_at + self.cache_ttl.total_seconds()
+                if time.time() < expires_at and self.store.entry_version(CACHE_TYPE, symbol) is None:
+                    self.store.put(CACHE_TYPE, symbol, self._project_fields(data), expires_at, expires_at,
+                                   self.store_max_entries, self.store_max_bytes)
+                    imported += 1
+                if path.endswith('.pkl'):
+                    os.remove(path)
             except Exception as e:
-                print(f"Cache read error: {e}")
+                print(f"Cache migration error for {path}: {e}")
+        
+        if imported > 0:
+            self._count_cache('migrated', imported)
+            print(f"🔄 Imported {imported} legacy cache files into {self.store_path}")
+    
+    def _count_cache(self, name: str, amount: int = 1):
+        with self.cache_lock:
+            self.cache_stats[name] += amount
+    
+    def _store_l1(self, symbol: str, version: tuple, expires_at: float, data: Dict):
+        """將存儲中的數據放入L1，記錄版本以便校驗"""
+        with self.cache_lock:
+            self.l1_cache[symbol] = (version, expires_at, data)
+            self.l1_cache.move_to_end(symbol)
+            while len(self.l1_cache) > self.l1_max_entries:
+                self.l1_cache.popitem(last=False)
+    
+    def _get_cached_data(self, symbol: str) -> Optional[Dict]:
+        """從緩存獲取數據：先查L1，存儲中的版本變化或L1未命中時再讀L2"""
+        try:
+            version = self.store.entry_version(CACHE_TYPE, symbol)
+        except Exception as e:
+            print(f"Cache read error: {e}")
+            return None
+        
+        if version is None:
+            # 條目不存在（或已被刪除），L1中的副本同樣失效
+            with self.cache_lock:
+                self.l1_cache.pop(symbol, None)
+                self.cache_stats['l1_misses'] += 1
+                self.cache_stats['l2_misses'] += 1
+            return None
+        
+        with self.cache_lock:
+            entry = self.l1_cache.get(symbol)
+            if entry is not None and entry[0] == tuple(version):
+                if time.time() < entry[1]:
+                    self.l1_cache.move_to_end(symbol)
+                    self.cache_stats['l1_hits'] += 1
+                    return entry[2]
+                # 版本未變但已過期，不必重新讀取
+                self.cache_stats['l1_misses'] += 1
+                self.cache_stats['l2_misses'] += 1
+                self.cache_stats['expired'] += 1
+                return None
+            self.cache_stats['l1_misses'] += 1
+        
+        try:
+            cached = self.store.get(CACHE_TYPE, symbol)
+            self._count_cache('l2_reads')
+            # 存儲按TTL判斷過期
+            if cached is not None:
+                self._store_l1(symbol, (cached.expires_at, cached.size), cached.expires_at, cached.data)
+                self._count_cache('l2_hits')
+                return cached.data
+            self._count_cache('expired')
+        except Exception as e:
+            print(f"Cache read error: {e}")
+        self._count_cache('l2_misses')
         return None
     
+    def get_cached_many(self, symbols: List[str]) -> Dict[str, Dict]:
+        """批量獲取多隻股票的緩存數據，L2只查詢一次"""
+        results = {}
+        try:
+            entries = self.store.get_many(CACHE_TYPE, symbols)
+        except Exception as e:
+            print(f"Cache bulk read error: {e}")
+            return results
+        
+        self._count_cache('bulk_gets')
+        for symbol, cached in entries.items():
+            self._store_l1(symbol, (cached.expires_at, cached.size), cached.expires_at, cached.data)
+            results[symbol] = cached.data
+        return results
+    
+    def preload_hot_symbols(self, limit: int = 200) -> int:
+        """將最近訪問最多的股票預加載到L1"""
+        if limit <= 0:
+            return 0
+        try:
+            start_time = time.time()
+            hot_symbols = self.store.hot_keys(CACHE_TYPE, min(limit, self.l1_max_entries))
+            loaded = len(self.get_cached_many(hot_symbols)) if hot_symbols else 0
+            if loaded > 0:
+                self._count_cache('preloaded', loaded)
+                print(f"🔥 Preloaded {loaded} hot symbols in {(time.time() - start_time) * 1000:.1f}ms")
+            return loaded
+        except Exception as e:
+            print(f"Cache preload error: {e}")
+            return 0
+    
+    def compact_cache(self) -> Dict:
+        """壓縮持久存儲（清理過期條目並回收空間）"""
+        return self.store.compact()
+    
     def _cache_data(self, symbol: str, data: Dict):
-        """緩存數據"""
+        """緩存數據，同時寫入L2存儲和L1"""
         try:
-            os.makedirs('data', exist_ok=True)
-            cache_file = f'data/cache_{symbol.replace(".", "_")}.json'
-            cache_data = {
-                'data': data,
-                'timestamp': datetime.now().isoformat()
-            }
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                json.dump(cache_data, f, ensure_ascii=False, indent=2)
+            expires_at = time.time() + self.cache_ttl.total_seconds()
+            projected = self._project_fields(data)
+            self.store.put(CACHE_TYPE, symbol, projected, expires_at, expires_at,
+                           self.store_max_entries, self.store_max_bytes)
+            self._count_cache('l2_writes')
+            version = self.store.entry_version(CACHE_TYPE, symbol)
+            if version is not None:
+                self._store_l1(symbol, tuple(version), expires_at, projected)
         except Exception as e:
             print(f"Cache write error: {e}")
+    
+    def get_cache_stats(self) -> Dict:
+        """獲取兩級緩存的命中統計"""
+        with self.cache_lock:
+            stats = dict(self.cache_stats)
+            l1_entries = len(self.l1_cache)
+        l1_total = stats['l1_hits'] + stats['l1_misses']
+        l2_total = stats['l2_hits'] + stats['l2_misses']
+        return {
+            'ttl_seconds': int(self.cache_ttl.total_seconds()),
+            'store': self.store_path,
+            'l1': {
+                'entries': l1_entries,
+                'preloaded': stats['preloaded'],
+                'hits': stats['l1_hits'],
+                'misses': stats['l1_misses'],
+                'hit_rate': f"{(stats['l1_hits'] / l1_total * 100) if l1_total else 0:.1f}%"
+            },
+            'l2': {
+                'hits': stats['l2_hits'],
+                'misses': stats['l2_misses'],
+                'reads': stats['l2_reads'],
+                'writes': stats['l2_writes'],
+                'bulk_gets': stats['bulk_gets'],
+                'migrated': stats['migrated'],
+                'hit_rate': f"{(stats['l2_hits'] / l2_total * 100) if l2_total else 0:.1f}%"
+            },
+            'expired': stats['expired']
+        }
 
 # 創建全局實例
 smart_fetcher = SmartDataFetcher()
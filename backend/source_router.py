@@ -0,0 +1,107 @@
+"""
+數據源自適應排序
+按數據源和市場（.HK、US等）記錄指數加權的延遲和成功率，據此動態調整數據源的嘗試順序
+"""
+import os
+import threading
+import time
+from typing import Dict, List
+
+def market_of(symbol: str) -> str:
+    """股票代碼所屬市場：0700.HK -> HK，沒有後綴的視為 US"""
+    if '.' in symbol:
+        return symbol.rsplit('.', 1)[1].upper()
+    return 'US'
+
+class SourceRouter:
+    """基於EWMA評分的數據源路由
+
+    每個 (數據源, 市場) 保存延遲和成功率的指數加權平均。排序代價為
+    「預期拿到有效結果的時間」= 延遲 / 成功率，越小越靠前，相同時按配置的優先級。
+    統計隨時間向先驗值衰減（recovery_half_life），已降級的數據源過一段時間會重新被嘗試。
+    """
+
+    def __init__(self, alpha: float = 0.2, recovery_half_life: float = 600.0,
+                 prior_latency: float = 1.0):
+        self.alpha = alpha                            # 新樣本權重
+        self.recovery_half_life = recovery_half_life  # 統計衰減回先驗值的半衰期（秒）
+        self.prior_latency = prior_latency            # 沒有樣本時假設的延遲（秒）
+        self.min_success_rate = 0.02                  # 避免除以0，失敗的源代價有上限
+        self.scores = {}  # (source, market) -> {'latency', 'success_rate', 'samples', 'failures', 'updated_at'}
+        self.lock = threading.Lock()
+
+    def record(self, source: str, symbol: str, success: bool, latency: float, prior_success: float = 0.5):
+        """記錄一次上游請求的結果和耗時"""
+        key = (source, market_of(symbol))
+        now = time.time()
+        with self.lock:
+            score = self.scores.get(key)
+            if score is None:
+                score = {'latency': self.prior_latency, 'success_rate': prior_success,
+                         'samples': 0, 'failures': 0, 'updated_at': now}
+                self.scores[key] = score
+            else:
+                self._decay(score, now, prior_success)
+
+            score['latency'] += self.alpha * (latency - score['latency'])
+            score['success_rate'] += self.alpha * ((1.0 if success else 0.0) - score['success_rate'])
+            score['samples'] += 1
+            if not success:
+                score['failures'] += 1
+            score['updated_at'] = now
+
+    def _decay(self, score: Dict, now: float, prior_success: float):
+        """按距離上次更新的時間把統計拉回先驗值"""
+        weight = 0.5 ** (max(0.0, now - score['updated_at']) / self.recovery_half_life)
+        score['latency'] = self.prior_latency + (score['latency'] - self.prior_latency) * weight
+        score['success_rate'] = prior_success + (score['success_rate'] - prior_success) * weight
+        score['updated_at'] = now
+
+    def _estimate(self, source: Dict, market: str, now: float) -> Dict:
+        """當前的延遲和成功率估計（不修改已保存的統計）"""
+        prior_success = source.get('success_rate', 0.5)
+        score = self.scores.get((source['name'], market))
+        if score is None:
+            return {'latency': self.prior_latency, 'success_rate': prior_success, 'samples': 0}
+        estimate = dict(score)
+        self._decay(estimate, now, prior_success)
+        return estimate
+
+    def _cost(self, estimate: Dict) -> float:
+        return estimate['latency'] / max(estimate['success_rate'], self.min_success_rate)
+
+    def rank(self, sources: List[Dict], symbol: str) -> List[Dict]:
+        """按預期代價排序數據源（source 字典需包含 name、priority，success_rate 作為先驗）"""
+        market = market_of(symbol)
+        now = time.time()
+        with self.lock:
+            costs = {s['name']: self._cost(self._estimate(s, market, now)) for s in sources}
+        return sorted(sources, key=lambda s: (costs[s['name']], s['priority']))
+
+    def get_stats(self, sources: List[Dict]) -> Dict:
+        """每個市場的實時評分和排序，供 /api/data/sources 展示"""
+        now = time.time()
+        with self.lock:
+            markets = sorted({market for _, market in self.scores})
+            result = {}
+            for market in markets:
+                entries = []
+                for source in sources:
+                    estimate = self._estimate(source, market, now)
+                    entries.append({
+                        'name': source['name'],
+                        'priority': source['priority'],
+                        'latency_ms': round(estimate['latency'] * 1000, 1),
+                        'success_rate': round(estimate['success_rate'], 3),
+                        'samples': estimate['samples'],
+                        'score': round(self._cost(estimate), 3)
+                    })
+                entries.sort(key=lambda e: (e['score'], e['priority']))
+                result[market] = entries
+            return result
+
+# 全局路由實例；SOURCE_ROUTER_ALPHA 控制新樣本權重，SOURCE_ROUTER_RECOVERY 控制降級數據源的恢復半衰期（秒）
+source_router = SourceRouter(
+    alpha=float(os.getenv('SOURCE_ROUTER_ALPHA', '0.2')),
+    recovery_half_life=float(os.getenv('SOURCE_ROUTER_RECOVERY', '600'))
+)
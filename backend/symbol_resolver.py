@@ -0,0 +1,120 @@
+"""
+股票代碼變體解析緩存
+記錄每個請求代碼在Yahoo Finance上實際可用的變體（正向條目），以及確認沒有數據的變體（負向條目），
+保存在共享的SQLite存儲中，重複查詢時先嘗試已知可用的變體並跳過已知無效的變體
+"""
+import os
+import threading
+import time
+from typing import Dict, List
+from cache_backends import SQLiteCacheBackend
+from circuit_breaker import http_status
+
+CACHE_TYPE = 'symbol_variant'
+
+def is_not_found_error(error) -> bool:
+    """上游明確表示沒有該代碼（404），與超時等臨時錯誤區分；代碼本身的數字（0404.HK）不算"""
+    status = http_status(error)
+    if status is not None:
+        return status == 404
+    return 'Not Found' in str(error)
+
+class SymbolResolver:
+    """代碼變體解析表
+
+    每個請求代碼一條記錄：{'variant': 最近成功的變體或None, 'negative': {變體: 過期時間},
+    'empty': {變體: 連續空響應次數}}。正向條目保留 positive_ttl 秒，負向條目保留 negative_ttl 秒後重新探測。
+    上游限速時經常返回空數據，所以空響應只在連續 empty_threshold 次（分別的查詢）後才寫負向條目，
+    請求的原始代碼本身從不因空響應寫負向條目。
+    """
+
+    def __init__(self, store_path: str = None, positive_ttl: float = 30 * 86400, negative_ttl: float = 86400,
+                 empty_threshold: int = 3):
+        self.store_path = store_path or os.getenv('CACHE_SQLITE_PATH', 'data/cache_store.db')
+        self.store = SQLiteCacheBackend(self.store_path)
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.empty_threshold = empty_threshold
+        self.max_entries = 50000
+        self.max_bytes = 16 * 1024 * 1024
+        self.lock = threading.Lock()
+        self.stats = {'resolved_hits': 0, 'negative_skips': 0, 'unresolved': 0,
+                      'positive_writes': 0, 'negative_writes': 0, 'empty_responses': 0}
+
+    def _load(self, symbol: str) -> Dict:
+        entry = self.store.get(CACHE_TYPE, symbol)
+        record = entry.data if entry else {'variant': None, 'negative': {}}
+        now = time.time()
+        record['negative'] = {v: until for v, until in record['negative'].items() if until > now}
+        record.setdefault('empty', {})  # 舊格式的記錄沒有空響應計數
+        return record
+
+    def _save(self, symbol: str, record: Dict):
+        expires_at = time.time() + max(self.positive_ttl, self.negative_ttl)
+        self.store.put(CACHE_TYPE, symbol, record, expires_at, expires_at, self.max_entries, self.max_bytes)
+
+    def candidates(self, symbol: str, variants: List[str]) -> List[str]:
+        """返回應該探測的變體：已知可用的變體排在最前，跳過負向條目，並去除重複"""
+        record = self._load(symbol)
+        ordered = []
+        for variant in ([record['variant']] if record['variant'] else []) + list(variants):
+            if variant not in ordered and variant not in record['negative']:
+                ordered.append(variant)
+
+        skipped = sum(1 for variant in set(variants) if variant in record['negative'])
+        with self.lock:
+            if record['variant'] and ordered and ordered[0] == record['variant']:
+                self.stats['resolved_hits'] += 1
+            else:
+                self.stats['unresolved'] += 1
+            self.stats['negative_skips'] += skipped
+        return ordered
+
+    def record_success(self, symbol: str, variant: str):
+        """記錄可用的變體；該變體的負向條目同時清除"""
+        with self.lock:
+            record = self._load(symbol)
+            if record['variant'] == variant and variant not in record['negative'] and not record['empty']:
+                return
+            record['variant'] = variant
+            record['negative'].pop(variant, None)
+            record['empty'] = {}  # 上游恢復正常，之前的空響應不再累計
+            self._save(symbol, record)
+            self.stats['positive_writes'] += 1
+
+    def record_failure(self, symbol: str, variant: str):
+        """記錄上游沒有數據的變體；如果它是已知可用的變體則撤銷正向條目"""
+        with self.lock:
+            record = self._load(symbol)
+            if record['variant'] == variant:
+                record['variant'] = None
+            record['negative'][variant] = time.time() + self.negative_ttl
+            self._save(symbol, record)
+            self.stats['negative_writes'] += 1
+
+    def record_empty(self, symbol: str, variant: str):
+        """記錄一次查詢中變體返回空數據；連續 empty_threshold 次後才按無效處理，原始代碼永遠不寫負向條目"""
+        with self.lock:
+            record = self._load(symbol)
+            count = record['empty'].get(variant, 0) + 1
+            self.stats['empty_responses'] += 1
+            if count >= self.empty_threshold and variant != symbol:
+                record['empty'].pop(variant, None)
+                if record['variant'] == variant:
+                    record['variant'] = None
+                record['negative'][variant] = time.time() + self.negative_ttl
+                self.stats['negative_writes'] += 1
+            else:
+                record['empty'][variant] = count
+            self._save(symbol, record)
+
+    def resolve(self, symbol: str):
+        """已知可用的變體，未知時返回None"""
+        return self._load(symbol)['variant']
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return dict(self.stats, store=self.store_path)
+
+# 全局實例，與其他持久緩存共用 CACHE_SQLITE_PATH
+symbol_resolver = SymbolResolver()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+緩存並發性能基準測試
+比較單分片與多分片 CacheManager 在不同線程數下的吞吐量
+"""
+import sys
+import random
+import threading
+import time
+from pathlib import Path
+
+# 添加backend目錄到Python路徑
+backend_dir = Path(__file__).parent / "backend"
+sys.path.insert(0, str(backend_dir))
+
+from cache_manager import CacheManager
+
+OPS_PER_THREAD = 20000
+KEYS = [f"{i:04d}.HK" for i in range(2000)]
+CACHE_TYPES = ['stock_info', 'price_data', 'analysis_result']
+
+def run_benchmark(num_shards: int, num_threads: int):
+    """運行一輪基準測試，返回(每秒操作數, get延遲p99毫秒)"""
+    cache = CacheManager(num_shards=num_shards)
+    for key in KEYS:
+        cache.set('stock_info', key, {'symbol': key, 'price': 1.0})
+    
+    start_barrier = threading.Barrier(num_threads + 1)
+    latencies = []
+    
+    def worker(seed):
+        rng = random.Random(seed)
+        local_latencies = []
+        start_barrier.wait()
+        for _ in range(OPS_PER_THREAD):
+            cache_type = rng.choice(CACHE_TYPES)
+            key = rng.choice(KEYS)
+            # 90% 讀，10% 寫
+            if rng.random() < 0.9:
+                op_start = time.perf_counter()
+                cache.get(cache_type, key)
+                local_latencies.append(time.perf_counter() - op_start)
+            else:
+                cache.set(cache_type, key, {'symbol': key, 'price': rng.random()})
+        latencies.extend(local_latencies)
+    
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(num_threads)]
+    for t in threads:
+        t.start()
+    start_barrier.wait()
+    start_time = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start_time
+    
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    return num_threads * OPS_PER_THREAD / elapsed, p99
+
+def main():
+    print("🚀 緩存並發基準測試")
+    print(f"   每線程操作數: {OPS_PER_THREAD}，鍵數: {len(KEYS)}，讀寫比 9:1")
+    print("=" * 78)
+    print(f"{'線程數':>6} | {'1 分片 ops/s':>13} | {'16 分片 ops/s':>13} | "
+          f"{'1 分片 get p99':>14} | {'16 分片 get p99':>15}")
+    print("-" * 78)
+    
+    for num_threads in [1, 2, 4, 8, 16]:
+        single_ops, single_p99 = run_benchmark(1, num_threads)
+        sharded_ops, sharded_p99 = run_benchmark(16, num_threads)
+        print(f"{num_threads:>6} | {single_ops:>13,.0f} | {sharded_ops:>13,.0f} | "
+              f"{single_p99:>12.3f}ms | {sharded_p99:>13.3f}ms")
+    
+    print("=" * 78)
+    print("註: CPython 有 GIL，純內存操作的總吞吐量受限於單核；")
+    print("    分片主要減少線程在同一把鎖上的排隊，在 free-threaded 構建或")
+    print("    計算與I/O交錯的真實請求中收益更明顯。")
+
+if __name__ == "__main__":
+    main()
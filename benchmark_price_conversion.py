@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+價格數據轉換基準測試
+比較原來逐行 iterrows 轉換為記錄列表與整列構造 PriceSeries 的耗時、緩存佔用，
+以及分析器使用記錄列表與 PriceSeries 的耗時
+"""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# 添加backend目錄到Python路徑
+backend_dir = Path(__file__).parent / "backend"
+sys.path.insert(0, str(backend_dir))
+
+from price_series import PriceSeries
+from analyzer import InvestmentAnalyzer
+from cache_backends import estimate_size
+
+PERIODS = {'5d': 5, '1mo': 21, '1y': 252, '5y': 1260, 'max': 5000}
+
+def make_history(rows: int) -> pd.DataFrame:
+    """構造與 yfinance Ticker.history 相同格式的數據"""
+    rng = np.random.default_rng(42)
+    close = 100 * np.cumprod(1 + rng.normal(0, 0.01, rows))
+    index = pd.date_range(end='2024-06-28', periods=rows, freq='B', tz='Asia/Hong_Kong', name='Date')
+    return pd.DataFrame({
+        'Open': close * 0.99, 'High': close * 1.01, 'Low': close * 0.98, 'Close': close,
+        'Volume': rng.integers(1_000_000, 10_000_000, rows), 'Dividends': 0.0, 'Stock Splits': 0.0
+    }, index=index)
+
+def iterrows_records(hist: pd.DataFrame):
+    """原來的逐行轉換"""
+    price_data = []
+    for date, row in hist.iterrows():
+        price_data.append({
+            'date': date.strftime('%Y-%m-%d'),
+            'open': float(row['Open']),
+            'high': float(row['High']),
+            'low': float(row['Low']),
+            'close': float(row['Close']),
+            'volume': int(row['Volume']),
+            'adj_close': float(row['Close'])
+        })
+    return price_data
+
+def best_of(func, repeat: int = 5) -> float:
+    """多次運行取最短時間（毫秒）"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+def analyze(analyzer, price_data):
+    analyzer.calculate_technical_indicators(price_data)
+    analyzer.calculate_risk_metrics(price_data)
+
+def main():
+    analyzer = InvestmentAnalyzer()
+
+    print("🚀 價格數據轉換基準測試（每項取5次中最快）")
+    print("=" * 100)
+    print(f"{'週期':>5} | {'行數':>5} | {'iterrows':>10} | {'PriceSeries':>11} | {'to_records':>10} | "
+          f"{'緩存(記錄)':>10} | {'緩存(序列)':>10} | {'分析(記錄)':>10} | {'分析(序列)':>10}")
+    print("-" * 100)
+
+    for period, rows in PERIODS.items():
+        hist = make_history(rows)
+        records = iterrows_records(hist)
+        series = PriceSeries.from_history(hist)
+        assert series.to_records() == records
+
+        loop_ms = best_of(lambda: iterrows_records(hist))
+        series_ms = best_of(lambda: PriceSeries.from_history(hist))
+        to_records_ms = best_of(series.to_records)
+        analyze_records_ms = best_of(lambda: analyze(analyzer, records))
+        analyze_series_ms = best_of(lambda: analyze(analyzer, series))
+        print(f"{period:>5} | {rows:>5} | {loop_ms:>8.2f}ms | {series_ms:>9.2f}ms | {to_records_ms:>8.2f}ms | "
+              f"{estimate_size(records) / 1024:>8.1f}KB | {estimate_size(series) / 1024:>8.1f}KB | "
+              f"{analyze_records_ms:>8.2f}ms | {analyze_series_ms:>8.2f}ms")
+
+    print("=" * 100)
+    print("註: 緩存和分析器都直接使用 PriceSeries；to_records 只在API響應序列化時調用。")
+    print("    「分析(記錄)」包括分析器把記錄列表轉換為 PriceSeries 的時間。")
+
+if __name__ == "__main__":
+    main()
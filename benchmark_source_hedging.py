@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+多源對沖請求基準測試
+啟動本地模擬數據源服務器，比較順序模式與對沖模式下 _fetch_stock_info_multi_source 的尾延遲
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# 基準測試不受全局配額限制（需在導入限速器之前設置）
+os.environ['RATE_LIMIT_GLOBAL_PER_MINUTE'] = '0'
+
+# 添加backend目錄到Python路徑
+backend_dir = Path(__file__).parent / "backend"
+sys.path.insert(0, str(backend_dir))
+
+from multi_source_collector import MultiSourceDataCollector
+from rate_limiter import rate_limiter
+from source_router import source_router
+
+REQUESTS = 200
+HEDGE_DELAY = 0.3
+
+# 模擬數據源的延遲分佈：(正常延遲秒數, 慢請求概率, 慢請求延遲秒數, 失敗概率)
+STUB_SOURCES = {
+    'stub_primary': (0.08, 0.10, 3.0, 0.05),
+    'stub_secondary': (0.15, 0.02, 1.0, 0.05),
+    'stub_tertiary': (0.25, 0.0, 0.0, 0.0)
+}
+
+class StubSourceHandler(BaseHTTPRequestHandler):
+    """按 STUB_SOURCES 的分佈延遲後返回報價，/<source>/<symbol>"""
+    rng = random.Random(42)
+    rng_lock = threading.Lock()
+
+    def do_GET(self):
+        _, source_name, symbol = self.path.split('/')
+        base, slow_prob, slow_delay, fail_prob = STUB_SOURCES[source_name]
+        with self.rng_lock:
+            roll = self.rng.random()
+            jitter = self.rng.uniform(0.8, 1.2)
+        time.sleep(slow_delay if roll < slow_prob else base * jitter)
+
+        if roll > 1 - fail_prob:
+            self.send_response(503)
+            self.end_headers()
+            return
+        body = json.dumps({'symbol': symbol, 'currentPrice': 100.0, 'longName': symbol}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def make_stub_fetcher(collector, base_url, source_name):
+    """像真實數據源一樣先取配額，再請求模擬服務器"""
+    def fetch(symbol):
+        if not collector._can_make_request(source_name):
+            return False, {}
+        try:
+            with urllib.request.urlopen(f"{base_url}/{source_name}/{symbol}", timeout=10) as response:
+                collector._update_source_stats(source_name, True)
+                return True, json.loads(response.read())
+        except Exception:
+            collector._update_source_stats(source_name, False)
+            return False, {}
+    return fetch
+
+def make_collector(base_url, hedge_enabled):
+    collector = MultiSourceDataCollector()
+    collector.hedge_enabled = hedge_enabled
+    collector.hedge_delay = HEDGE_DELAY
+    collector.data_sources = [
+        {'name': name, 'priority': priority, 'enabled': True, 'rate_limit': 100000,
+         'last_request': 0, 'success_rate': 1.0, 'fallback': False}
+        for priority, name in enumerate(STUB_SOURCES, start=1)
+    ]
+    collector.fetchers = {}
+    for source in collector.data_sources:
+        rate_limiter.configure(source['name'], source['rate_limit'])
+        collector.fetchers[source['name']] = make_stub_fetcher(collector, base_url, source['name'])
+    return collector
+
+def run_benchmark(base_url, hedge_enabled):
+    """返回 (延遲列表, 收集器統計)"""
+    collector = make_collector(base_url, hedge_enabled)
+    # 每種模式從相同的路由評分開始
+    source_router.scores.clear()
+    latencies = []
+    for i in range(REQUESTS):
+        start_time = time.perf_counter()
+        collector._fetch_stock_info_multi_source(f"{i:04d}.HK")
+        latencies.append(time.perf_counter() - start_time)
+    return sorted(latencies), collector.get_stats()
+
+def percentile(sorted_values, pct):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct))] * 1000
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubSourceHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    # 基準測試只輸出結果表，屏蔽收集器的逐條日誌
+    real_stdout = sys.stdout
+    results = {}
+    try:
+        for mode, hedge_enabled in [('順序', False), ('對沖', True)]:
+            sys.stdout = open(os.devnull, 'w')
+            results[mode] = run_benchmark(base_url, hedge_enabled)
+            sys.stdout.close()
+            sys.stdout = real_stdout
+    finally:
+        sys.stdout = real_stdout
+        server.shutdown()
+
+    print("🚀 多源對沖請求基準測試")
+    print(f"   請求數: {REQUESTS}，對沖延遲: {HEDGE_DELAY}s，"
+          f"首選源 10% 請求延遲 3s、5% 失敗")
+    print("=" * 64)
+    print(f"{'模式':>4} | {'p50':>9} | {'p95':>9} | {'p99':>9} | {'max':>9} | {'備用請求':>6}")
+    print("-" * 64)
+    for mode, (latencies, stats) in results.items():
+        print(f"{mode:>4} | {percentile(latencies, 0.5):>7.0f}ms | {percentile(latencies, 0.95):>7.0f}ms | "
+              f"{percentile(latencies, 0.99):>7.0f}ms | {latencies[-1] * 1000:>7.0f}ms | "
+              f"{stats['hedging']['hedges_launched']:>8}")
+    print("=" * 64)
+    print("註: 對沖模式只在首選源超過對沖延遲仍未返回時才發出備用請求，")
+    print("    額外請求數約等於慢請求比例，仍受每個數據源的令牌桶限制。")
+
+if __name__ == "__main__":
+    main()
@@ -709,6 +709,7 @@ async function loadWatchlistPreview() {
     
     // 顯示前5個觀察清單項目
     const previewList = watchlist.slice(0, 5);
+    const items = {};
     
     previewList.forEach(symbol => {
         const item = document.createElement('div');
@@ -718,11 +719,12 @@ async function loadWatchlistPreview() {
             <span class="loading">載入中...</span>
         `;
         elements.watchlistPreview.appendChild(item);
-        
-        // 載入價格信息
-        loadPreviewPrice(symbol, item);
+        items[symbol] = item;
     });
     
+    // 一次請求刷新所有價格
+    loadPreviewPrices(items);
+    
     if (watchlist.length > 5) {
         const moreItem = document.createElement('div');
         moreItem.className = 'watchlist-preview-item';
@@ -731,19 +733,21 @@ async function loadWatchlistPreview() {
     }
 }
 
-async function loadPreviewPrice(symbol, item) {
+async function loadPreviewPrices(items) {
     try {
-        const response = await fetch(`${API_BASE}/api/stock/${symbol}`);
+        const response = await fetch(`${API_BASE}/api/watchlist/prices`);
         const data = await response.json();
         
         if (response.ok) {
-            const stockInfo = data.stock_info || {};
-            const priceSpan = item.querySelector('span:last-child');
-            priceSpan.textContent = `$${(stockInfo.current_price || 0).toFixed(2)}`;
-            priceSpan.className = '';
+            for (const [symbol, item] of Object.entries(items)) {
+                const quote = data[symbol];
+                const priceSpan = item.querySelector('span:last-child');
+                priceSpan.textContent = quote ? `$${(quote.current_price || 0).toFixed(2)}` : 'N/A';
+                priceSpan.className = '';
+            }
         }
     } catch (error) {
-        console.error(`Error loading preview for ${symbol}:`, error);
+        console.error('Error loading watchlist prices:', error);
     }
 }
 
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+異步數據獲取引擎測試
+啟動本地HTTP服務器，測試大量股票並發獲取、每個數據源的並發上限、429熔斷統計和批量超時（需要aiohttp）
+"""
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+# 添加backend目錄到Python路徑
+backend_dir = Path(__file__).parent / "backend"
+sys.path.insert(0, str(backend_dir))
+
+# 測試不受全局每分鐘配額限制
+os.environ['RATE_LIMIT_GLOBAL_PER_MINUTE'] = '0'
+
+from async_fetch_engine import AsyncFetchEngine
+from circuit_breaker import circuit_breakers
+from rate_limiter import rate_limiter
+
+class StubHandler(BaseHTTPRequestHandler):
+    """/quote 延遲0.2秒返回報價；/slow 延遲3秒；/limited 返回429"""
+    protocol_version = 'HTTP/1.1'
+    lock = threading.Lock()
+    active = 0
+    max_active = 0
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/limited':
+            self.send_response(429)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        with self.lock:
+            StubHandler.active += 1
+            StubHandler.max_active = max(StubHandler.max_active, StubHandler.active)
+        time.sleep(3 if url.path == '/slow' else 0.2)
+        with self.lock:
+            StubHandler.active -= 1
+
+        symbol = parse_qs(url.query)['symbol'][0]
+        body = json.dumps({'symbol': symbol, 'c': 320.0}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class StubCollector:
+    """只提供引擎用到的 MultiSourceDataCollector 接口"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.data_sources = [
+            {'name': 'stub_fast', 'priority': 1, 'enabled': True, 'success_rate': 0.9},
+            {'name': 'stub_limited', 'priority': 2, 'enabled': True, 'success_rate': 0.9}
+        ]
+        self.updates = []
+
+    def _rest_request(self, source_name, symbol):
+        path = {'stub_limited': '/limited', 'stub_slow': '/slow'}.get(source_name, '/quote')
+        return f"{self.base_url}{path}", {'symbol': symbol}, symbol
+
+    def _parse_rest_response(self, source_name, data, clean_symbol):
+        return {'symbol': data['symbol'], 'current_price': data['c']} if 'c' in data else None
+
+    def _update_source_stats(self, source_name, success, rate_limited=False, symbol_miss=False):
+        self.updates.append((source_name, success, rate_limited))
+        breaker = circuit_breakers.get(source_name)
+        if success:
+            breaker.record_success()
+        elif symbol_miss:
+            breaker.release()
+        else:
+            breaker.record_failure(rate_limited=rate_limited)
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # 默認的5會讓同時建立的連接排隊重試
+
+def start_server():
+    server = StubServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def test_many_symbols_in_flight():
+    """測試200隻股票在一個事件循環中並發獲取，在途請求不超過數據源的並發上限"""
+    print("🧪 測試批量並發獲取...")
+    server, base_url = start_server()
+    rate_limiter.configure('stub_fast', 100000)
+    engine = AsyncFetchEngine(StubCollector(base_url))
+    engine.source_concurrency = {'stub_fast': 50}
+    try:
+        symbols = [f"{i:04d}.HK" for i in range(200)]
+        start_time = time.time()
+        results = engine.fetch_many(symbols, ['stub_fast'])
+        elapsed = time.time() - start_time
+
+        assert len(results) == 200
+        assert results['0042.HK'] == ('stub_fast', {'symbol': '0042.HK', 'current_price': 320.0})
+        # 逐個請求需要40秒，並發50個約0.8秒
+        assert elapsed < 5, f"batch took {elapsed:.1f}s"
+        assert StubHandler.max_active <= 50
+        stats = engine.get_stats()
+        assert stats['requests'] == 200 and stats['in_flight'] == 0
+        assert stats['max_in_flight'] == 50
+    finally:
+        engine.close()
+        server.shutdown()
+    print(f"   ✅ 200隻股票耗時 {elapsed:.2f}s")
+
+def test_rate_limited_source_falls_through():
+    """測試429計入熔斷器並換下一個數據源"""
+    print("🧪 測試429回退...")
+    server, base_url = start_server()
+    rate_limiter.configure('stub_fast', 100000)
+    rate_limiter.configure('stub_limited', 100000)
+    collector = StubCollector(base_url)
+    engine = AsyncFetchEngine(collector)
+    try:
+        success, data = engine.fetch('0700.HK', ['stub_fast', 'stub_limited'])
+        assert success and data['current_price'] == 320.0
+
+        # 只請求被限速的源時沒有結果
+        success, data = engine.fetch('0005.HK', ['stub_limited'])
+        assert not success and data == {}
+        assert ('stub_limited', False, True) in collector.updates
+        assert circuit_breakers.get('stub_limited').get_stats()['consecutive_failures'] >= 1
+    finally:
+        engine.close()
+        server.shutdown()
+    print("   ✅ 429回退正常")
+
+def test_sync_facade_reuses_loop():
+    """測試同步接口多次調用共用同一個事件循環線程和 ClientSession"""
+    print("🧪 測試事件循環復用...")
+    server, base_url = start_server()
+    rate_limiter.configure('stub_fast', 100000)
+    engine = AsyncFetchEngine(StubCollector(base_url))
+    try:
+        engine.fetch('0700.HK', ['stub_fast'])
+        loop, session = engine.loop, engine.session
+        engine.fetch('0005.HK', ['stub_fast'])
+        assert engine.loop is loop and engine.session is session
+        assert engine.get_stats()['batches'] == 2
+    finally:
+        engine.close()
+        server.shutdown()
+    assert not engine.get_stats()['running']
+    print("   ✅ 事件循環復用正常")
+
+def test_timeout_returns_partial_results():
+    """測試批量超時時返回已完成的股票，只有慢數據源上的股票缺失"""
+    print("🧪 測試批量超時...")
+    server, base_url = start_server()
+    rate_limiter.configure('stub_fast', 100000)
+    rate_limiter.configure('stub_slow', 100000)
+    collector = StubCollector(base_url)
+    collector.data_sources.append({'name': 'stub_slow', 'priority': 3, 'enabled': True, 'success_rate': 0.9})
+    engine = AsyncFetchEngine(collector)
+    engine.source_concurrency = {'stub_fast': 10, 'stub_slow': 2}
+    try:
+        fast = engine.fetch_many([f"{i:04d}.HK" for i in range(10)], ['stub_fast'], timeout=1.0)
+        assert len(fast) == 10
+
+        # 同一批中一隻股票只能從慢數據源獲取
+        original = collector._rest_request
+        collector._rest_request = lambda source_name, symbol: original(
+            'stub_slow' if symbol == '9999.HK' else source_name, symbol)
+        symbols = [f"{i:04d}.HK" for i in range(10, 20)] + ['9999.HK']
+        start_time = time.time()
+        results = engine.fetch_many(symbols, ['stub_fast'], timeout=1.0)
+        elapsed = time.time() - start_time
+
+        assert len(results) == 10 and '9999.HK' not in results
+        assert elapsed < 2, f"batch took {elapsed:.1f}s"
+        assert engine.get_stats()['timed_out_symbols'] == 1
+        assert engine.get_stats()['in_flight'] == 0
+    finally:
+        engine.close()
+        server.shutdown()
+    print(f"   ✅ 超時返回 {len(results)}/11 隻股票，耗時 {elapsed:.2f}s")
+
+def main():
+    """運行所有測試"""
+    print("🚀 異步數據獲取引擎測試")
+    print("=" * 50)
+
+    tests = [
+        test_many_symbols_in_flight,
+        test_rate_limited_source_falls_through,
+        test_sync_facade_reuses_loop,
+        test_timeout_returns_partial_results
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"   ❌ {test.__name__} 失敗: {e}")
+
+    print("=" * 50)
+    print(f"📊 測試結果: {passed}/{len(tests)} 通過")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+批量價格下載測試
+用本地構造的 yf.download 結果測試拆分、緩存和回退，不需要網絡
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# 添加backend目錄到Python路徑
+backend_dir = Path(__file__).parent / "backend"
+sys.path.insert(0, str(backend_dir))
+
+# 測試不受全局每分鐘配額限制；價格歷史保存在臨時目錄
+os.environ['RATE_LIMIT_GLOBAL_PER_MINUTE'] = '0'
+os.environ['CACHE_SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(), 'cache_store.db')
+
+import data_collector
+from cache_manager import cache_manager
+from price_history_store import price_history_store, CACHE_TYPE
+from rate_limiter import rate_limiter
+
+class FakeYahoo:
+    """記錄請求的 yfinance 替身：download 返回按股票分組的多層列，Ticker.history 返回空數據"""
+
+    def __init__(self, empty=()):
+        self.empty = set(empty)
+        self.error = None  # 設置後 download 拋出該異常
+        self.downloads = []
+        self.download_kwargs = []
+        self.histories = []
+
+    def download(self, tickers, **kwargs):
+        self.downloads.append(list(tickers))
+        self.download_kwargs.append(kwargs)
+        if self.error is not None:
+            raise self.error
+        index = pd.date_range('2024-01-01', periods=5, tz='Asia/Hong_Kong')
+        frames = {}
+        for i, symbol in enumerate(tickers):
+            close = np.arange(5.0) + 10 + i
+            if symbol in self.empty:
+                close[:] = np.nan
+            elif i % 2:
+                close[2] = np.nan  # 其他市場的交易日，本股票沒有數據
+            frames[symbol] = pd.DataFrame({'Open': close, 'High': close, 'Low': close,
+                                           'Close': close, 'Volume': [100] * 5}, index=index)
+        return pd.concat(frames, axis=1)
+
+    def Ticker(self, symbol):
+        fake = self
+
+        class Ticker:
+            def history(self, period=None, start=None, end=None):
+                fake.histories.append(symbol)
+                return pd.DataFrame()
+        return Ticker()
+
+def make_collector(fake):
+    data_collector.yf = fake
+    cache_manager.clear_type('price_data')
+    price_history_store.store.clear_type(CACHE_TYPE)
+    collector = data_collector.DataCollector()
+    collector.bulk_chunk_size = 2
+    return collector
+
+def test_bulk_download_splits_per_symbol():
+    """測試多隻股票分批下載並按股票拆分，去掉其他市場交易日的空行"""
+    print("🧪 測試批量拆分...")
+    fake = FakeYahoo()
+    collector = make_collector(fake)
+    prices = collector.get_stock_prices_bulk(['0700.HK', '0005.HK', '0941.HK', '0700.HK'], '5d')
+
+    assert fake.downloads == [['0700.HK', '0005.HK'], ['0941.HK']]
+    assert fake.histories == []
+    assert len(prices['0700.HK']) == 5
+    assert len(prices['0005.HK']) == 4
+    assert prices['0700.HK'].to_records()[-1] == {'date': '2024-01-05', 'open': 14.0, 'high': 14.0, 'low': 14.0,
+                                                  'close': 14.0, 'volume': 100, 'adj_close': 14.0}
+    print("   ✅ 批量拆分正常")
+
+def test_bulk_results_fill_price_cache():
+    """測試批量結果寫入與 get_stock_prices 相同的緩存鍵"""
+    print("🧪 測試緩存寫入...")
+    fake = FakeYahoo()
+    collector = make_collector(fake)
+    collector.get_stock_prices_bulk(['0700.HK', '0005.HK'], '5d')
+
+    assert collector.get_stock_prices('0005.HK', '5d') == cache_manager.get('price_data', '0005.HK_5d')
+    collector.get_stock_prices_bulk(['0700.HK', '0005.HK'], '5d')
+    assert len(fake.downloads) == 1
+    assert fake.histories == []
+    print("   ✅ 緩存寫入正常")
+
+def test_missing_symbols_fall_back():
+    """測試批量結果中沒有數據的股票單獨獲取，fallback=False 時直接跳過"""
+    print("🧪 測試缺失股票...")
+    fake = FakeYahoo(empty=['9999.HK'])
+    collector = make_collector(fake)
+    prices = collector.get_stock_prices_bulk(['0700.HK', '9999.HK'], '5d', fallback=False)
+    assert '9999.HK' not in prices
+    assert fake.histories == []
+
+    prices = collector.get_stock_prices_bulk(['0700.HK', '9999.HK'], '5d')
+    assert fake.histories == ['9999.HK']
+    assert prices['9999.HK']  # 回退數據
+    print("   ✅ 缺失股票處理正常")
+
+def test_expired_cache_refreshes_incrementally():
+    """測試 price_data 緩存過期後批量請求只下載最後幾根K線之後的數據"""
+    print("🧪 測試增量刷新...")
+    fake = FakeYahoo()
+    collector = make_collector(fake)
+    collector.get_stock_prices_bulk(['0700.HK', '0005.HK'], '5d')
+    assert fake.download_kwargs[0]['period'] == '5d'
+
+    cache_manager.clear_type('price_data')
+    incremental_fetches = price_history_store.get_stats()['incremental_fetches']
+    prices = collector.get_stock_prices_bulk(['0700.HK', '0005.HK'], '5d')
+    # 0700.HK 從倒數第二根K線開始增量下載；0005.HK 只有4根K線不足5d，完整重新下載
+    assert fake.downloads == [['0700.HK', '0005.HK'], ['0700.HK'], ['0005.HK']]
+    assert fake.download_kwargs[1]['start'] == '2024-01-04' and 'period' not in fake.download_kwargs[1]
+    assert fake.download_kwargs[2]['period'] == '5d'
+    assert len(prices['0700.HK']) == 5 and len(prices['0005.HK']) == 5  # 單獨下載時沒有空行
+    assert price_history_store.get_stats()['incremental_fetches'] == incremental_fetches + 1
+    print("   ✅ 增量刷新正常")
+
+def test_no_quota_returns_stored_history():
+    """測試配額不足時不逐隻請求，已有歷史的股票返回保存的歷史，其餘返回空序列"""
+    print("🧪 測試配額不足...")
+    fake = FakeYahoo()
+    collector = make_collector(fake)
+    collector.get_stock_prices_bulk(['0700.HK'], '5d')
+    cache_manager.clear_type('price_data')
+
+    collector.rate_limit_timeout = 0
+    while rate_limiter.try_acquire('yahoo_finance'):
+        pass
+    try:
+        prices = collector.get_stock_prices_bulk(['0700.HK', '0941.HK', '2318.HK'], '5d')
+    finally:
+        rate_limiter.state.pop('yahoo_finance', None)  # 恢復滿桶
+
+    assert fake.downloads == [['0700.HK']]
+    assert fake.histories == []
+    assert len(prices['0700.HK']) == 5
+    assert len(prices['0941.HK']) == 0 and len(prices['2318.HK']) == 0
+    # 過期的歷史不寫入緩存
+    assert cache_manager.get('price_data', '0700.HK_5d') is None
+    print("   ✅ 配額不足處理正常")
+
+def test_download_error_does_not_fan_out():
+    """測試批量請求失敗（例如429）時不逐隻請求，也不緩存回退數據"""
+    print("🧪 測試批量請求失敗...")
+    fake = FakeYahoo()
+    collector = make_collector(fake)
+    collector.get_stock_prices_bulk(['0700.HK'], '5d')
+    cache_manager.clear_type('price_data')
+
+    fake.error = Exception('429 Client Error: Too Many Requests')
+    prices = collector.get_stock_prices_bulk(['0700.HK', '0941.HK', '2318.HK', '0005.HK'], '5d')
+    assert len(fake.downloads) == 2  # 增量批次失敗後不再請求完整下載的批次
+    assert fake.histories == []
+    assert len(prices['0700.HK']) == 5
+    assert all(len(prices[symbol]) == 0 for symbol in ('0941.HK', '2318.HK', '0005.HK'))
+    assert cache_manager.get_stats()['cache_types'].get('price_data', 0) == 0
+
+    # yf.download 吞掉錯誤返回空表時同樣處理
+    fake.error = None
+    fake.empty = {'0941.HK', '2318.HK'}
+    prices = collector.get_stock_prices_bulk(['0941.HK', '2318.HK'], '5d')
+    assert fake.histories == []
+    assert len(prices['0941.HK']) == 0 and len(prices['2318.HK']) == 0
+    print("   ✅ 批量請求失敗處理正常")
+
+def main():
+    """運行所有測試"""
+    print("🚀 批量價格下載測試")
+    print("=" * 50)
+
+    tests = [
+        test_bulk_download_splits_per_symbol,
+        test_bulk_results_fill_price_cache,
+        test_missing_symbols_fall_back,
+        test_expired_cache_refreshes_incrementally,
+        test_no_quota_returns_stored_history,
+        test_download_error_does_not_fan_out
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"   ❌ {test.__name__} 失敗: {e}")
+
+    print("=" * 50)
+    print(f"📊 測試結果: {passed}/{len(tests)} 通過")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+"""
+緩存管理器單元測試
+直接測試 CacheManager，不需要啟動服務器
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+
+# 添加backend目錄到Python路徑
+backend_dir = Path(__file__).parent / "backend"
+sys.path.insert(0, str(backend_dir))
+
+from cache_manager import CacheManager, cache_manager, cached
+from cache_backends import SQLiteCacheBackend, create_backend
+from symbol_resolver import SymbolResolver
+
+def test_lru_eviction_by_entries():
+    """測試按條目數的LRU淘汰"""
+    print("🧪 測試LRU條目數淘汰...")
+    cache = CacheManager(num_shards=1)
+    cache.set_limits('price_data', max_entries=2)
+    
+    cache.set('price_data', 'A', [1])
+    cache.set('price_data', 'B', [2])
+    # 訪問A使其成為最近使用
+    assert cache.get('price_data', 'A') == [1]
+    cache.set('price_data', 'C', [3])
+    
+    assert cache.get('price_data', 'B') is None
+    assert cache.get('price_data', 'A') == [1]
+    assert cache.get('price_data', 'C') == [3]
+    
+    stats = cache.get_stats()
+    assert stats['evictions'] == 1
+    assert stats['evictions_by_type'] == {'price_data': 1}
+    print("   ✅ LRU條目數淘汰正常")
+
+def test_eviction_by_bytes():
+    """測試按字節預算的淘汰"""
+    print("🧪 測試字節預算淘汰...")
+    cache = CacheManager(num_shards=1)
+    cache.set_limits('analysis_result', max_entries=100, max_bytes=20000)
+    
+    for i in range(10):
+        cache.set('analysis_result', f"report_{i}", 'x' * 5000)
+    
+    stats = cache.get_stats()
+    assert stats['memory_usage']['analysis_result'] <= 20000
+    assert stats['cache_types']['analysis_result'] < 10
+    assert cache.get('analysis_result', 'report_9') is not None
+    
+    # 單個條目超過預算時不緩存
+    cache.set('analysis_result', 'huge', 'x' * 50000)
+    assert cache.get('analysis_result', 'huge') is None
+    assert cache.get_stats()['rejected'] == 1
+    print("   ✅ 字節預算淘汰正常")
+
+def test_expired_get_does_not_deadlock():
+    """測試過期條目在get時被清理"""
+    print("🧪 測試過期條目清理...")
+    cache = CacheManager()
+    cache.set('news', 'old', ['item'], ttl_seconds=-1)
+    assert cache.get('news', 'old') is None
+    stats = cache.get_stats()
+    assert stats['expirations'] == 1
+    assert stats['memory_usage']['news'] == 0
+    print("   ✅ 過期條目清理正常")
+
+def test_heap_cleanup_only_removes_expired():
+    """測試過期堆清理只刪除真正過期的條目"""
+    print("🧪 測試過期堆清理...")
+    cache = CacheManager()
+    cache.cleanup_batch_size = 3
+    
+    for i in range(10):
+        cache.set('news', f"expired_{i}", {'i': i}, ttl_seconds=-1)
+    cache.set('news', 'fresh', {'ok': True}, ttl_seconds=3600)
+    # 重新設置的條目不應被舊堆項刪除
+    cache.set('news', 'expired_0', {'i': 0}, ttl_seconds=3600)
+    
+    removed = cache._cleanup_expired()
+    assert removed == 9
+    assert cache.get('news', 'fresh') == {'ok': True}
+    assert cache.get('news', 'expired_0') == {'i': 0}
+    assert cache.get_stats()['expirations'] == 9
+    print("   ✅ 過期堆清理正常")
+
+def test_get_or_compute_coalesces_concurrent_misses():
+    """測試並發未命中只計算一次"""
+    print("🧪 測試單飛請求合併...")
+    cache = CacheManager()
+    calls = []
+    
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return {'symbol': '0700.HK'}
+    
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(
+            cache.get_or_compute('analysis_result', '0700.HK', compute)))
+        for _ in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    
+    assert len(calls) == 1
+    assert results == [{'symbol': '0700.HK'}] * 8
+    stats = cache.get_stats()
+    assert stats['computations'] == 1
+    assert stats['coalesced_waits'] == 7
+    assert stats['inflight'] == 0
+    print("   ✅ 單飛請求合併正常")
+
+def test_get_or_compute_propagates_errors():
+    """測試計算失敗時錯誤傳遞且不緩存"""
+    print("🧪 測試單飛錯誤傳遞...")
+    cache = CacheManager()
+    
+    def failing():
+        raise ValueError("upstream down")
+    
+    try:
+        cache.get_or_compute('analysis_result', 'bad', failing)
+        assert False, "expected ValueError"
+    except ValueError:
+        pass
+    assert cache.get('analysis_result', 'bad') is None
+    assert cache.get_or_compute('analysis_result', 'bad', lambda: 'ok') == 'ok'
+    print("   ✅ 單飛錯誤傳遞正常")
+
+def test_stale_while_revalidate():
+    """測試軟過期後返回舊數據並在後台刷新"""
+    print("🧪 測試stale-while-revalidate...")
+    cache = CacheManager()
+    cache.set_stale_ttl('stock_info', timedelta(seconds=30))
+    versions = iter(['v1', 'v2'])
+    
+    def compute():
+        time.sleep(0.05)
+        return next(versions)
+    
+    assert cache.get_or_compute('stock_info', '0005.HK', compute, ttl_seconds=0.05) == 'v1'
+    time.sleep(0.1)
+    # 軟過期：立即返回舊值，後台刷新
+    assert cache.get_or_compute('stock_info', '0005.HK', compute, ttl_seconds=60) == 'v1'
+    # 普通get不提供舊數據
+    deadline = time.time() + 2
+    while cache.get('stock_info', '0005.HK') != 'v2' and time.time() < deadline:
+        time.sleep(0.02)
+    assert cache.get('stock_info', '0005.HK') == 'v2'
+    
+    stats = cache.get_stats()
+    assert stats['stale_hits'] == 1
+    assert stats['background_refreshes'] == 1
+    assert stats['refresh_time_ms']['max'] >= 40
+    print("   ✅ stale-while-revalidate正常")
+
+def test_failed_refresh_keeps_stale_entry():
+    """測試後台刷新沒有拿到數據（返回None）時保留舊條目並計為刷新失敗"""
+    print("🧪 測試刷新失敗...")
+    cache = CacheManager()
+    cache.set_stale_ttl('stock_info', timedelta(seconds=30))
+    cache.set('stock_info', '0005.HK', 'real', ttl_seconds=0.05)
+    time.sleep(0.1)
+
+    assert cache.get_or_compute('stock_info', '0005.HK', lambda: None, ttl_seconds=60) == 'real'
+    deadline = time.time() + 2
+    while cache.get_stats()['refresh_failures'] == 0 and time.time() < deadline:
+        time.sleep(0.02)
+    stats = cache.get_stats()
+    assert stats['refresh_failures'] == 1 and stats['background_refreshes'] == 0
+    # 舊條目仍在窗口內，下一次仍返回舊數據
+    assert cache.get_or_compute('stock_info', '0005.HK', lambda: 'fresh', ttl_seconds=60) == 'real'
+
+    # 沒有舊條目時返回None，不寫入緩存
+    assert cache.get_or_compute('stock_info', '9999.HK', lambda: None) is None
+    assert cache.get('stock_info', '9999.HK') is None
+    print("   ✅ 刷新失敗處理正常")
+
+def test_hard_expiry_drops_stale_entry():
+    """測試超過硬過期時間的條目不再提供"""
+    print("🧪 測試硬過期...")
+    cache = CacheManager()
+    cache.set_stale_ttl('analysis_result', timedelta(0))
+    cache.set('analysis_result', 'X', 'old', ttl_seconds=-1)
+    assert cache.get_or_compute('analysis_result', 'X', lambda: 'new') == 'new'
+    assert cache.get_stats()['stale_hits'] == 0
+    print("   ✅ 硬過期正常")
+
+def test_sharded_budget_and_concurrency():
+    """測試分片緩存的總體容量和多線程讀寫"""
+    print("🧪 測試分片緩存...")
+    cache = CacheManager(num_shards=8)
+    cache.set_limits('price_data', max_entries=80)
+    errors = []
+    
+    def worker(worker_id):
+        try:
+            for i in range(500):
+                key = f"{worker_id}_{i % 50}"
+                cache.set('price_data', key, [i])
+                cache.get('price_data', key)
+                if i % 7 == 0:
+                    cache.delete('price_data', key)
+        except Exception as e:
+            errors.append(e)
+    
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    
+    assert not errors
+    stats = cache.get_stats()
+    assert stats['cache_types']['price_data'] <= 80
+    assert stats['evictions'] > 0
+    assert stats['shards'] == 8
+    print("   ✅ 分片緩存正常")
+
+def test_limits_are_global_across_shards():
+    """測試容量上限按類型在所有分片上合計，淘汰全局最久未使用的條目"""
+    print("🧪 測試跨分片容量上限...")
+    cache = CacheManager(num_shards=16)
+    cache.set_limits('economic_indicators', max_entries=100, max_bytes=64 * 1024)
+    for i in range(100):
+        cache.set('economic_indicators', f"indicator_{i}", [i])
+    # 100個鍵分佈不均也不會提前淘汰
+    assert cache.get_stats()['cache_types']['economic_indicators'] == 100
+    assert cache.get_stats()['evictions'] == 0
+    
+    assert cache.get('economic_indicators', 'indicator_0') == [0]
+    for i in range(100, 110):
+        cache.set('economic_indicators', f"indicator_{i}", [i])
+    assert cache.get_stats()['cache_types']['economic_indicators'] == 100
+    # 淘汰的是最舊的 indicator_1..10，剛訪問過的 indicator_0 保留
+    assert cache.get('economic_indicators', 'indicator_0') == [0]
+    assert all(cache.get('economic_indicators', f"indicator_{i}") is None for i in range(1, 11))
+    assert cache.get('economic_indicators', 'indicator_11') == [11]
+    assert cache.backend.totals.get('economic_indicators')[0] == 100
+    cache.delete('economic_indicators', 'indicator_11')
+    cache.clear_type('news')
+    assert cache.backend.totals.get('economic_indicators')[0] == 99
+    
+    # 超過 max_bytes / 16 但不超過 max_bytes 的單個條目可以緩存
+    cache.set_limits('news', max_entries=10, max_bytes=16 * 1024)
+    cache.set('news', 'big', 'x' * 4096)
+    assert cache.get('news', 'big') == 'x' * 4096
+    print("   ✅ 跨分片容量上限正常")
+
+def test_shard_placement_is_stable():
+    """測試分片位置不受 PYTHONHASHSEED 影響"""
+    print("🧪 測試分片位置...")
+    import zlib
+    backend = CacheManager(num_shards=16).backend
+    assert backend._shard('price_data', '0700.HK_1y') is backend.shards[zlib.crc32(b'price_data\x000700.HK_1y') % 16]
+    print("   ✅ 分片位置正常")
+
+def test_sqlite_backend_shared_between_managers():
+    """測試SQLite後端在兩個CacheManager（模擬兩個worker）之間共享"""
+    print("🧪 測試SQLite共享後端...")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "cache.db")
+        worker_a = CacheManager(backend=SQLiteCacheBackend(db_path))
+        worker_b = CacheManager(backend=SQLiteCacheBackend(db_path))
+        
+        worker_a.set('stock_info', '0700.HK', {'name': 'Tencent'})
+        assert worker_b.get('stock_info', '0700.HK') == {'name': 'Tencent'}
+        
+        # 另一個worker的計算結果直接命中，不會重複計算
+        calls = []
+        result = worker_b.get_or_compute('stock_info', '0700.HK', lambda: calls.append(1) or {})
+        assert result == {'name': 'Tencent'} and not calls
+        
+        # 容量限制和淘汰在共享存儲上生效
+        worker_a.set_limits('price_data', max_entries=2)
+        for key in ('A', 'B', 'C'):
+            worker_a.set('price_data', key, [key])
+        assert worker_b.get('price_data', 'A') is None
+        assert worker_b.get_cache_info('price_data')['entries'] == 2
+        
+        # 過期條目由清理線程分批刪除
+        worker_a.set('news', 'old', ['x'], ttl_seconds=0)
+        assert worker_b._cleanup_expired() == 1
+        assert worker_b.get('news', 'old') is None
+        
+        worker_b.delete('stock_info', '0700.HK')
+        assert worker_a.get('stock_info', '0700.HK') is None
+        assert worker_a.get_stats()['backend'] == 'sqlite'
+    print("   ✅ SQLite共享後端正常")
+
+def test_sqlite_clear_keeps_other_stores():
+    """測試共用 CACHE_SQLITE_PATH 時，清空 CacheManager 不影響代碼解析表等其他組件的條目"""
+    print("🧪 測試SQLite命名空間...")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "cache.db")
+        previous = os.environ.get('CACHE_SQLITE_PATH')
+        os.environ['CACHE_SQLITE_PATH'] = db_path
+        try:
+            cache = CacheManager(backend=create_backend('sqlite'))
+        finally:
+            if previous is None:
+                del os.environ['CACHE_SQLITE_PATH']
+            else:
+                os.environ['CACHE_SQLITE_PATH'] = previous
+        resolver = SymbolResolver(store_path=db_path)
+        resolver.record_success('700.HK', '0700.HK')
+        cache.set('stock_info', '0700.HK', {'name': 'Tencent'})
+
+        assert set(cache.get_stats()['cache_types']) == {'stock_info'}
+        cache.clear_all()
+        assert cache.get('stock_info', '0700.HK') is None
+        assert resolver.resolve('700.HK') == '0700.HK'
+        assert resolver.store.stats()['cache_types'] == {'symbol_variant': 1}
+    print("   ✅ SQLite命名空間正常")
+
+def test_snapshot_and_restore():
+    """測試快照保存和熱重啟恢復（丟棄已過期條目）"""
+    print("🧪 測試快照和恢復...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "snapshot.pkl")
+        cache = CacheManager(num_shards=4)
+        cache.set('stock_info', '0700.HK', {'name': 'Tencent'})
+        cache.set('price_data', '0700.HK_1y', [{'close': 320.0}])
+        cache.set('news', 'old', ['x'], ttl_seconds=0)
+        
+        result = cache.snapshot(path)
+        assert result['entries'] == 2
+        # 沒有新寫入時自動快照跳過
+        assert cache.snapshot(path, force=False)['entries'] == 0
+        
+        restarted = CacheManager(num_shards=4)
+        result = restarted.restore(path)
+        assert result['restored'] == 2
+        assert restarted.get('stock_info', '0700.HK') == {'name': 'Tencent'}
+        assert restarted.get('price_data', '0700.HK_1y') == [{'close': 320.0}]
+        assert restarted.get('news', 'old') is None
+        
+        # 快照期間條目過期的情況
+        cache.set('analysis_result', 'soon', {'score': 1}, ttl_seconds=0.05)
+        cache.set_stale_ttl('analysis_result', timedelta(0))
+        cache.set('analysis_result', 'short', {'score': 2}, ttl_seconds=0.05)
+        cache.snapshot(path)
+        time.sleep(0.06)
+        result = CacheManager(num_shards=4).restore(path)
+        assert result['expired'] == 1
+    print("   ✅ 快照和恢復正常")
+
+def test_cached_decorator():
+    """測試緩存裝飾器：穩定鍵、空結果緩存、獨立TTL"""
+    print("🧪 測試緩存裝飾器...")
+    calls = []
+    
+    class Collector:
+        @cached('news', ttl_override=timedelta(seconds=30), negative_ttl=timedelta(seconds=0.05))
+        def get_news(self, symbol, limit=5):
+            calls.append((symbol, limit))
+            return [] if symbol == 'EMPTY' else [symbol] * int(limit)
+    
+    # 不同實例、位置參數和關鍵字參數共用同一個鍵
+    assert Collector().get_news('0700.HK') == ['0700.HK'] * 5
+    assert Collector().get_news('0700.HK', 5) == ['0700.HK'] * 5
+    assert Collector().get_news(symbol='0700.HK', limit=5) == ['0700.HK'] * 5
+    assert calls == [('0700.HK', 5)]
+    # 參數類型不同時不共用
+    Collector().get_news('0700.HK', 5.0)
+    assert len(calls) == 2
+    
+    # 空結果也會緩存，但使用較短的TTL
+    assert Collector().get_news('EMPTY') == []
+    assert Collector().get_news('EMPTY') == []
+    assert len(calls) == 3
+    time.sleep(0.06)
+    Collector().get_news('EMPTY')
+    assert len(calls) == 4
+    
+    # 不修改該類型的全局TTL
+    assert cache_manager.ttl['news'] == timedelta(minutes=30)
+    
+    Collector.get_news.invalidate(None, '0700.HK')
+    Collector().get_news('0700.HK')
+    assert len(calls) == 5
+    print("   ✅ 緩存裝飾器正常")
+
+def test_tag_and_prefix_invalidation():
+    """測試按標籤和鍵前綴失效（內存和SQLite後端）"""
+    print("🧪 測試標籤和前綴失效...")
+    with tempfile.TemporaryDirectory() as tmp:
+        for cache in (CacheManager(num_shards=4),
+                      CacheManager(backend=SQLiteCacheBackend(str(Path(tmp) / "cache.db")))):
+            cache.set('stock_info', '0700.HK', {'name': 'Tencent'})
+            cache.set('price_data', '0700.HK_1y', [1], tags=['symbol:0700.HK', 'period:1y'])
+            cache.set('price_data', '0700.HK_1mo', [2], tags=['symbol:0700.HK', 'period:1mo'])
+            cache.set('price_data', '0005.HK_1y', [3], tags=['symbol:0005.HK', 'period:1y'])
+            cache.set('analysis_result', '0700.HK_report', '<html>', tags=['symbol:0700.HK'])
+            cache.set('news', 'DataCollector.get_market_news:abc', ['n'], tags=['symbol:0700.HK'])
+            # 未打標籤的舊鍵通過前綴失效
+            cache.set('price_data', '0700.HK_5d', [4])
+            
+            assert cache.invalidate_tag('period:1y', 'price_data') == 2
+            assert cache.get('price_data', '0700.HK_1mo') == [2]
+            
+            # 覆蓋寫入時替換標籤
+            cache.set('price_data', '0700.HK_1mo', [5], tags=['period:1mo'])
+            assert cache.invalidate_tag('symbol:0700.HK', 'price_data') == 0
+            cache.set('price_data', '0700.HK_1mo', [5], tags=['symbol:0700.HK'])
+            
+            assert cache.invalidate_stock_data('0700.HK') == 5
+            for cache_type, key in (('stock_info', '0700.HK'), ('price_data', '0700.HK_1mo'),
+                                    ('price_data', '0700.HK_5d'), ('analysis_result', '0700.HK_report'),
+                                    ('news', 'DataCollector.get_market_news:abc')):
+                assert cache.get(cache_type, key) is None
+            
+            cache.set('price_data', '0005.HK_1y', [3], tags=['symbol:0005.HK'])
+            cache.set('price_data', '0005.HK_6mo', [6])
+            cache.set('price_data', '0005.HKX_1y', [7])
+            assert cache.invalidate_prefix('price_data', '0005.HK_') == 2
+            assert cache.get('price_data', '0005.HKX_1y') == [7]
+            # 條目刪除後標籤索引同步清理
+            assert cache.invalidate_tag('symbol:0005.HK') == 0
+    print("   ✅ 標籤和前綴失效正常")
+
+def test_per_type_metrics():
+    """測試按類型的計數、延遲分位數、節省時間和Prometheus輸出"""
+    print("🧪 測試按類型統計...")
+    cache = CacheManager(num_shards=2)
+    
+    def slow_compute():
+        time.sleep(0.02)
+        return {'score': 1}
+    
+    cache.get_or_compute('analysis_result', '0700.HK', slow_compute)
+    for _ in range(10):
+        cache.get_or_compute('analysis_result', '0700.HK', slow_compute)
+    cache.get('news', 'missing')
+    cache.set_limits('price_data', max_entries=1)
+    cache.set('price_data', 'A', [1])
+    cache.set('price_data', 'B', [2])
+    
+    stats = cache.get_stats()
+    analysis = stats['by_type']['analysis_result']
+    assert analysis['hits'] == 10 and analysis['misses'] >= 1
+    assert analysis['computations'] == 1
+    assert analysis['compute_ms_avg'] >= 20
+    # 10次命中，每次約節省20ms
+    assert 150 <= analysis['time_saved_ms'] <= 1000
+    assert analysis['get_latency_ms']['samples'] >= 11
+    assert analysis['get_latency_ms']['p50'] <= analysis['get_latency_ms']['p99']
+    assert analysis['bytes'] > 0
+    assert stats['by_type']['news']['misses'] == 1
+    assert stats['by_type']['price_data']['evictions'] == 1
+    assert isinstance(stats['hit_rate_pct'], float)
+    
+    text = cache.get_prometheus_metrics()
+    assert 'cache_hits_total{type="analysis_result"} 10' in text
+    assert 'cache_latency_seconds{op="get",type="analysis_result",quantile="0.99"}' in text
+    assert '# TYPE cache_evictions_total counter' in text
+    assert 'cache_latency_seconds_count{op="get",type="analysis_result"} 11' in text
+    assert 'cache_latency_seconds_sum{op="get",type="analysis_result"}' in text
+    
+    # 節省時間是累計值：計算變慢（平均耗時上升）或樣本被替換都不會讓它減少
+    saved = analysis['time_saved_ms']
+    cache.record_compute_time('analysis_result', 0.0)
+    cache.record_compute_time('analysis_result', 0.0)
+    assert cache.get_stats()['by_type']['analysis_result']['time_saved_ms'] == saved
+    cache.get('analysis_result', '0700.HK')
+    assert cache.get_stats()['by_type']['analysis_result']['time_saved_ms'] >= saved
+    print("   ✅ 按類型統計正常")
+
+def main():
+    """運行所有測試"""
+    print("🚀 緩存管理器單元測試")
+    print("=" * 50)
+    
+    tests = [
+        test_lru_eviction_by_entries,
+        test_eviction_by_bytes,
+        test_expired_get_does_not_deadlock,
+        test_heap_cleanup_only_removes_expired,
+        test_get_or_compute_coalesces_concurrent_misses,
+        test_get_or_compute_propagates_errors,
+        test_stale_while_revalidate,
+        test_failed_refresh_keeps_stale_entry,
+        test_hard_expiry_drops_stale_entry,
+        test_sharded_budget_and_concurrency,
+        test_limits_are_global_across_shards,
+        test_shard_placement_is_stable,
+        test_sqlite_backend_shared_between_managers,
+        test_sqlite_clear_keeps_other_stores,
+        test_snapshot_and_restore,
+        test_cached_decorator,
+        test_tag_and_prefix_invalidation,
+        test_per_type_metrics
+    ]
+    
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"   ❌ {test.__name__} 失敗: {e}")
+    
+    print("=" * 50)
+    print(f"📊 測試結果: {passed}/{len(tests)} 通過")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
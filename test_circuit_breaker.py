@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+數據源熔斷器測試
+直接測試 CircuitBreaker，不需要啟動服務器
+"""
+import sys
+import time
+from pathlib import Path
+
+# 添加backend目錄到Python路徑
+backend_dir = Path(__file__).parent / "backend"
+sys.path.insert(0, str(backend_dir))
+
+from circuit_breaker import (CircuitBreaker, CircuitBreakerRegistry, http_status, is_rate_limit_error, is_upstream_failure,
+                             CLOSED, OPEN, HALF_OPEN)
+
+def test_trips_on_consecutive_failures():
+    """測試連續失敗達到閾值後熔斷，成功會重置計數"""
+    print("🧪 測試連續失敗熔斷...")
+    breaker = CircuitBreaker('finnhub', failure_threshold=3, open_timeout=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    # 熔斷期間直接拒絕
+    assert not breaker.allow_request()
+    stats = breaker.get_stats()
+    assert stats['trips'] == 1
+    assert stats['short_circuited'] == 1
+    assert stats['retry_in_seconds'] > 0
+    print("   ✅ 連續失敗熔斷正常")
+
+def test_trips_immediately_on_429():
+    """測試被上游限速時立即熔斷"""
+    print("🧪 測試429熔斷...")
+    assert is_rate_limit_error(Exception('429 Client Error: Too Many Requests'))
+    assert not is_rate_limit_error(Exception('404 Not Found'))
+
+    breaker = CircuitBreaker('yahoo_finance', failure_threshold=5, open_timeout=60)
+    breaker.record_failure(rate_limited=True)
+    assert breaker.state == OPEN
+    assert breaker.get_stats()['last_error'] == 'rate limited'
+    print("   ✅ 429熔斷正常")
+
+def test_half_open_single_probe():
+    """測試冷卻後只放行一個探測請求，成功後恢復"""
+    print("🧪 測試半開探測...")
+    breaker = CircuitBreaker('twelve_data', failure_threshold=1, open_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+
+    assert breaker.allow_request()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow_request()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow_request() and breaker.allow_request()
+    assert breaker.get_stats()['probes'] == 1
+    print("   ✅ 半開探測正常")
+
+def test_failed_probe_backs_off():
+    """測試探測失敗後重新熔斷並加倍冷卻時間"""
+    print("🧪 測試探測失敗退避...")
+    breaker = CircuitBreaker('marketstack', failure_threshold=1, open_timeout=0.05, max_open_timeout=0.15)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.current_timeout == 0.1
+
+    time.sleep(0.06)
+    assert not breaker.allow_request()
+    time.sleep(0.05)
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.current_timeout == 0.15  # 不超過上限
+    print("   ✅ 探測失敗退避正常")
+
+def test_release_returns_probe():
+    """測試放行後沒有發出請求時交還探測名額"""
+    print("🧪 測試交還探測名額...")
+    breaker = CircuitBreaker('iex_cloud', failure_threshold=1, open_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    breaker.release()
+    assert breaker.allow_request()
+    print("   ✅ 交還探測名額正常")
+
+def test_registry_shares_breakers():
+    """測試註冊表按名稱共用熔斷器並彙總狀態"""
+    print("🧪 測試熔斷器註冊表...")
+    registry = CircuitBreakerRegistry(failure_threshold=2, open_timeout=60)
+    registry.get('yahoo_finance').record_failure(rate_limited=True)
+    assert registry.get('yahoo_finance').state == OPEN
+    registry.get('quandl')
+
+    stats = registry.get_stats()
+    assert stats['yahoo_finance']['state'] == OPEN
+    assert stats['quandl']['state'] == CLOSED
+
+    registry.reset('yahoo_finance')
+    assert registry.get('yahoo_finance').allow_request()
+    print("   ✅ 熔斷器註冊表正常")
+
+def test_symbol_errors_are_not_upstream_failures():
+    """測試只有429、5xx和傳輸錯誤計入熔斷，404和數據錯誤只與單個代碼有關"""
+    print("🧪 測試錯誤分類...")
+    assert is_upstream_failure(Exception('429 Client Error: Too Many Requests'))
+    assert is_upstream_failure(Exception('503 Server Error: Service Unavailable'))
+    assert is_upstream_failure(ConnectionError('Connection refused'))
+    assert is_upstream_failure(TimeoutError('Read timed out'))
+    assert not is_upstream_failure(Exception('HTTP Error 404: Not Found'))
+    assert not is_upstream_failure(KeyError('regularMarketPrice'))
+    assert not is_upstream_failure(ValueError('No data found, symbol may be delisted'))
+    print("   ✅ 錯誤分類正常")
+
+def test_symbol_digits_are_not_status_codes():
+    """測試代碼中的數字（0429.HK、1429.HK）不會被當成429，狀態碼優先取自響應對象"""
+    print("🧪 測試狀態碼解析...")
+    not_found = Exception('HTTP Error 404: Not Found for url: https://query2.finance.yahoo.com/'
+                          'v10/finance/quoteSummary/1429.HK')
+    assert http_status(not_found) == 404
+    assert not is_rate_limit_error(not_found) and not is_upstream_failure(not_found)
+    no_data = ValueError('No data found for 2429.HK, symbol may be delisted')
+    assert http_status(no_data) is None
+    assert not is_rate_limit_error(no_data) and not is_upstream_failure(no_data)
+
+    class Response:
+        status_code = 429
+
+    class HTTPError(Exception):
+        response = Response()
+
+    limited = HTTPError('Client Error for url: https://finnhub.io/api/v1/quote?symbol=0404.HK')
+    assert http_status(limited) == 429 and is_rate_limit_error(limited) and is_upstream_failure(limited)
+    assert is_rate_limit_error(Exception('Too Many Requests. Rate limited. Try after a while.'))
+    print("   ✅ 狀態碼解析正常")
+
+def main():
+    """運行所有測試"""
+    print("🚀 數據源熔斷器測試")
+    print("=" * 50)
+
+    tests = [
+        test_trips_on_consecutive_failures,
+        test_trips_immediately_on_429,
+        test_half_open_single_probe,
+        test_failed_probe_backs_off,
+        test_release_returns_probe,
+        test_registry_shares_breakers,
+        test_symbol_errors_are_not_upstream_failures,
+        test_symbol_digits_are_not_status_codes
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"   ❌ {test.__name__} 失敗: {e}")
+
+    print("=" * 50)
+    print(f"📊 測試結果: {passed}/{len(tests)} 通過")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
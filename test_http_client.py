@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+共享HTTP連接池測試
+啟動本地HTTP服務器，測試連接復用、429/5xx重試和每個主機的統計
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# 添加backend目錄到Python路徑
+backend_dir = Path(__file__).parent / "backend"
+sys.path.insert(0, str(backend_dir))
+
+from http_client import PooledHTTPClient
+
+class StubHandler(BaseHTTPRequestHandler):
+    """/ok 返回200；/flaky 第一次返回503；/limited 總是返回429並要求等待一小時"""
+    protocol_version = 'HTTP/1.1'  # 支持keep-alive
+    calls = {}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        with self.lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+            count = self.calls[path]
+
+        if path == '/limited' or (path == '/flaky' and count == 1):
+            status = 429 if path == '/limited' else 503
+            self.send_response(status)
+            if status == 429:
+                self.send_header('Retry-After', '3600')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = json.dumps({'c': 320.0}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def test_connections_are_reused():
+    """測試同一主機的連續請求復用同一個連接"""
+    print("🧪 測試連接復用...")
+    server, base_url = start_server()
+    try:
+        # 掛載前綴包含端口（真實數據源使用默認端口，只需主機名）
+        client = PooledHTTPClient(host_pool_sizes={f'127.0.0.1:{server.server_address[1]}': 2})
+        for _ in range(5):
+            response = client.get(f"{base_url}/ok", params={'symbol': '0700'})
+            assert response.status_code == 200
+            assert response.json()['c'] == 320.0
+
+        host = client.get_stats()['hosts']['127.0.0.1']
+        assert host['requests'] == 5
+        assert host['connections_opened'] == 1
+        assert host['connections_reused'] == 4
+        assert host['pool_size'] == 2
+    finally:
+        server.shutdown()
+    print("   ✅ 連接復用正常")
+
+def test_retries_on_server_error():
+    """測試5xx按退避重試後成功"""
+    print("🧪 測試5xx重試...")
+    server, base_url = start_server()
+    try:
+        client = PooledHTTPClient(backoff_factor=0, host_pool_sizes={})
+        response = client.get(f"{base_url}/flaky")
+        assert response.status_code == 200
+        assert client.get_stats()['hosts']['127.0.0.1']['retries'] == 1
+    finally:
+        server.shutdown()
+    print("   ✅ 5xx重試正常")
+
+def test_rate_limited_response_is_returned():
+    """測試429帶很長的 Retry-After 時不重試也不等待，直接把響應交給調用方（由熔斷器處理）"""
+    print("🧪 測試429...")
+    server, base_url = start_server()
+    try:
+        client = PooledHTTPClient(retries=2, host_pool_sizes={})
+        start = time.perf_counter()
+        response = client.get(f"{base_url}/limited")
+        assert time.perf_counter() - start < 1.0
+        assert response.status_code == 429
+        assert StubHandler.calls['/limited'] == 1
+        stats = client.get_stats()
+        assert stats['hosts']['127.0.0.1']['retries'] == 0
+        assert stats['timeout'] == {'connect': 3.05, 'read': 10.0}
+    finally:
+        server.shutdown()
+    print("   ✅ 429處理正常")
+
+def main():
+    """運行所有測試"""
+    print("🚀 HTTP連接池測試")
+    print("=" * 50)
+
+    tests = [
+        test_connections_are_reused,
+        test_retries_on_server_error,
+        test_rate_limited_response_is_returned
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"   ❌ {test.__name__} 失敗: {e}")
+
+    print("=" * 50)
+    print(f"📊 測試結果: {passed}/{len(tests)} 通過")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
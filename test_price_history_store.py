@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+增量價格歷史存儲測試
+用臨時SQLite文件和本地構造的K線測試覆蓋判斷、增量追加去重、復權檢查和按週期切片，不需要網絡
+"""
+import os
+import sys
+import tempfile
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# 添加backend目錄到Python路徑
+backend_dir = Path(__file__).parent / "backend"
+sys.path.insert(0, str(backend_dir))
+
+# 測試不受全局每分鐘配額限制；價格歷史保存在臨時目錄
+os.environ['RATE_LIMIT_GLOBAL_PER_MINUTE'] = '0'
+os.environ['CACHE_SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(), 'cache_store.db')
+
+from price_series import PriceSeries
+from price_history_store import PriceHistoryStore, period_start
+
+def make_series(days: int, end: date = None, offset: float = 0.0) -> PriceSeries:
+    """到 end（默認今天）為止連續 days 天的K線，收盤價為 100 + 序號 + offset"""
+    end = end or date.today()
+    dates = np.arange(np.datetime64(end - timedelta(days=days - 1)), np.datetime64(end) + 1)
+    close = np.arange(days, dtype=np.float64) + 100 + offset
+    return PriceSeries(dates, close, close, close, close, [1000] * days)
+
+def make_store() -> PriceHistoryStore:
+    return PriceHistoryStore(os.path.join(tempfile.mkdtemp(), 'history.db'))
+
+def test_plan_and_coverage():
+    """測試已保存的歷史覆蓋較短週期，增量請求從倒數第二根K線開始"""
+    print("🧪 測試覆蓋判斷...")
+    store = make_store()
+    assert store.plan('0700.HK', '1mo') == (None, None)
+
+    series = make_series(400, end=date.today() - timedelta(days=3)).since(period_start('1y'))
+    store.save_full('0700.HK', '1y', series)
+    stored, start = store.plan('0700.HK', '1mo')
+    assert stored == series
+    assert start == series.dates[-2]
+    assert store.plan('0700.HK', '2y') == (None, None)
+    assert store.plan('0700.HK', '5d')[0] is not None
+
+    # 按交易日計的週期只能確認已保存的K線數
+    store.save_full('0005.HK', '5d', make_series(5))
+    assert store.plan('0005.HK', '5d')[0] is not None
+    assert store.plan('0005.HK', '1mo') == (None, None)
+    print("   ✅ 覆蓋判斷正常")
+
+def test_append_deduplicates_and_slices():
+    """測試增量數據追加後去重，最後一根K線以新數據為準"""
+    print("🧪 測試追加去重...")
+    store = make_store()
+    stored = make_series(30, end=date.today() - timedelta(days=2))
+    store.save_full('0700.HK', '1mo', stored)
+
+    # 從倒數第二根K線開始：前兩根與已保存的重疊，最後一根價格更新
+    newer = make_series(4, end=date.today(), offset=28)
+    newer = PriceSeries(newer.dates, newer.open, newer.high, newer.low,
+                        np.append(newer.close[:-1], 200.0), newer.volume)
+    merged = store.append('0700.HK', stored, newer)
+
+    assert len(merged) == 32
+    assert len(np.unique(merged.dates)) == 32
+    assert merged.dates[-1] == np.datetime64(date.today())
+    assert merged.last_close == 200.0
+    assert merged.close[-3] == newer.close[1]  # 原來的最後一根被覆蓋
+
+    assert store.slice(merged, '5d') == merged.tail(5)
+    assert store.slice(merged, '1mo') == merged.since(period_start('1mo'))
+    assert store.slice(merged, 'max') == merged
+    assert store.plan('0700.HK', '1mo')[0] == merged
+    print("   ✅ 追加去重正常")
+
+def test_adjustment_triggers_full_refetch():
+    """測試重疊K線價格變化（重新復權）時刪除歷史，需要完整重新下載"""
+    print("🧪 測試復權檢查...")
+    store = make_store()
+    stored = make_series(30)
+    store.save_full('0700.HK', '1mo', stored)
+
+    adjusted = make_series(2, offset=28 - 5)  # 整段歷史按派息調整後價格下降
+    assert store.append('0700.HK', stored, adjusted) is None
+    assert store.plan('0700.HK', '1mo') == (None, None)
+    assert store.get_stats()['adjustment_refetches'] == 1
+    print("   ✅ 復權檢查正常")
+
+def test_history_persists_across_instances():
+    """測試歷史保存在SQLite中，新實例（其他worker或重啟後）可以直接使用"""
+    print("🧪 測試持久化...")
+    path = os.path.join(tempfile.mkdtemp(), 'history.db')
+    series = make_series(30)
+    PriceHistoryStore(path).save_full('0700.HK', '1mo', series)
+
+    stored, start = PriceHistoryStore(path).plan('0700.HK', '1mo')
+    assert stored == series
+    assert start == series.dates[-2]
+    print("   ✅ 持久化正常")
+
+def test_collector_fetches_missing_range_only():
+    """測試 get_stock_prices 緩存過期後只請求最後幾根K線之後的數據"""
+    print("🧪 測試收集器增量請求...")
+    import data_collector
+    from cache_manager import cache_manager
+    from price_history_store import price_history_store, CACHE_TYPE
+
+    requests = []
+
+    class FakeYahoo:
+        def Ticker(self, symbol):
+            class Ticker:
+                def history(self, period=None, start=None, end=None):
+                    requests.append({'period': period, 'start': start})
+                    days = 2 if start else 30
+                    index = pd.date_range(end=pd.Timestamp(date.today()), periods=days, tz='Asia/Hong_Kong')
+                    close = np.arange(days, dtype=np.float64) + 100 + (28 if start else 0)
+                    return pd.DataFrame({'Open': close, 'High': close, 'Low': close,
+                                         'Close': close, 'Volume': [1000] * days}, index=index)
+            return Ticker()
+
+    data_collector.yf = FakeYahoo()
+    cache_manager.clear_type('price_data')
+    price_history_store.store.clear_type(CACHE_TYPE)
+    collector = data_collector.DataCollector()
+
+    first = collector.get_stock_prices('0700.HK', '1mo')
+    cache_manager.clear_type('price_data')
+    second = collector.get_stock_prices('0700.HK', '1mo')
+
+    assert requests[0] == {'period': '1mo', 'start': None}
+    assert requests[1] == {'period': None, 'start': str(first.dates[-2])}
+    assert second == first.since(period_start('1mo'))
+    print("   ✅ 收集器增量請求正常")
+
+def main():
+    """運行所有測試"""
+    print("🚀 增量價格歷史存儲測試")
+    print("=" * 50)
+
+    tests = [
+        test_plan_and_coverage,
+        test_append_deduplicates_and_slices,
+        test_adjustment_triggers_full_refetch,
+        test_history_persists_across_instances,
+        test_collector_fetches_missing_range_only
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"   ❌ {test.__name__} 失敗: {e}")
+
+    print("=" * 50)
+    print(f"📊 測試結果: {passed}/{len(tests)} 通過")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+PriceSeries 按列價格序列測試
+測試從yfinance數據構造、排序、記錄轉換、緩存序列化，以及分析器直接使用 PriceSeries
+"""
+import os
+import pickle
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# 添加backend目錄到Python路徑
+backend_dir = Path(__file__).parent / "backend"
+sys.path.insert(0, str(backend_dir))
+
+from price_series import PriceSeries, as_price_series
+from analyzer import InvestmentAnalyzer
+from cache_backends import SQLiteCacheBackend, estimate_size
+
+def make_history(rows, tz='Asia/Hong_Kong'):
+    rng = np.random.default_rng(7)
+    close = 100 * np.cumprod(1 + rng.normal(0, 0.01, rows))
+    index = pd.date_range(end='2024-06-28', periods=rows, freq='B', tz=tz)
+    return pd.DataFrame({'Open': close * 0.99, 'High': close * 1.01, 'Low': close * 0.98, 'Close': close,
+                         'Volume': rng.integers(1_000_000, 10_000_000, rows)}, index=index)
+
+def test_from_history_matches_rows():
+    """測試整列構造的記錄與原來逐行轉換完全一致（包括帶時區的索引）"""
+    print("🧪 測試從歷史數據構造...")
+    for tz in ('Asia/Hong_Kong', None):
+        hist = make_history(300, tz)
+        expected = [{'date': date.strftime('%Y-%m-%d'), 'open': float(row['Open']), 'high': float(row['High']),
+                     'low': float(row['Low']), 'close': float(row['Close']), 'volume': int(row['Volume']),
+                     'adj_close': float(row['Close'])} for date, row in hist.iterrows()]
+        series = PriceSeries.from_history(hist)
+        assert series.to_records() == expected
+        assert PriceSeries.from_records(expected) == series
+    print("   ✅ 從歷史數據構造正常")
+
+def test_sorted_once_and_read_only():
+    """測試構造時按日期排序，數組只讀"""
+    print("🧪 測試排序...")
+    series = PriceSeries.from_records([
+        {'date': '2024-01-03', 'open': 3, 'high': 3, 'low': 3, 'close': 3, 'volume': 300},
+        {'date': '2024-01-01', 'open': 1, 'high': 1, 'low': 1, 'close': 1, 'volume': None},
+        {'date': '2024-01-02', 'open': 2, 'high': 2, 'low': 2, 'close': 2, 'volume': 200}
+    ])
+    assert series.close.tolist() == [1.0, 2.0, 3.0]
+    assert series.volume.tolist() == [0, 200, 300]
+    assert series.last_close == 3.0
+    try:
+        series.close[0] = 5.0
+        assert False, "cached arrays must be read-only"
+    except ValueError:
+        pass
+    assert len(as_price_series([])) == 0
+    print("   ✅ 排序正常")
+
+def test_cache_round_trip_and_size():
+    """測試經過pickle和SQLite緩存後數據不變，估算大小遠小於記錄列表"""
+    print("🧪 測試緩存序列化...")
+    series = PriceSeries.from_history(make_history(252))
+    assert pickle.loads(pickle.dumps(series, protocol=5)) == series
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = SQLiteCacheBackend(os.path.join(tmp, 'cache_store.db'))
+        backend.put('price_data', '0700.HK_1y', series, 2e9, 2e9, 10, 10 * 1024 * 1024)
+        assert backend.get('price_data', '0700.HK_1y').data == series
+
+    records_size = estimate_size(series.to_records())
+    series_size = estimate_size(series)
+    assert series_size >= 252 * 48
+    assert series_size * 5 < records_size, (series_size, records_size)
+    print(f"   ✅ 緩存序列化正常（{series_size} vs {records_size} 字節）")
+
+def test_analyzer_uses_series():
+    """測試分析器對 PriceSeries 和亂序記錄列表計算出相同指標"""
+    print("🧪 測試分析器...")
+    analyzer = InvestmentAnalyzer()
+    series = PriceSeries.from_history(make_history(260))
+    records = series.to_records()[::-1]
+
+    for method in (analyzer.calculate_technical_indicators, analyzer.calculate_risk_metrics):
+        from_records = method(records)
+        from_series = method(series)
+        assert from_records and from_records.keys() == from_series.keys()
+        for key in from_records:
+            assert abs(from_records[key] - from_series[key]) < 1e-9, key
+    assert analyzer.calculate_technical_indicators(PriceSeries.from_records(records[:10])) == {}
+    print("   ✅ 分析器正常")
+
+def main():
+    """運行所有測試"""
+    print("🚀 PriceSeries 測試")
+    print("=" * 50)
+
+    tests = [
+        test_from_history_matches_rows,
+        test_sorted_once_and_read_only,
+        test_cache_round_trip_and_size,
+        test_analyzer_uses_series
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"   ❌ {test.__name__} 失敗: {e}")
+
+    print("=" * 50)
+    print(f"📊 測試結果: {passed}/{len(tests)} 通過")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+令牌桶速率限制器測試
+直接測試 RateLimiter，不需要啟動服務器
+"""
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 添加backend目錄到Python路徑
+backend_dir = Path(__file__).parent / "backend"
+sys.path.insert(0, str(backend_dir))
+
+from rate_limiter import RateLimiter, GLOBAL_BUCKET
+
+def test_burst_capacity():
+    """測試桶容量內的突發請求立即通過，超出後被拒絕"""
+    print("🧪 測試突發容量...")
+    limiter = RateLimiter()
+    limiter.configure('yahoo_finance', 60, burst=3)
+    assert all(limiter.try_acquire('yahoo_finance') for _ in range(3))
+    assert not limiter.try_acquire('yahoo_finance')
+
+    stats = limiter.get_stats()['buckets']['yahoo_finance']
+    assert stats['acquired'] == 3
+    assert stats['rejected'] == 1
+    print("   ✅ 突發容量正常")
+
+def test_blocking_acquire():
+    """測試配額不足時阻塞等待補充，超時則返回False"""
+    print("🧪 測試阻塞獲取...")
+    limiter = RateLimiter()
+    limiter.configure('finnhub', 600, burst=1)  # 每0.1秒補充一個令牌
+    assert limiter.acquire('finnhub')
+
+    start_time = time.time()
+    assert limiter.acquire('finnhub', timeout=1.0)
+    waited = time.time() - start_time
+    assert 0.05 <= waited < 0.5, waited
+
+    # 等待時間超過timeout時不睡眠，直接拒絕
+    start_time = time.time()
+    assert not limiter.acquire('finnhub', timeout=0.01)
+    assert time.time() - start_time < 0.05
+    print("   ✅ 阻塞獲取正常")
+
+def test_request_wait_accounting():
+    """測試按線程統計每個請求因限速增加的延遲"""
+    print("🧪 測試請求延遲統計...")
+    limiter = RateLimiter()
+    limiter.configure('yahoo_finance', 600, burst=1)
+
+    # 有配額時冷請求不增加延遲
+    limiter.begin_request()
+    assert limiter.acquire('yahoo_finance', timeout=1.0)
+    assert limiter.request_wait() < 0.01
+
+    # 配額不足時只等待到下一個令牌
+    assert limiter.acquire('yahoo_finance', timeout=1.0)
+    assert 0.05 <= limiter.request_wait() < 0.5
+
+    limiter.begin_request()
+    assert limiter.request_wait() == 0.0
+    stats = limiter.get_stats()['buckets']['yahoo_finance']
+    assert stats['acquired'] == 2
+    assert stats['paced'] == 1
+    print("   ✅ 請求延遲統計正常")
+
+def test_global_bucket():
+    """測試全局桶限制所有數據源的總請求數"""
+    print("🧪 測試全局限制...")
+    limiter = RateLimiter(global_per_minute=6)  # 容量1
+    limiter.configure('alpha_vantage', 600)
+    limiter.configure('finnhub', 600)
+    assert limiter.try_acquire('alpha_vantage')
+    assert not limiter.try_acquire('finnhub')
+
+    # 全局桶拒絕時數據源桶的令牌不被扣除
+    stats = limiter.get_stats()['buckets']
+    assert stats['finnhub']['tokens'] == stats['finnhub']['capacity']
+    assert stats[GLOBAL_BUCKET]['acquired'] == 1
+    print("   ✅ 全局限制正常")
+
+def test_source_only_acquire():
+    """測試 use_global=False 的請求只受數據源桶限制，不佔用全局配額"""
+    print("🧪 測試不佔用全局配額...")
+    limiter = RateLimiter(global_per_minute=6)  # 容量1
+    limiter.configure('yahoo_finance', 600, burst=3)
+    for _ in range(3):
+        assert limiter.acquire('yahoo_finance', timeout=0, use_global=False)
+    # 數據源桶耗盡後仍然受限
+    assert not limiter.acquire('yahoo_finance', timeout=0, use_global=False)
+
+    stats = limiter.get_stats()['buckets']
+    assert stats[GLOBAL_BUCKET]['tokens'] == stats[GLOBAL_BUCKET]['capacity']
+    assert stats[GLOBAL_BUCKET]['acquired'] == 0
+    assert limiter.try_acquire('finnhub')
+    print("   ✅ 不佔用全局配額正常")
+
+def test_stricter_rate_wins():
+    """測試同一數據源被多處配置時採用較低的速率"""
+    print("🧪 測試配置合併...")
+    limiter = RateLimiter()
+    limiter.configure('yahoo_finance', 100)
+    limiter.configure('yahoo_finance', 10)
+    limiter.configure('yahoo_finance', 50)
+    assert limiter.get_stats()['buckets']['yahoo_finance']['per_minute'] == 10
+
+    # set_rate 可以放寬速率，並重置為滿桶
+    limiter.configure('finnhub', 6, burst=1)
+    assert limiter.try_acquire('finnhub') and not limiter.try_acquire('finnhub')
+    limiter.set_rate('finnhub', 600, burst=5)
+    assert limiter.get_stats()['buckets']['finnhub']['per_minute'] == 600
+    assert all(limiter.try_acquire('finnhub') for _ in range(5))
+    print("   ✅ 配置合併正常")
+
+def test_shared_state_across_instances():
+    """測試設置狀態文件後多個限速器（模擬多個worker）共享配額"""
+    print("🧪 測試跨進程共享...")
+    with tempfile.TemporaryDirectory() as tmp:
+        state_path = os.path.join(tmp, 'rate_limiter.json')
+        worker_a = RateLimiter(state_path=state_path)
+        worker_b = RateLimiter(state_path=state_path)
+        if worker_a.state_path is None:
+            print("   ⚠️ 平台不支持文件鎖，跳過")
+            return
+        for limiter in (worker_a, worker_b):
+            limiter.configure('twelve_data', 12, burst=2)
+
+        assert worker_a.try_acquire('twelve_data')
+        assert worker_b.try_acquire('twelve_data')
+        assert not worker_a.try_acquire('twelve_data')
+        assert not worker_b.try_acquire('twelve_data')
+    print("   ✅ 跨進程共享正常")
+
+def main():
+    """運行所有測試"""
+    print("🚀 速率限制器測試")
+    print("=" * 50)
+
+    tests = [
+        test_burst_capacity,
+        test_blocking_acquire,
+        test_request_wait_accounting,
+        test_global_bucket,
+        test_source_only_acquire,
+        test_stricter_rate_wins,
+        test_shared_state_across_instances
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"   ❌ {test.__name__} 失敗: {e}")
+
+    print("=" * 50)
+    print(f"📊 測試結果: {passed}/{len(tests)} 通過")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+SmartDataFetcher 文件緩存測試
+直接測試兩級緩存（內存L1 + SQLite存儲L2），不需要啟動服務器
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# 添加backend目錄到Python路徑
+backend_dir = Path(__file__).parent / "backend"
+sys.path.insert(0, str(backend_dir))
+
+# 測試不受全局每分鐘配額限制
+os.environ['RATE_LIMIT_GLOBAL_PER_MINUTE'] = '0'
+
+import smart_data_fetcher
+from smart_data_fetcher import SmartDataFetcher
+from circuit_breaker import circuit_breakers, CLOSED, OPEN
+from rate_limiter import rate_limiter, YAHOO_FINANCE_PER_MINUTE
+
+SAMPLE = {'longName': '騰訊控股有限公司', 'currentPrice': 320.0, 'regularMarketPrice': 320.0}
+
+def test_l1_serves_repeat_reads():
+    """測試重複讀取由L1提供，L2只讀取一次"""
+    print("🧪 測試L1緩存...")
+    with tempfile.TemporaryDirectory() as tmp:
+        store_path = os.path.join(tmp, 'cache_store.db')
+        SmartDataFetcher(store_path)._cache_data('0700.HK', SAMPLE)
+
+        # 新實例模擬進程重啟（關閉預加載）：第一次讀L2，之後命中L1
+        os.environ['SMART_CACHE_PRELOAD'] = '0'
+        try:
+            fetcher = SmartDataFetcher(store_path)
+        finally:
+            del os.environ['SMART_CACHE_PRELOAD']
+        for _ in range(5):
+            assert fetcher._get_cached_data('0700.HK') == SAMPLE
+
+        stats = fetcher.get_cache_stats()
+        assert stats['l2']['reads'] == 1
+        assert stats['l2']['hits'] == 1
+        assert stats['l1']['hits'] == 4
+    print("   ✅ L1緩存正常")
+
+def test_l1_revalidates_on_store_change():
+    """測試條目被其他進程改寫後L1失效並重新讀取"""
+    print("🧪 測試版本校驗...")
+    with tempfile.TemporaryDirectory() as tmp:
+        store_path = os.path.join(tmp, 'cache_store.db')
+        writer = SmartDataFetcher(store_path)
+        reader = SmartDataFetcher(store_path)
+
+        writer._cache_data('0700.HK', SAMPLE)
+        assert reader._get_cached_data('0700.HK') == SAMPLE
+
+        updated = dict(SAMPLE, currentPrice=330.0)
+        time.sleep(0.01)
+        writer._cache_data('0700.HK', updated)
+        assert reader._get_cached_data('0700.HK') == updated
+        assert reader.get_cache_stats()['l2']['reads'] == 2
+
+        writer.store.delete('smart_fetcher', '0700.HK')
+        assert reader._get_cached_data('0700.HK') is None
+    print("   ✅ 版本校驗正常")
+
+def test_expired_entry_is_miss():
+    """測試兩級緩存使用同一個TTL"""
+    print("🧪 測試緩存過期...")
+    with tempfile.TemporaryDirectory() as tmp:
+        fetcher = SmartDataFetcher(os.path.join(tmp, 'cache_store.db'))
+        fetcher.cache_ttl = timedelta(seconds=0.05)
+        fetcher._cache_data('0700.HK', SAMPLE)
+        assert fetcher._get_cached_data('0700.HK') == SAMPLE
+
+        time.sleep(0.06)
+        # 版本未變化，直接由L1判定過期，不再讀取L2
+        assert fetcher._get_cached_data('0700.HK') is None
+        stats = fetcher.get_cache_stats()
+        assert stats['l2']['reads'] == 0
+        assert stats['expired'] == 1
+    print("   ✅ 緩存過期正常")
+
+def test_projection_and_bulk_get():
+    """測試只保存用到的字段，並可一次批量讀取多隻股票"""
+    print("🧪 測試字段裁剪和批量讀取...")
+    with tempfile.TemporaryDirectory() as tmp:
+        store_path = os.path.join(tmp, 'cache_store.db')
+        fetcher = SmartDataFetcher(store_path)
+        fetcher._cache_data('0700.HK', dict(SAMPLE, address1='Tencent Binhai Towers', companyOfficers=[{}] * 10))
+        fetcher._cache_data('0005.HK', dict(SAMPLE, longName='匯豐控股有限公司'))
+
+        # 所有股票共用一個存儲文件
+        assert os.listdir(tmp) and all(name.startswith('cache_store.db') for name in os.listdir(tmp))
+
+        other = SmartDataFetcher(store_path)
+        cached = other.get_cached_many(['0700.HK', '0005.HK', '9988.HK'])
+        assert cached['0700.HK'] == SAMPLE
+        assert cached['0005.HK']['longName'] == '匯豐控股有限公司'
+        assert '9988.HK' not in cached
+
+        # 預加載的熱門股票直接命中L1
+        assert other.get_cache_stats()['l1']['preloaded'] == 2
+        assert other._get_cached_data('0005.HK')['longName'] == '匯豐控股有限公司'
+        assert other.get_cache_stats()['l1']['hits'] == 1
+
+        result = other.compact_cache()
+        assert result['bytes_after'] > 0
+    print("   ✅ 字段裁剪和批量讀取正常")
+
+def test_legacy_files_are_imported():
+    """測試舊版每股票緩存文件在啟動時導入存儲"""
+    print("🧪 測試舊格式導入...")
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = {'data': dict(SAMPLE, address1='Tencent Binhai Towers'),
+                  'timestamp': datetime.now().isoformat()}
+        with open(os.path.join(tmp, 'cache_0700_HK.json'), 'w', encoding='utf-8') as f:
+            json.dump(legacy, f, ensure_ascii=False, indent=2)
+        # 過期的舊緩存不導入
+        legacy['timestamp'] = (datetime.now() - timedelta(hours=1)).isoformat()
+        with open(os.path.join(tmp, 'cache_0005_HK.json'), 'w', encoding='utf-8') as f:
+            json.dump(legacy, f)
+
+        fetcher = SmartDataFetcher(os.path.join(tmp, 'cache_store.db'))
+        assert fetcher.get_cache_stats()['l2']['migrated'] == 1
+        assert fetcher._get_cached_data('0700.HK') == SAMPLE
+        assert fetcher._get_cached_data('0005.HK') is None
+    print("   ✅ 舊格式導入正常")
+
+def test_invalid_symbols_do_not_trip_breaker():
+    """測試未知或已退市代碼沒有數據時不打開共享的Yahoo熔斷器，5xx仍然計入"""
+    print("🧪 測試代碼級失敗...")
+
+    class FakeYahoo:
+        def __init__(self, error=None):
+            self.error = error
+
+        def Ticker(self, symbol):
+            error = self.error
+
+            class Ticker:
+                @property
+                def info(self):
+                    if error:
+                        raise error
+                    return {}
+            return Ticker()
+
+    original_yf = smart_data_fetcher.yf
+    breaker = circuit_breakers.get('yahoo_finance')
+    circuit_breakers.reset('yahoo_finance')
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            fetcher = SmartDataFetcher(os.path.join(tmp, 'cache_store.db'))
+            # 構造時 configure 會把速率收緊到 YAHOO_FINANCE_PER_MINUTE，之後再放寬
+            rate_limiter.set_rate('yahoo_finance', 100000)
+            smart_data_fetcher.yf = FakeYahoo()
+            for i in range(breaker.failure_threshold + 2):
+                fetcher.fetch_stock_data(f"99{i:02d}.HK")
+            assert breaker.state == CLOSED and breaker.consecutive_failures == 0
+
+            smart_data_fetcher.yf = FakeYahoo(Exception('404 Client Error: Not Found'))
+            for i in range(breaker.failure_threshold + 2):
+                fetcher.fetch_stock_data(f"98{i:02d}.HK")
+            assert breaker.state == CLOSED
+
+            smart_data_fetcher.yf = FakeYahoo(Exception('502 Server Error: Bad Gateway'))
+            for i in range(breaker.failure_threshold):
+                fetcher.fetch_stock_data(f"97{i:02d}.HK")
+            assert breaker.state == OPEN
+    finally:
+        smart_data_fetcher.yf = original_yf
+        circuit_breakers.reset('yahoo_finance')
+        rate_limiter.set_rate('yahoo_finance', YAHOO_FINANCE_PER_MINUTE)
+    print("   ✅ 代碼級失敗正常")
+
+def main():
+    """運行所有測試"""
+    print("🚀 SmartDataFetcher 緩存測試")
+    print("=" * 50)
+
+    tests = [
+        test_l1_serves_repeat_reads,
+        test_l1_revalidates_on_store_change,
+        test_expired_entry_is_miss,
+        test_projection_and_bulk_get,
+        test_legacy_files_are_imported,
+        test_invalid_symbols_do_not_trip_breaker
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"   ❌ {test.__name__} 失敗: {e}")
+
+    print("=" * 50)
+    print(f"📊 測試結果: {passed}/{len(tests)} 通過")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+多源對沖請求測試
+用按固定延遲返回的模擬數據源測試 _fetch_hedged 的對沖延遲、並發上限、取消排隊請求、總超時和統計，不需要網絡
+"""
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+# 測試不受全局配額限制（需在導入限速器之前設置）
+os.environ['RATE_LIMIT_GLOBAL_PER_MINUTE'] = '0'
+
+# 添加backend目錄到Python路徑
+backend_dir = Path(__file__).parent / "backend"
+sys.path.insert(0, str(backend_dir))
+
+from multi_source_collector import MultiSourceDataCollector
+
+class StubSource:
+    """延遲 delay 秒後返回結果的數據源，記錄調用時間和同時在途的請求數"""
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+
+    def __init__(self, name, delay, success=True):
+        self.name = name
+        self.delay = delay
+        self.success = success
+        self.calls = []
+
+    def __call__(self, symbol):
+        with self.lock:
+            self.calls.append(time.time())
+            StubSource.in_flight += 1
+            StubSource.max_in_flight = max(StubSource.max_in_flight, StubSource.in_flight)
+        try:
+            time.sleep(self.delay)
+        finally:
+            with self.lock:
+                StubSource.in_flight -= 1
+        if not self.success:
+            return False, {}
+        return True, {'symbol': symbol, 'current_price': 320.0, 'data_source': self.name}
+
+def make_collector(stubs, hedge_delay=0.2, max_concurrent=2, hedge_timeout=20.0):
+    """用模擬數據源替換收集器的全部數據源；模擬源不經過限速器，只測試對沖調度"""
+    collector = MultiSourceDataCollector()
+    collector.hedge_delay = hedge_delay
+    collector.max_concurrent = max_concurrent
+    collector.hedge_timeout = hedge_timeout
+    collector.data_sources = [
+        {'name': stub.name, 'priority': priority, 'enabled': True, 'rate_limit': 100000,
+         'last_request': 0, 'success_rate': 1.0, 'fallback': False}
+        for priority, stub in enumerate(stubs, start=1)
+    ]
+    collector.fetchers = {stub.name: stub for stub in stubs}
+    StubSource.in_flight = 0
+    StubSource.max_in_flight = 0
+    return collector
+
+def hedge_stats(collector):
+    return collector.get_stats()['hedging']
+
+def test_fast_primary_no_hedge():
+    """測試首選源在對沖延遲內返回時不啟動備用源"""
+    print("🧪 測試首選源及時返回...")
+    primary, backup = StubSource('hedge_fast_primary', 0.05), StubSource('hedge_fast_backup', 0.05)
+    collector = make_collector([primary, backup], hedge_delay=0.3)
+    source_name, data = collector._fetch_hedged('0700.HK', collector.data_sources)
+
+    assert source_name == 'hedge_fast_primary' and data['current_price'] == 320.0
+    time.sleep(0.35)
+    assert len(primary.calls) == 1 and backup.calls == []
+    stats = hedge_stats(collector)
+    assert stats['hedges_launched'] == 0 and stats['hedged_fetches'] == 0 and stats['hedge_wins'] == 0
+    print("   ✅ 首選源及時返回正常")
+
+def test_slow_primary_is_hedged():
+    """測試首選源超過對沖延遲未返回時啟動備用源，並採用先返回的結果"""
+    print("🧪 測試對沖啟動...")
+    primary, backup = StubSource('hedge_slow_primary', 1.0), StubSource('hedge_slow_backup', 0.05)
+    collector = make_collector([primary, backup], hedge_delay=0.2)
+    start_time = time.time()
+    source_name, data = collector._fetch_hedged('0700.HK', collector.data_sources)
+    elapsed = time.time() - start_time
+
+    assert source_name == 'hedge_slow_backup' and data['data_source'] == 'hedge_slow_backup'
+    assert elapsed < 0.6, f"hedged fetch took {elapsed:.2f}s"
+    assert backup.calls[0] - primary.calls[0] >= 0.19  # 等到對沖延遲才啟動
+    stats = hedge_stats(collector)
+    assert stats['hedges_launched'] == 1 and stats['hedged_fetches'] == 1 and stats['hedge_wins'] == 1
+    print(f"   ✅ 對沖啟動正常（{elapsed:.2f}s）")
+
+def test_failed_primary_is_not_a_hedge():
+    """測試首選源失敗時立即請求下一個源，不計為對沖"""
+    print("🧪 測試失敗後切換...")
+    primary, backup = StubSource('hedge_failing_primary', 0.05, success=False), StubSource('hedge_next', 0.05)
+    collector = make_collector([primary, backup], hedge_delay=1.0)
+    start_time = time.time()
+    source_name, _ = collector._fetch_hedged('0700.HK', collector.data_sources)
+
+    assert source_name == 'hedge_next'
+    assert time.time() - start_time < 0.5
+    stats = hedge_stats(collector)
+    assert stats['hedges_launched'] == 0 and stats['hedged_fetches'] == 0 and stats['hedge_wins'] == 1
+    print("   ✅ 失敗後切換正常")
+
+def test_concurrency_cap():
+    """測試同時在途的請求不超過 max_concurrent"""
+    print("🧪 測試並發上限...")
+    stubs = [StubSource(f'hedge_cap_{i}', 0.4, success=False) for i in range(3)] + [StubSource('hedge_cap_ok', 0.05)]
+    collector = make_collector(stubs, hedge_delay=0.05, max_concurrent=2)
+    source_name, _ = collector._fetch_hedged('0700.HK', collector.data_sources)
+
+    assert source_name == 'hedge_cap_ok'
+    assert StubSource.max_in_flight == 2
+    # 第三個源要等前兩個中的一個結束才能啟動
+    assert stubs[2].calls[0] - stubs[0].calls[0] >= 0.39
+    assert hedge_stats(collector)['hedges_launched'] >= 1
+    print("   ✅ 並發上限正常")
+
+def test_queued_sources_not_called_after_winner():
+    """測試有結果後排隊中的數據源不再被調用"""
+    print("🧪 測試取消排隊請求...")
+    primary = StubSource('hedge_queue_primary', 0.3)
+    second = StubSource('hedge_queue_second', 1.0)
+    third = StubSource('hedge_queue_third', 0.01)
+    collector = make_collector([primary, second, third], hedge_delay=0.1, max_concurrent=2)
+    source_name, _ = collector._fetch_hedged('0700.HK', collector.data_sources)
+
+    assert source_name == 'hedge_queue_primary'
+    time.sleep(0.3)
+    assert len(second.calls) == 1
+    assert third.calls == []
+    stats = hedge_stats(collector)
+    assert stats['hedges_launched'] == 1 and stats['hedged_fetches'] == 1 and stats['hedge_wins'] == 0
+    print("   ✅ 取消排隊請求正常")
+
+def test_deadline_returns_failure():
+    """測試所有數據源都未在總超時內返回時返回失敗"""
+    print("🧪 測試總超時...")
+    stubs = [StubSource('hedge_deadline_a', 1.0), StubSource('hedge_deadline_b', 1.0)]
+    collector = make_collector(stubs, hedge_delay=0.05, hedge_timeout=0.3)
+    start_time = time.time()
+    result = collector._fetch_hedged('0700.HK', collector.data_sources)
+    elapsed = time.time() - start_time
+
+    assert result == (None, None)
+    assert 0.29 <= elapsed < 0.6, f"deadline took {elapsed:.2f}s"
+    stats = hedge_stats(collector)
+    assert stats['hedges_launched'] == 1 and stats['hedged_fetches'] == 0
+    print("   ✅ 總超時正常")
+
+def main():
+    """運行所有測試"""
+    print("🚀 多源對沖請求測試")
+    print("=" * 50)
+
+    tests = [
+        test_fast_primary_no_hedge,
+        test_slow_primary_is_hedged,
+        test_failed_primary_is_not_a_hedge,
+        test_concurrency_cap,
+        test_queued_sources_not_called_after_winner,
+        test_deadline_returns_failure
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"   ❌ {test.__name__} 失敗: {e}")
+
+    print("=" * 50)
+    print(f"📊 測試結果: {passed}/{len(tests)} 通過")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+數據源自適應排序測試
+直接測試 SourceRouter，不需要啟動服務器
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+# 測試不受全局配額限制（需在導入限速器之前設置）
+os.environ['RATE_LIMIT_GLOBAL_PER_MINUTE'] = '0'
+
+# 添加backend目錄到Python路徑
+backend_dir = Path(__file__).parent / "backend"
+sys.path.insert(0, str(backend_dir))
+
+from source_router import SourceRouter, market_of
+
+SOURCES = [
+    {'name': 'yahoo_finance', 'priority': 1, 'success_rate': 0.9},
+    {'name': 'alpha_vantage', 'priority': 2, 'success_rate': 0.8},
+    {'name': 'finnhub', 'priority': 3, 'success_rate': 0.7}
+]
+
+def names(sources):
+    return [s['name'] for s in sources]
+
+def test_market_of():
+    """測試市場劃分"""
+    print("🧪 測試市場劃分...")
+    assert market_of('0700.HK') == 'HK'
+    assert market_of('AAPL') == 'US'
+    assert market_of('VOD.L') == 'L'
+    print("   ✅ 市場劃分正常")
+
+def test_priors_keep_configured_order():
+    """測試沒有樣本時按先驗成功率和優先級排序"""
+    print("🧪 測試初始排序...")
+    router = SourceRouter()
+    assert names(router.rank(SOURCES, '0700.HK')) == ['yahoo_finance', 'alpha_vantage', 'finnhub']
+    print("   ✅ 初始排序正常")
+
+def test_failing_source_drifts_down():
+    """測試持續失敗的數據源排到後面"""
+    print("🧪 測試失敗降級...")
+    router = SourceRouter(alpha=0.3)
+    for _ in range(5):
+        router.record('yahoo_finance', '0700.HK', False, 0.2, prior_success=0.9)
+        router.record('alpha_vantage', '0700.HK', True, 0.5, prior_success=0.8)
+    assert names(router.rank(SOURCES, '0700.HK'))[:2] == ['alpha_vantage', 'finnhub']
+    print("   ✅ 失敗降級正常")
+
+def test_slow_source_drifts_down():
+    """測試成功但很慢的數據源排在快的數據源之後"""
+    print("🧪 測試延遲降級...")
+    router = SourceRouter(alpha=0.3)
+    for _ in range(5):
+        router.record('yahoo_finance', '0700.HK', True, 8.0, prior_success=0.9)
+        router.record('finnhub', '0700.HK', True, 0.3, prior_success=0.7)
+    ranked = names(router.rank(SOURCES, '0700.HK'))
+    assert ranked[0] == 'finnhub'
+    assert ranked[-1] == 'yahoo_finance'
+    print("   ✅ 延遲降級正常")
+
+def test_markets_are_scored_separately():
+    """測試港股上的失敗不影響美股排序"""
+    print("🧪 測試分市場評分...")
+    router = SourceRouter(alpha=0.5)
+    for _ in range(5):
+        router.record('yahoo_finance', '0700.HK', False, 1.0, prior_success=0.9)
+    assert names(router.rank(SOURCES, '0700.HK'))[0] != 'yahoo_finance'
+    assert names(router.rank(SOURCES, 'AAPL'))[0] == 'yahoo_finance'
+
+    stats = router.get_stats(SOURCES)
+    assert list(stats) == ['HK']
+    hk = {entry['name']: entry for entry in stats['HK']}
+    assert hk['yahoo_finance']['samples'] == 5
+    assert hk['yahoo_finance']['success_rate'] < 0.1
+    assert stats['HK'][-1]['name'] == 'yahoo_finance'
+    print("   ✅ 分市場評分正常")
+
+def test_degraded_source_recovers():
+    """測試降級的數據源隨時間恢復到先驗值，重新被嘗試"""
+    print("🧪 測試恢復...")
+    router = SourceRouter(alpha=0.5, recovery_half_life=0.05)
+    for _ in range(5):
+        router.record('yahoo_finance', '0700.HK', False, 1.0, prior_success=0.9)
+    assert names(router.rank(SOURCES, '0700.HK'))[0] != 'yahoo_finance'
+    time.sleep(0.5)
+    assert names(router.rank(SOURCES, '0700.HK'))[0] == 'yahoo_finance'
+    print("   ✅ 恢復正常")
+
+def test_quota_wait_not_counted_as_latency():
+    """測試首選源等待限速配額的時間不計入路由評分的耗時"""
+    print("🧪 測試配額等待不計入耗時...")
+    from multi_source_collector import MultiSourceDataCollector, source_router
+    from rate_limiter import rate_limiter
+
+    collector = MultiSourceDataCollector()
+    collector.data_sources = [{'name': 'router_wait', 'priority': 1, 'enabled': True, 'rate_limit': 120,
+                               'last_request': 0, 'success_rate': 0.9, 'fallback': False}]
+
+    def fetch(symbol):
+        if not collector._can_make_request('router_wait'):
+            return False, {}
+        time.sleep(0.05)
+        collector._update_source_stats('router_wait', True)
+        return True, {'symbol': symbol, 'current_price': 320.0}
+
+    collector.fetchers = {'router_wait': fetch}
+    # 每秒補充2個令牌，耗盡後下一次請求約需等待0.5秒
+    rate_limiter.configure('router_wait', 120, burst=1)
+    assert rate_limiter.try_acquire('router_wait')
+
+    latencies = []
+    source_router.record = lambda source, symbol, success, latency, prior_success=0.5: latencies.append(latency)
+    try:
+        start_time = time.time()
+        success, _ = collector._fetch_from_source('router_wait', '0700.HK', wait_for_quota=True)
+        elapsed = time.time() - start_time
+    finally:
+        del source_router.record
+
+    assert success and elapsed >= 0.4, f"fetch took {elapsed:.2f}s"
+    assert len(latencies) == 1 and latencies[0] < 0.2, f"recorded latency {latencies[0]:.2f}s"
+    print(f"   ✅ 總耗時 {elapsed:.2f}s，計入評分 {latencies[0]:.2f}s")
+
+def main():
+    """運行所有測試"""
+    print("🚀 數據源自適應排序測試")
+    print("=" * 50)
+
+    tests = [
+        test_market_of,
+        test_priors_keep_configured_order,
+        test_failing_source_drifts_down,
+        test_slow_source_drifts_down,
+        test_markets_are_scored_separately,
+        test_degraded_source_recovers,
+        test_quota_wait_not_counted_as_latency
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"   ❌ {test.__name__} 失敗: {e}")
+
+    print("=" * 50)
+    print(f"📊 測試結果: {passed}/{len(tests)} 通過")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
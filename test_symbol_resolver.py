@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+股票代碼變體解析緩存測試
+直接測試 SymbolResolver，不需要啟動服務器
+"""
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 添加backend目錄到Python路徑
+backend_dir = Path(__file__).parent / "backend"
+sys.path.insert(0, str(backend_dir))
+
+from symbol_resolver import SymbolResolver, is_not_found_error
+
+VARIANTS = ['0700.HK', '0700', '0700.HK', '0700.SI', '0700.TO', '0700.L', '0700.AX', '0700.PA']
+
+def probe(resolver, symbol, variants, working):
+    """模擬Yahoo探測流程，返回(成功的變體, 上游請求次數)"""
+    calls = 0
+    for variant in resolver.candidates(symbol, variants):
+        calls += 1
+        if variant == working:
+            resolver.record_success(symbol, variant)
+            return variant, calls
+        resolver.record_failure(symbol, variant)
+    return None, calls
+
+def test_candidates_deduplicate():
+    """測試沒有記錄時按原順序探測並去除重複變體"""
+    print("🧪 測試初始候選...")
+    with tempfile.TemporaryDirectory() as tmp:
+        resolver = SymbolResolver(os.path.join(tmp, 'cache_store.db'))
+        assert resolver.candidates('0700.HK', VARIANTS) == [
+            '0700.HK', '0700', '0700.SI', '0700.TO', '0700.L', '0700.AX', '0700.PA']
+        assert resolver.get_stats()['unresolved'] == 1
+    print("   ✅ 初始候選正常")
+
+def test_repeat_lookup_makes_one_call():
+    """測試解析成功後重複查詢只需要一次上游請求，並在重啟後保留"""
+    print("🧪 測試正向條目...")
+    with tempfile.TemporaryDirectory() as tmp:
+        store_path = os.path.join(tmp, 'cache_store.db')
+        resolver = SymbolResolver(store_path)
+        assert probe(resolver, '0700.HK', VARIANTS, '0700.L') == ('0700.L', 5)
+        assert probe(resolver, '0700.HK', VARIANTS, '0700.L') == ('0700.L', 1)
+
+        # 新實例模擬進程重啟
+        restarted = SymbolResolver(store_path)
+        assert restarted.resolve('0700.HK') == '0700.L'
+        assert probe(restarted, '0700.HK', VARIANTS, '0700.L') == ('0700.L', 1)
+        assert restarted.get_stats()['resolved_hits'] == 1
+    print("   ✅ 正向條目正常")
+
+def test_negative_entries_are_skipped():
+    """測試確認無效的變體被跳過，全部無效時不再探測"""
+    print("🧪 測試負向條目...")
+    with tempfile.TemporaryDirectory() as tmp:
+        resolver = SymbolResolver(os.path.join(tmp, 'cache_store.db'))
+        assert probe(resolver, '9999.HK', ['9999.HK', '9999'], None) == (None, 2)
+        assert resolver.candidates('9999.HK', ['9999.HK', '9999']) == []
+        assert resolver.get_stats()['negative_skips'] == 2
+    print("   ✅ 負向條目正常")
+
+def test_stale_positive_entry_falls_back():
+    """測試已知變體失效時撤銷正向條目並繼續探測其他變體"""
+    print("🧪 測試正向條目失效...")
+    with tempfile.TemporaryDirectory() as tmp:
+        resolver = SymbolResolver(os.path.join(tmp, 'cache_store.db'))
+        resolver.record_success('0700.HK', '0700.L')
+        assert probe(resolver, '0700.HK', VARIANTS, '0700.HK') == ('0700.HK', 2)
+        assert resolver.resolve('0700.HK') == '0700.HK'
+        assert '0700.L' not in resolver.candidates('0700.HK', VARIANTS)
+    print("   ✅ 正向條目失效正常")
+
+def test_negative_entries_expire():
+    """測試負向條目過期後重新探測"""
+    print("🧪 測試負向條目過期...")
+    with tempfile.TemporaryDirectory() as tmp:
+        resolver = SymbolResolver(os.path.join(tmp, 'cache_store.db'), negative_ttl=0.05)
+        resolver.record_failure('0700.HK', '0700.SI')
+        assert '0700.SI' not in resolver.candidates('0700.HK', VARIANTS)
+        time.sleep(0.06)
+        assert '0700.SI' in resolver.candidates('0700.HK', VARIANTS)
+    print("   ✅ 負向條目過期正常")
+
+def test_empty_response_keeps_symbol():
+    """測試一次空響應（例如上游限速）不會把代碼從候選中移除"""
+    print("🧪 測試空響應...")
+    with tempfile.TemporaryDirectory() as tmp:
+        resolver = SymbolResolver(os.path.join(tmp, 'cache_store.db'))
+        resolver.record_success('0700.HK', '0700.HK')
+        for variant in resolver.candidates('0700.HK', VARIANTS):
+            resolver.record_empty('0700.HK', variant)
+        assert resolver.candidates('0700.HK', VARIANTS)[0] == '0700.HK'
+        assert resolver.resolve('0700.HK') == '0700.HK'
+        assert len(resolver.candidates('0700.HK', VARIANTS)) == 7
+        assert resolver.get_stats()['negative_writes'] == 0
+    print("   ✅ 空響應正常")
+
+def test_repeated_empty_responses():
+    """測試變體連續多次空響應才寫負向條目，原始代碼永遠不寫，成功後計數清零"""
+    print("🧪 測試連續空響應...")
+    with tempfile.TemporaryDirectory() as tmp:
+        resolver = SymbolResolver(os.path.join(tmp, 'cache_store.db'), empty_threshold=3)
+        for _ in range(2):
+            resolver.record_empty('0700.HK', '0700.SI')
+        resolver.record_success('0700.HK', '0700.HK')
+        resolver.record_empty('0700.HK', '0700.SI')
+        assert '0700.SI' in resolver.candidates('0700.HK', VARIANTS)
+
+        for _ in range(5):
+            resolver.record_empty('0700.HK', '0700.HK')
+            resolver.record_empty('0700.HK', '0700.SI')
+        candidates = resolver.candidates('0700.HK', VARIANTS)
+        assert '0700.SI' not in candidates
+        assert '0700.HK' in candidates
+    print("   ✅ 連續空響應正常")
+
+def test_not_found_detection():
+    """測試只有404才算確認無效"""
+    print("🧪 測試錯誤分類...")
+    assert is_not_found_error(Exception('HTTP Error 404: Not Found'))
+    assert not is_not_found_error(Exception('Read timed out'))
+    # 消息中代碼的數字不是狀態碼
+    assert not is_not_found_error(TimeoutError('Read timed out fetching quoteSummary/0404.HK'))
+    assert not is_not_found_error(Exception('HTTP Error 502: Bad Gateway for url: .../quoteSummary/1404.HK'))
+    print("   ✅ 錯誤分類正常")
+
+def main():
+    """運行所有測試"""
+    print("🚀 代碼變體解析緩存測試")
+    print("=" * 50)
+
+    tests = [
+        test_candidates_deduplicate,
+        test_repeat_lookup_makes_one_call,
+        test_negative_entries_are_skipped,
+        test_stale_positive_entry_falls_back,
+        test_negative_entries_expire,
+        test_empty_response_keeps_symbol,
+        test_repeated_empty_responses,
+        test_not_found_detection
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"   ❌ {test.__name__} 失敗: {e}")
+
+    print("=" * 50)
+    print(f"📊 測試結果: {passed}/{len(tests)} 通過")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)